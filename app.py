@@ -1,12 +1,46 @@
 import os
 import re
+import sys
 import json
+import time
+import random
+import atexit
+import bisect
+import asyncio
+import contextlib
+import cProfile
+import functools
+import sqlite3
+import gzip
+import io
+import hashlib
+import tempfile
+import zipfile
+import queue
+import threading
+import concurrent.futures
+import multiprocessing
+import unicodedata
+import uuid
 import google.generativeai as genai
-from flask import Flask, jsonify, request, Response, render_template_string
+from flask import Flask, jsonify, request, Response, abort, g, has_request_context, send_file, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+try:
+    import fcntl  # Trava entre processos do single-flight (indisponível no Windows)
+except ImportError:
+    fcntl = None
+try:
+    import brotli  # Compressão 'br' do frontend (opcional: sem ela, só gzip)
+except ImportError:
+    brotli = None
+try:
+    import orjson  # Parsing mais rápido das respostas JSON do modelo (opcional)
+except ImportError:
+    orjson = None
 # NOVAS IMPORTAÇÕES PARA O MOTOR DE PDF
-from weasyprint import HTML, CSS
+import pdf_worker  # leve: o WeasyPrint só é importado na primeira renderização
 
 # --- 1. CONFIGURAÇÃO DA APLICAÇÃO FLASK E API GEMINI ---
 # (Toda a lógica do backend Python permanece inalterada)
@@ -15,76 +49,3182 @@ app = Flask(__name__)
 
 # Configuração da API Key
 API_KEY = os.environ.get('GOOGLE_API_KEY')
+# Backend do modelo: 'gemini' (padrão) ou 'fake', o modelo falso de
+# fake_model.py, para benchmarks sem rede e sem gastar cota.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')
+# O nome entra na chave do cache: respostas do modelo falso nunca se
+# misturam com as do Gemini.
+MODEL_NAME = os.environ.get('GEMINI_MODEL', 'gemini-flash-latest') if MODEL_BACKEND == 'gemini' else MODEL_BACKEND
 model = None
 
+def _gemini_model():
+    if not API_KEY:
+        print("!! ERRO FATAL: GOOGLE_API_KEY não encontrada no ambiente. !!")
+        return None
+    
+    try:
+        genai.configure(api_key=API_KEY)
+        gemini = genai.GenerativeModel(MODEL_NAME)
+        print(f"Modelo '{MODEL_NAME}' configurado com sucesso.")
+        return gemini
+    except Exception as e:
+        print(f"Erro ao configurar o '{MODEL_NAME}': {e}")
+        try:
+            print("Tentando fallback para 'gemini-flash-latest'...")
+            gemini = genai.GenerativeModel('gemini-flash-latest')
+            print("Modelo 'gemini-flash-latest' configurado com sucesso.")
+            return gemini
+        except Exception as e2:
+            print(f"Erro ao configurar 'gemini-flash-latest' também: {e2}")
+            return None
+
+def _fake_model():
+    import fake_model
+    fake = fake_model.FakeModel.from_env()
+    print(f"Modelo FALSO configurado ({fake.describe()}). Nenhuma chamada vai ao Gemini.")
+    return fake
+
+MODEL_BACKENDS = {
+    'gemini': _gemini_model,
+    'fake': _fake_model,
+}
+
 def get_model():
-    """Configura e retorna o modelo de IA. Lida com erros de chave."""
+    """Configura e retorna o modelo de IA do backend escolhido. Lida com erros de chave."""
     global model
     if model:
         return model
-    
-    if not API_KEY:
-        print("!! ERRO FATAL: GOOGLE_API_KEY não encontrada no ambiente. !!")
+
+    factory = MODEL_BACKENDS.get(MODEL_BACKEND)
+    if factory is None:
+        print(f"!! ERRO FATAL: MODEL_BACKEND '{MODEL_BACKEND}' desconhecido (use {', '.join(MODEL_BACKENDS)}). !!")
         return None
-    
+    model = factory()
+    return model
+
+
+# --- 1.1 CACHE DE RESPOSTAS DA IA (MEMÓRIA + SQLITE) ---
+# Muitos prompts se repetem durante uma aula (mesma palavra, mesmo tema).
+# O cache tem dois níveis: um LRU em memória (por processo) e um SQLite em
+# disco (compartilhado entre os workers do gunicorn).
+
+# TTL (em segundos) por endpoint. Pode ser sobrescrito por variável de
+# ambiente, ex: AI_CACHE_TTL_RHYMES=3600. TTL 0 desliga o cache do endpoint.
+AI_CACHE_TTLS = {
+    'themes': 60 * 30,
+    'ideas': 60 * 60 * 24,
+    'rhymes': 60 * 60 * 24 * 7,
+    'check': 60 * 60 * 24,
+    'verse': 60 * 60 * 24,
+    'pdf_style': 60 * 60 * 24 * 7,
+}
+for _scope in AI_CACHE_TTLS:
+    _env_ttl = os.environ.get(f'AI_CACHE_TTL_{_scope.upper()}')
+    if _env_ttl is not None:
+        AI_CACHE_TTLS[_scope] = int(_env_ttl)
+
+AI_CACHE_ENABLED = os.environ.get('AI_CACHE_ENABLED', '1') != '0'
+AI_CACHE_MEMORY_ITEMS = int(os.environ.get('AI_CACHE_MEMORY_ITEMS', 2000))
+AI_CACHE_DISK_MAX_BYTES = int(os.environ.get('AI_CACHE_DISK_MAX_BYTES', 50 * 1024 * 1024))
+AI_CACHE_DB_PATH = os.environ.get(
+    'AI_CACHE_DB_PATH', os.path.join(tempfile.gettempdir(), 'oficina_ai_cache.sqlite3')
+)
+
+
+class AIResponseCache:
+    """Cache em dois níveis (LRU em memória + SQLite em disco) com TTL."""
+
+    def __init__(self, db_path, memory_items, disk_max_bytes):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._disk_ok = True
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def make_key(prompt_text, model_name, force_json):
+        """Chave estável: prompt normalizado + nome do modelo + force_json.
+
+        Só os espaços são normalizados: maiúsculas mudam a resposta (um poema
+        revisado com "Sol" não é o mesmo que com "sol").
+        """
+        normalized = re.sub(r'\s+', ' ', prompt_text).strip()
+        raw = f"{model_name}|{int(bool(force_json))}|{normalized}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ai_cache_last_access ON ai_cache (last_access)")
+            self._local.conn = conn
+        return conn
+
+    def _memory_put(self, key, expires_at, value):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+                self.stats['memory_evictions'] += 1
+
+    def get(self, key):
+        """Retorna (True, valor) em caso de acerto, ou (False, None)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return True, entry[1]
+                del self._memory[key]
+
+        if self._disk_ok:
+            try:
+                conn = self._db()
+                row = conn.execute(
+                    "SELECT value, expires_at FROM ai_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        conn.execute("UPDATE ai_cache SET last_access = ? WHERE key = ?", (now, key))
+                        value = json.loads(row[0])
+                        self._memory_put(key, row[1], value)
+                        with self._lock:
+                            self.stats['disk_hits'] += 1
+                        return True, value
+                    conn.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return False, None
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._memory_put(key, expires_at, value)
+        with self._lock:
+            self.stats['stores'] += 1
+
+        if self._disk_ok:
+            try:
+                payload = json.dumps(value, ensure_ascii=False)
+                now = time.time()
+                conn = self._db()
+                conn.execute(
+                    "INSERT OR REPLACE INTO ai_cache (key, value, expires_at, last_access, size)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, expires_at, now, len(payload)),
+                )
+                self._evict_disk(conn, now)
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+
+    def _evict_disk(self, conn, now):
+        """Remove expirados e, se preciso, os menos acessados até caber no limite."""
+        conn.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        excess = total - self.disk_max_bytes
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM ai_cache ORDER BY last_access").fetchall():
+            conn.execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+            removed += 1
+            excess -= size
+            if excess <= 0:
+                break
+        with self._lock:
+            self.stats['disk_evictions'] += removed
+
+    def _disable_disk(self, error):
+        print(f"Cache em disco desativado (usando apenas memória). Erro: {error}")
+        self._disk_ok = False
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_items'] = len(self._memory)
+        hits = stats.get('memory_hits', 0) + stats.get('disk_hits', 0)
+        total = hits + stats.get('misses', 0)
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['disk_enabled'] = self._disk_ok
+        return stats
+
+
+ai_cache = AIResponseCache(AI_CACHE_DB_PATH, AI_CACHE_MEMORY_ITEMS, AI_CACHE_DISK_MAX_BYTES)
+
+
+# --- 1.2 CAMINHO ASSÍNCRONO PARA AS CHAMADAS AO MODELO ---
+# As chamadas ao Gemini rodam num event loop dedicado (uma thread por
+# processo) usando `generate_content_async`. Os handlers só submetem a
+# corrotina e esperam o resultado, então a espera de rede não prende o
+# interpretador e um único processo (gunicorn com worker 'gthread', ver
+# gunicorn.conf.py) mantém centenas de chamadas em voo. O semáforo limita
+# quantas chamadas podem estar abertas ao mesmo tempo.
+
+LLM_ASYNC_ENABLED = os.environ.get('LLM_ASYNC_ENABLED', '1') != '0'
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 256))
+
+
+class AsyncLLMRunner:
+    """Event loop em thread própria para as chamadas assíncronas ao modelo."""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._semaphore = None
+
+    def _ensure_loop(self):
+        # O PID é conferido porque o gunicorn faz fork: threads não sobrevivem
+        # ao fork, então cada worker precisa do seu próprio loop.
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=run, name='llm-event-loop', daemon=True).start()
+                ready.wait()
+                self.in_flight = 0
+                self._loop = loop
+                self._pid = os.getpid()
+        return self._loop
+
+    async def _generate(self, model, prompt_text, generation_config):
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                if hasattr(model, 'generate_content_async'):
+                    return await model.generate_content_async(prompt_text, generation_config=generation_config)
+                # Modelos sem API assíncrona rodam no pool de threads do loop.
+                call = functools.partial(model.generate_content, prompt_text, generation_config=generation_config)
+                return await asyncio.get_running_loop().run_in_executor(None, call)
+            finally:
+                self.in_flight -= 1
+
+    def submit(self, model, prompt_text, generation_config):
+        """Agenda a chamada no loop e retorna um `concurrent.futures.Future`."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._generate(model, prompt_text, generation_config), loop)
+
+    def generate(self, model, prompt_text, generation_config):
+        return self.submit(model, prompt_text, generation_config).result()
+
+    async def _stream(self, model, prompt_text, generation_config, sink):
+        async with self._semaphore:
+            self.in_flight += 1
+            usage = None
+            try:
+                if hasattr(model, 'generate_content_async'):
+                    response = await model.generate_content_async(
+                        prompt_text, generation_config=generation_config, stream=True)
+                    async for chunk in response:
+                        sink.put(('chunk', _chunk_text(chunk)))
+                        usage = getattr(chunk, 'usage_metadata', None) or usage
+                else:
+                    def run():
+                        last_usage = None
+                        for chunk in model.generate_content(prompt_text, generation_config=generation_config, stream=True):
+                            sink.put(('chunk', _chunk_text(chunk)))
+                            last_usage = getattr(chunk, 'usage_metadata', None) or last_usage
+                        return last_usage
+                    usage = await asyncio.get_running_loop().run_in_executor(None, run)
+                sink.put(('done', usage))
+            except Exception as e:
+                sink.put(('error', e))
+            finally:
+                self.in_flight -= 1
+
+    def stream(self, model, prompt_text, generation_config, idle_timeout=None, on_usage=None):
+        """Gerador (síncrono) com os pedaços de texto da resposta, à medida que chegam.
+
+        `idle_timeout` é o maior intervalo aceito entre dois pedaços;
+        `on_usage` recebe o usage_metadata do último pedaço, no fim.
+        """
+        loop = self._ensure_loop()
+        sink = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._stream(model, prompt_text, generation_config, sink), loop)
+        try:
+            while True:
+                try:
+                    kind, payload = sink.get(timeout=idle_timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"O modelo parou de responder por {idle_timeout:.0f}s.")
+                if kind == 'chunk':
+                    yield payload
+                elif kind == 'error':
+                    raise payload
+                else:
+                    if on_usage is not None:
+                        on_usage(payload)
+                    return
+        finally:
+            # Cliente desconectou no meio: cancela a chamada no loop.
+            future.cancel()
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Pedaço sem texto (ex.: só metadados de segurança).
+        return ''
+
+
+llm_runner = AsyncLLMRunner(LLM_MAX_CONCURRENCY)
+
+
+# --- 1.3 SINGLE-FLIGHT: CHAMADAS IDÊNTICAS EM VOO VIRAM UMA SÓ ---
+# Quando a turma inteira pede o mesmo tema no mesmo segundo, só a primeira
+# requisição (a "líder") chama o modelo; as outras esperam o resultado dela.
+# Entre threads do mesmo worker isso usa um Future em memória. Entre workers,
+# opcionalmente, a líder segura uma trava de arquivo (fcntl) e as demais, ao
+# conseguir a trava, encontram a resposta já gravada no cache em disco.
+
+SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', '1') != '0'
+SINGLE_FLIGHT_CROSS_PROCESS = os.environ.get('SINGLE_FLIGHT_CROSS_PROCESS', '0') == '1'
+SINGLE_FLIGHT_LOCK_DIR = os.environ.get(
+    'SINGLE_FLIGHT_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'oficina_singleflight')
+)
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_LOCK_TIMEOUT', 30))
+
+
+class FlightAbandoned(Exception):
+    """A líder largou a chamada sem resultado (o cliente do stream desconectou)."""
+
+
+class SingleFlight:
+    """Agrupa chamadas concorrentes com a mesma chave numa única execução."""
+
+    def __init__(self, lock_dir, lock_timeout):
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def enter(self, key):
+        """Retorna (future, líder). Quem é líder precisa resolver o future e chamar `leave`."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+                self.stats['leaders'] += 1
+            else:
+                self.stats['collapsed'] += 1
+        return future, leader
+
+    def leave(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key, fn):
+        """Executa `fn()` uma vez por chave em voo; as demais chamadas reaproveitam o resultado."""
+        while True:
+            future, leader = self.enter(key)
+            if leader:
+                break
+            try:
+                with phase('single_flight'):
+                    return future.result()
+            except FlightAbandoned:
+                continue  # A líder desistiu: tenta de novo (talvez como líder).
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self.leave(key, future)
+
+    def process_lock(self, key):
+        """Trava de arquivo por chave, compartilhada entre os workers do gunicorn."""
+        return _FileFlightLock(self, os.path.join(self.lock_dir, f"{key[:32]}.lock"))
+
+    def record(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class _FileFlightLock:
+    """Context manager com `flock` e prazo máximo de espera (é só otimização:
+    se o prazo estourar, a chamada segue sem a trava)."""
+
+    def __init__(self, flight, path):
+        self.flight = flight
+        self.path = path
+        self._fd = None
+        self.waited = False
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        deadline = time.monotonic() + self.flight.lock_timeout
+        while True:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+            except OSError as e:
+                print(f"Single-flight entre processos indisponível: {e}")
+                return self
+            if not self._lock(fd, deadline):
+                return self
+            # Quem solta a trava apaga o arquivo; se ele sumiu (ou já é outro)
+            # entre o open e o flock, travamos um inode órfão: abre de novo.
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    self._fd = fd
+                    return self
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _lock(self, fd, deadline):
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                self.waited = True
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    return False
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+
+
+single_flight = SingleFlight(SINGLE_FLIGHT_LOCK_DIR, SINGLE_FLIGHT_LOCK_TIMEOUT)
+
+
+def generate_ai_content(prompt_text, force_json=False, cache_scope=None, validate=None, timeout=None):
+    """Função central para chamadas de IA, com cache, retry e parsing de JSON.
+
+    `cache_scope` identifica o endpoint (chave de AI_CACHE_TTLS); sem ele a
+    resposta não é cacheada. `validate` recebe o resultado e decide se ele
+    pode ir para o cache (respostas fora do formato nunca são guardadas).
+    `timeout` sobrepõe o prazo do endpoint (LLM_TIMEOUTS). Chamadas idênticas
+    simultâneas são agrupadas (single-flight).
+    """
+    ttl = AI_CACHE_TTLS.get(cache_scope, 0) if AI_CACHE_ENABLED else 0
+    key = AIResponseCache.make_key(prompt_text, MODEL_NAME, force_json)
+    if ttl > 0:
+        hit, cached = ai_cache.get(key)
+        if hit:
+            return cached
+
+    def call_and_store():
+        result, complete = _generate_ai_content_uncached(prompt_text, force_json, cache_scope, timeout)
+        # JSON reparado (resposta cortada) serve para esta requisição, mas não vai ao cache.
+        if ttl > 0 and complete:
+            with phase('validate'):
+                valid = validate is None or validate(result)
+            if valid:
+                ai_cache.set(key, result, ttl)
+        return result
+
+    def call_across_processes():
+        # Só faz sentido com cache: é pelo SQLite que o resultado chega aos outros workers.
+        with single_flight.process_lock(key) as lock:
+            if lock.waited:
+                hit, cached = ai_cache.get(key)
+                if hit:
+                    single_flight.record('collapsed_cross_process')
+                    return cached
+            return call_and_store()
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return call_and_store()
+    if SINGLE_FLIGHT_CROSS_PROCESS and ttl > 0:
+        return single_flight.do(key, call_across_processes)
+    return single_flight.do(key, call_and_store)
+
+
+def _generate_ai_content_uncached(prompt_text, force_json=False, scope=None, timeout=None):
+    """Chamada direta ao modelo, sem passar pelo cache.
+
+    Retorna (resultado, completo); `completo` é False quando o JSON veio
+    cortado e foi reparado (ver extract_json).
+    """
+    model = get_model()
+    if model is None:
+        raise Exception("Modelo de IA não inicializado. Verifique a API Key e as permissões no Google Cloud.")
+
+    try:
+        generation_config = {}
+        if force_json:
+            generation_config["response_mime_type"] = "application/json"
+
+        response = call_model(model, prompt_text, generation_config, scope, timeout)
+        
+        with phase('parse'):
+            text = response.text
+            
+            # Só tenta JSON quando a resposta começa como JSON (CSS também tem '{').
+            stripped = text.strip()
+            looks_like_json = stripped.startswith(('[', '{')) or re.match(r'```\s*json', stripped, re.IGNORECASE)
+            if force_json or looks_like_json:
+                try:
+                    value, repaired = extract_json(text)
+                except JsonExtractionError:
+                    metrics.inc('oficina_llm_json_parse_failures_total', scope=scope or 'other')
+                    raise
+                if repaired:
+                    print(f"[JSON] Resposta cortada; aproveitando os elementos completos ({scope or 'sem escopo'}).")
+                    metrics.inc('oficina_llm_json_repairs_total', scope=scope or 'other')
+                return value, not repaired
+            
+            return text, True
+
+    except (LLMRateLimited, LLMUnavailable, TimeoutError):
+        raise
+    except Exception as e:
+        print(f"Erro na geração de conteúdo da IA: {e}")
+        error_message = str(e)
+        if "is not found" in error_message:
+             print("!! ERRO 404 DETECTADO: Verifique o nome do modelo e as permissões da API Key !!")
+             raise Exception(f"Erro 404 da API Gemini: {error_message}") from e
+        
+        raise Exception(f"Falha ao gerar ou processar resposta da IA: {error_message}") from e
+
+
+# Extração do JSON da resposta: o modelo às vezes embrulha o JSON em ```json,
+# escreve uma frase antes ou depois, ou é cortado no meio (limite de tokens).
+# Uma única varredura, que pula direto de um caractere estrutural para o
+# próximo, acha o primeiro valor JSON balanceado (respeitando strings e
+# escapes) e ignora o que vier depois; um colchete de prosa que não abre JSON
+# é pulado. Se o texto acabar antes de o valor fechar, ele é reparado: ficam
+# os elementos completos (e o texto de um valor cortado, com a aspa fechada) e
+# fecha-se a lista ou objeto externo. Com o orjson instalado, o parsing usa ele.
+
+_JSON_STRUCTURAL_RE = re.compile(r'["\\\[\]{},:]')
+_JSON_OPENER_RE = re.compile(r'[\[{]')
+# Quantos '[' / '{' de prosa são pulados antes de desistir da resposta.
+JSON_MAX_CANDIDATES = 8
+_JSON_CLOSERS = {'[': ']', '{': '}'}
+
+
+class JsonExtractionError(ValueError):
+    """Não há um valor JSON aproveitável no texto."""
+
+    def __init__(self, message, end=None):
+        super().__init__(message)
+        self.end = end  # fim do candidato descartado, se ele fechou
+
+
+def json_loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def extract_json(text, repair=True):
+    """Primeira lista ou objeto JSON do texto. Retorna (valor, reparado).
+
+    Também serve para um texto parcial (ex.: o buffer de um stream): com
+    `repair`, devolve o que já está completo. Um '[' ou '{' que não abre JSON
+    ("a lista [abaixo]: [...]") é pulado em favor do próximo. Levanta
+    JsonExtractionError se não houver JSON ou se ele não tiver conserto.
+    """
+    stripped = text.strip()
+    if stripped[:1] in ('[', '{'):
+        # Caso comum (response_mime_type JSON): o texto já é o JSON, sem varredura.
+        try:
+            return json_loads(stripped), False
+        except ValueError:
+            pass
+    error = JsonExtractionError("A resposta não contém JSON.")
+    position = 0
+    for _ in range(JSON_MAX_CANDIDATES):
+        first = _JSON_OPENER_RE.search(text, position)
+        if first is None:
+            break
+        try:
+            return _scan_json(text, first.start(), repair)
+        except JsonExtractionError as e:
+            error = e
+            if e.end is None:
+                break  # Chegou ao fim do texto sem fechar: não há candidato depois.
+            position = e.end
+    raise error
+
+
+def _scan_json(text, start, repair):
+    depth = 0
+    closer = _JSON_CLOSERS[text[start]]
+    in_string = False
+    escaped_at = -1  # posição do caractere escapado por uma barra
+    cut = None  # fim do último elemento completo da lista/objeto externo
+    in_value = False  # no objeto externo, depois do ':' (a string é um valor)
+    for match in _JSON_STRUCTURAL_RE.finditer(text, start):
+        i = match.start()
+        if i == escaped_at:
+            continue
+        c = match.group()
+        if in_string:
+            if c == '\\':
+                escaped_at = i + 1
+            elif c == '"':
+                in_string = False
+                if depth == 1 and (closer == ']' or in_value):
+                    cut = i + 1
+            continue
+        if c == '"':
+            in_string = True
+        elif c in '[{':
+            depth += 1
+        elif c in ']}':
+            depth -= 1
+            if depth == 0:
+                try:
+                    return json_loads(text[start:i + 1]), False
+                except ValueError as e:
+                    raise JsonExtractionError(f"JSON inválido na resposta: {e}", end=i + 1) from e
+            if depth == 1:
+                cut = i + 1
+        elif depth == 1 and c == ',':
+            cut = i
+            in_value = False
+        elif depth == 1 and c == ':':
+            in_value = True
+
+    suffix = closer
+    if in_string and depth == 1 and closer == '}' and in_value:
+        # Valor de texto cortado no meio: fecha a string e aproveita o que veio.
+        cut, suffix = len(text), '"' + closer
+        if escaped_at == len(text):
+            cut -= 1  # Barra solta no fim escaparia a aspa que fecha.
+    # Sem nenhum elemento completo não há o que aproveitar.
+    if not repair or cut is None or cut <= start:
+        raise JsonExtractionError("A resposta não contém um JSON completo.")
+    try:
+        return json_loads(text[start:cut] + suffix), True
+    except ValueError as e:
+        raise JsonExtractionError(f"JSON cortado sem conserto: {e}") from e
+
+
+# --- 1.4 LÉXICO PT-BR E MOTOR FONÉTICO DE RIMAS ---
+# Conversão grafema-fonema simplificada do português brasileiro: acha a sílaba
+# tônica, decide o timbre (aberto/fechado) e transcreve da vogal tônica até o
+# fim da palavra. Essa transcrição é a "chave de rima": palavras com a mesma
+# chave rimam. O índice chave -> palavras é montado uma vez por processo.
+
+LEXICON_PATH = os.environ.get(
+    'LEXICON_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexico_ptbr.txt')
+)
+RHYME_MAX_RESULTS = int(os.environ.get('RHYME_MAX_RESULTS', 12))
+# Só palavras razoavelmente comuns são sugeridas como rima para os alunos.
+RHYME_MIN_FREQUENCY = int(os.environ.get('RHYME_MIN_FREQUENCY', 300))
+RHYME_DEFINITIONS = os.environ.get('RHYME_DEFINITIONS', '1') != '0'
+
+# Palavras que nunca devem aparecer como sugestão para alunos de 11-13 anos.
+RHYME_BLOCKLIST = {
+    'merda', 'porra', 'caralho', 'cacete', 'puta', 'putas', 'puto', 'foda', 'fodas',
+    'foder', 'fodido', 'fodida', 'cu', 'bunda', 'buceta', 'piroca', 'pica', 'rola',
+    'viado', 'bicha', 'vadia', 'vagabunda', 'safada', 'safado', 'corno', 'otário',
+    'idiota', 'imbecil', 'babaca', 'desgraça', 'desgraçado', 'maldito', 'maldita',
+    'droga', 'drogas', 'cocaína', 'matar', 'morto', 'morta', 'sangue', 'cadáver',
+    'sexo', 'sexy', 'tesão', 'estupro', 'bosta', 'cagar', 'mijar', 'peido',
+    'assassino', 'assassina', 'assassinato', 'suicídio', 'nazi', 'nazis', 'bêbado', 'bêbada',
+    'pistola', 'pistolas', 'arma', 'armas',
+}
+
+# Palavras átonas (artigos, preposições, conjunções e pronomes oblíquos): não
+# têm sílaba tônica própria, então não rimam ('você' não rima com 'que' nem
+# 'se'). As formas tônicas ('quê', 'porquê', 'pôr', 'dê') continuam no índice.
+RHYME_FUNCTION_WORDS = {
+    'o', 'a', 'os', 'as', 'um', 'uns', 'de', 'do', 'da', 'dos', 'das', 'em', 'no', 'na', 'nos', 'nas',
+    'num', 'numa', 'ao', 'aos', 'à', 'às', 'por', 'pelo', 'pela', 'pelos', 'pelas', 'com', 'sem',
+    'pra', 'pro', 'pras', 'pros', 'e', 'ou', 'nem', 'mas', 'que', 'se', 'porque', 'me', 'te',
+    'lhe', 'lhes', 'vos', 'lo', 'la', 'los', 'las', 'mo', 'ma', 'mos',
+}
+
+_WORD_RE = re.compile(r"[a-zà-öø-ÿç]+(?:-[a-zà-öø-ÿç]+)*", re.IGNORECASE)
+_VOWEL_CHARS = set('aeiouáéíóúâêôãõàü')
+_FRONT_VOWELS = set('eiéêí')
+_ACCENTED_STRESS = {'á': 'a', 'é': 'E', 'í': 'i', 'ó': 'O', 'ú': 'u', 'â': 'a', 'ê': 'e', 'ô': 'o'}
+_NASALIZE = {'a': 'ã', 'e': 'ẽ', 'E': 'ẽ', 'i': 'ĩ', 'o': 'õ', 'O': 'õ', 'u': 'ũ', 'ã': 'ã', 'õ': 'õ'}
+_BASE_VOWEL = {'á': 'a', 'à': 'a', 'â': 'a', 'ã': 'a', 'é': 'e', 'ê': 'e', 'í': 'i',
+               'ó': 'o', 'ô': 'o', 'õ': 'o', 'ú': 'u', 'ü': 'u'}
+# O 'x' no meio da palavra costuma soar 'ch' (caixa, lixo, roxo), mas tem
+# exceções que nenhuma regra de vizinhança separa: 'ks' em táxi e fixo,
+# 's' em próximo. Radicais com o 'x' em questão.
+_X_EXCEPTIONS = (
+    ('táxi', 'ks'), ('taxis', 'ks'), ('tóxic', 'ks'), ('toxic', 'ks'), ('oxig', 'ks'),
+    ('paradox', 'ks'), ('ortodox', 'ks'), ('fix', 'ks'), ('sex', 'ks'), ('nex', 'ks'),
+    ('plex', 'ks'), ('flex', 'ks'), ('flux', 'ks'), ('box', 'ks'), ('léxic', 'ks'),
+    ('lexic', 'ks'), ('axil', 'ks'), ('máxim', 's'), ('maxim', 's'), ('próxim', 's'),
+    ('proxim', 's'), ('auxíli', 's'), ('auxili', 's'), ('trouxe', 's'), ('sintax', 's'),
+)
+
+
+class _Lexicon:
+    """Léxico PT-BR carregado sob demanda: palavra -> (frequência, pronúncia)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.words = {}
+        self.rhyme_index = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return self
+        with self._lock:
+            if self._loaded:
+                return self
+            start = time.perf_counter()
+            words = {}
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    for line in f:
+                        if not line.strip() or line.startswith('#'):
+                            continue
+                        parts = line.split()
+                        freq = int(parts[1]) if len(parts) > 1 else 1
+                        pron = parts[2] if len(parts) > 2 else None
+                        words[parts[0]] = (freq, pron)
+            except OSError as e:
+                print(f"Léxico PT-BR não encontrado em '{self.path}': {e}")
+
+            index = defaultdict(list)
+            for word, (freq, pron) in words.items():
+                if (freq < RHYME_MIN_FREQUENCY or word in RHYME_BLOCKLIST or word in RHYME_FUNCTION_WORDS
+                        or '-' in word):
+                    continue
+                key = ptbr_rhyme_key(pron or word)
+                if key:
+                    index[key].append((freq, word))
+            for entries in index.values():
+                entries.sort(key=lambda e: (-e[0], e[1]))
+
+            self.words = words
+            self.rhyme_index = dict(index)
+            self._loaded = True
+            print(f"Léxico PT-BR carregado: {len(words)} palavras, "
+                  f"{len(self.rhyme_index)} chaves de rima em {time.perf_counter() - start:.2f}s.")
+        return self
+
+    def frequency(self, word):
+        entry = self.words.get(word)
+        return entry[0] if entry else 0
+
+    def pronunciation(self, word):
+        entry = self.words.get(word)
+        return (entry[1] or word) if entry else word
+
+
+lexicon = _Lexicon(LEXICON_PATH)
+
+
+def _segment_word(word):
+    """Quebra a grafia em segmentos ('V' vogal / 'C' consoante) tratando dígrafos."""
+    segments = []
+    i = 0
+    n = len(word)
+    while i < n:
+        ch = word[i]
+        nxt = word[i + 1] if i + 1 < n else ''
+        after = word[i + 2] if i + 2 < n else ''
+        if ch in ('q', 'g') and nxt in ('u', 'ü') and after in _VOWEL_CHARS:
+            # 'qu'/'gu' + vogal: o 'u' é mudo (antes de e/i) ou semivogal (antes de a/o).
+            glide = 'w' if (after not in _FRONT_VOWELS or nxt == 'ü') else ''
+            segments.append(('C', ('k' if ch == 'q' else 'g') + glide, i))
+            i += 2
+            continue
+        if ch in _VOWEL_CHARS:
+            segments.append(('V', ch, i))
+        elif ch == 'y':
+            segments.append(('V', 'i', i))
+        elif ch in 'cls' and nxt == 'h' or ch == 'n' and nxt == 'h':
+            segments.append(('C', ch + 'h', i))
+            i += 2
+            continue
+        elif ch in 'rs' and nxt == ch:
+            segments.append(('C', ch + ch, i))
+            i += 2
+            continue
+        elif ch in 'sx' and nxt in ('c', 'ç') and (nxt == 'ç' or after in _FRONT_VOWELS):
+            segments.append(('C', 'sc', i))
+            i += 2
+            continue
+        elif ch.isalpha():
+            segments.append(('C', ch, i))
+        i += 1
+    return segments
+
+
+def _is_hiatus_glide_position(segments, j):
+    """True quando i/u após vogal forma hiato (ra-i-nha, a-in-da, ju-iz, ru-im)."""
+    rest = segments[j + 1:]
+    if not rest:
+        return False
+    first = rest[0]
+    if first[0] != 'C':
+        return False
+    if first[1] == 'nh':
+        return True
+    if first[1] in ('m', 'n'):
+        return len(rest) == 1 or rest[1][0] == 'C'
+    if first[1] in ('r', 'l', 'z') and len(rest) == 1:
+        return True
+    return False
+
+
+def _nuclei(segments):
+    """Marca semivogais e retorna os índices (em `segments`) dos núcleos silábicos."""
+    glides = set()
+    nuclei = []
+    for j, (kind, ch, _) in enumerate(segments):
+        if kind != 'V':
+            continue
+        prev = segments[j - 1] if j > 0 else None
+        prev_is_nucleus = prev is not None and prev[0] == 'V' and (j - 1) not in glides
+        if prev_is_nucleus:
+            following = segments[j + 1][1] if j + 1 < len(segments) else ''
+            # i/u entre vogais é semivogal (prai-a, fei-o), exceto antes de outra
+            # i/u, quando vira núcleo (ca-iu, sa-iu).
+            if (ch in ('i', 'u') and following not in ('i', 'u', 'í', 'ú')
+                    and not _is_hiatus_glide_position(segments, j)):
+                glides.add(j)
+                continue
+            if prev[1] in ('ã', 'õ') and ch in ('o', 'e'):
+                glides.add(j)
+                continue
+        nuclei.append(j)
+    return nuclei, glides
+
+
+def _stressed_nucleus(word, segments, nuclei):
+    for j in nuclei:
+        if segments[j][1] in _ACCENTED_STRESS:
+            return j
+    tilde = [j for j in nuclei if segments[j][1] in ('ã', 'õ')]
+    if tilde:
+        return tilde[-1]
+    if len(nuclei) == 1:
+        return nuclei[0]
+    if re.search(r'(a|e|o|as|es|os|am|em|ens)$', word):
+        return nuclei[-2]
+    return nuclei[-1]
+
+
+def _default_timbre(vowel, tail, word):
+    """Timbre da vogal tônica e/o sem acento gráfico, por regras de terminação.
+
+    Retorna 'E'/'O' (aberto) ou 'e'/'o' (fechado). Exceções vêm do léxico
+    (coluna de pronúncia), ex: 'boca 32441 bôca'.
+    """
+    closed, open_ = (vowel, vowel.upper())
+    if not tail:
+        return closed
+    if vowel == 'o' and tail.startswith('ia'):
+        return open_  # joia, boia, apoia
+    if tail[0] in 'mn' or tail[0] in 'iu':
+        return closed
+    if tail in ('l', 'ls'):
+        return open_
+    if tail in ('r', 'rs'):
+        return closed
+    if tail == 'z':
+        return closed if vowel == 'e' else open_
+    last = tail.rstrip('s')[-1:] if tail.rstrip('s') else ''
+    if vowel == 'o':
+        if last == 'o':
+            return closed
+        if last == 'a':
+            return closed if re.search(r'[dts]oras?$', word) else open_
+        if last == 'e':
+            return open_
+        return closed
+    # vogal 'e'
+    if tail.startswith('rr') or (tail[0] == 'r' and len(tail) > 1 and tail[1] not in _VOWEL_CHARS
+                                 and tail[1] != 'd'):
+        return open_
+    if tail.startswith('st'):
+        return open_
+    core = tail.rstrip('s')
+    if last == 'a':
+        if core.endswith(('ta', 'sa', 'za', 'ça', 'lha', 'ssa', 'ja', 'da', 'xa')):
+            return closed
+        return open_
+    if last == 'o':
+        return open_ if core.endswith(('lo', 'ro')) else closed
+    if last == 'e':
+        return open_ if core.endswith('ve') else closed
+    return closed
+
+
+def _x_exception(word, pos):
+    """Som do 'x' na posição `pos` quando ele cai num radical de _X_EXCEPTIONS."""
+    for stem, phone in _X_EXCEPTIONS:
+        start = pos - stem.index('x')
+        if start >= 0 and word.startswith(stem, start):
+            return phone
+    return None
+
+
+def ptbr_phonemes(word):
+    """Transcreve a palavra e retorna (fonemas, índice do fonema tônico)."""
+    word = word.lower()
+    segments = _segment_word(word)
+    nuclei, glides = _nuclei(segments)
+    if not nuclei:
+        return [], -1
+    stressed = _stressed_nucleus(word, segments, nuclei)
+    last_nucleus = nuclei[-1]
+
+    phones = []
+    stress_phone = -1
+    count = len(segments)
+    for j, (kind, ch, pos) in enumerate(segments):
+        prev = segments[j - 1] if j > 0 else None
+        nxt = segments[j + 1] if j + 1 < count else None
+        next_is_vowel = nxt is not None and nxt[0] == 'V'
+        prev_is_vowel = prev is not None and prev[0] == 'V'
+
+        if kind == 'V':
+            if j in glides:
+                if ch in ('u', 'o'):
+                    # 'ou' vira 'o' fechado na fala (falou ~ falô).
+                    if phones and phones[-1] == 'o' and ch == 'u':
+                        continue
+                    phones.append('w')
+                else:
+                    phones.append('j')
+                continue
+            if j == stressed:
+                if ch in _ACCENTED_STRESS:
+                    phone = _ACCENTED_STRESS[ch]
+                elif ch in ('e', 'o'):
+                    tail = word[pos + 1:]
+                    phone = _default_timbre(ch, tail, word)
+                elif ch in ('ã', 'õ'):
+                    phone = ch
+                else:
+                    phone = _BASE_VOWEL.get(ch, ch)
+                stress_phone = len(phones)
+            else:
+                phone = _BASE_VOWEL.get(ch, ch) if ch not in ('ã', 'õ') else ch
+                # Vogais átonas finais: 'e' -> 'i', 'o' -> 'u' (leite, gato).
+                if j == last_nucleus and j > stressed:
+                    tail_after = ''.join(s[1] for s in segments[j + 1:])
+                    if tail_after in ('', 's'):
+                        phone = {'e': 'i', 'o': 'u'}.get(phone, phone)
+            # Vogal antes de m/n em coda fica nasal (campo, ponte).
+            if nxt is not None and nxt[0] == 'C' and nxt[1] in ('m', 'n'):
+                after = segments[j + 2] if j + 2 < count else None
+                if after is None or after[0] == 'C':
+                    phone = _NASALIZE.get(phone, phone)
+            phones.append(phone)
+            continue
+
+        # Consoantes
+        if ch in ('m', 'n'):
+            if next_is_vowel:
+                phones.append(ch)
+            elif nxt is None and prev_is_vowel:
+                # Finais nasais: -am -> ãw, -em/-en -> ẽj.
+                if phones and phones[-1] == 'ã' and prev[1] == 'a':
+                    phones.append('w')
+                elif phones and phones[-1] == 'ẽ':
+                    phones.append('j')
+            elif nxt is not None and nxt[1] == 's' and j + 2 == count and phones and phones[-1] == 'ẽ':
+                phones.append('j')  # -ens
+            continue
+        if ch == 'nh':
+            phones.append('N')
+        elif ch == 'lh':
+            phones.append('L')
+        elif ch == 'ch':
+            phones.append('S')
+        elif ch == 'sh':
+            phones.append('S')
+        elif ch == 'rr':
+            phones.append('R')
+        elif ch == 'ss' or ch == 'sc' or ch == 'ç':
+            phones.append('s')
+        elif ch == 'r':
+            if prev is None or (prev[0] == 'C' and prev[1] in ('n', 'l', 's')) or not next_is_vowel:
+                phones.append('R')
+            else:
+                phones.append('r')
+        elif ch == 's':
+            phones.append('z' if prev_is_vowel and next_is_vowel else 's')
+        elif ch == 'z':
+            phones.append('z' if next_is_vowel else 's')
+        elif ch == 'c':
+            phones.append('s' if nxt is not None and nxt[1] in _FRONT_VOWELS else 'k')
+        elif ch == 'g':
+            phones.append('Z' if nxt is not None and nxt[1] in _FRONT_VOWELS else 'g')
+        elif ch == 'j':
+            phones.append('Z')
+        elif ch == 'l':
+            phones.append('l' if next_is_vowel else 'w')
+        elif ch == 'x':
+            exception = _x_exception(word, pos)
+            if exception:
+                phones.append(exception)
+            elif nxt is None:
+                phones.append('ks')
+            elif prev is not None and prev[1] == 'e' and j == 1 and next_is_vowel:
+                phones.append('z')  # exame, exemplo
+            else:
+                phones.append('S')
+        elif ch == 'h':
+            continue
+        else:
+            phones.append(ch)
+    return phones, stress_phone
+
+
+def ptbr_rhyme_key(word):
+    """Chave de rima: transcrição a partir da vogal tônica ('escola' -> 'Ola')."""
+    match = _WORD_RE.search(word or '')
+    if not match:
+        return ''
+    word = match.group(0).lower().split('-')[-1]
+    phones, stress = ptbr_phonemes(word)
+    if stress < 0:
+        return ''
+    return ''.join(phones[stress:])
+
+
+def find_local_rhymes(word, limit=None):
+    """Busca rimas no índice local, ordenadas por frequência.
+
+    Retorna (rimas, conhecida), onde `conhecida` indica se a palavra está no
+    léxico (fora dele o timbre da vogal tônica é só um palpite).
+    """
+    lex = lexicon.ensure_loaded()
+    normalized = word.strip().lower()
+    known = normalized in lex.words
+    key = ptbr_rhyme_key(lex.pronunciation(normalized))
+    if not key:
+        return [], known
+    limit = limit or RHYME_MAX_RESULTS
+    rhymes = []
+    for _, candidate in lex.rhyme_index.get(key, ()):
+        if candidate == normalized:
+            continue
+        rhymes.append(candidate)
+        if len(rhymes) >= limit:
+            break
+    return rhymes, known
+
+
+# --- 1.5 CORRETOR ORTOGRÁFICO LOCAL (ÍNDICE DE DELEÇÕES ESTILO SYMSPELL) ---
+# Usa o mesmo léxico PT-BR do motor de rimas. Cada palavra é indexada pelas
+# deleções (até SPELL_MAX_DISTANCE letras) do seu prefixo sem acentos; na
+# consulta, geramos as deleções da palavra digitada e conferimos a distância
+# real só dos candidatos encontrados. Assim um poema sem erros é revisado sem
+# nenhuma chamada à IA.
+
+SPELL_MAX_DISTANCE = int(os.environ.get('SPELL_MAX_DISTANCE', 2))
+SPELL_PREFIX_LENGTH = int(os.environ.get('SPELL_PREFIX_LENGTH', 6))
+SPELL_MAX_SUGGESTIONS = 2
+
+# Terminações flexionais: uma palavra fora do léxico é aceita se trocar a
+# terminação por uma forma base conhecida (brincávamos -> brincar, gatinho -> gato).
+_SPELL_SUFFIXES = (
+    ('ávamos', ('ar',)), ('íamos', ('er', 'ir')), ('aremos', ('ar',)), ('eremos', ('er',)),
+    ('iremos', ('ir',)), ('ariam', ('ar',)), ('eriam', ('er',)), ('iriam', ('ir',)),
+    ('assem', ('ar',)), ('essem', ('er',)), ('issem', ('ir',)), ('ando', ('ar',)),
+    ('endo', ('er',)), ('indo', ('ir',)), ('avam', ('ar',)), ('aram', ('ar',)),
+    ('eram', ('er',)), ('iram', ('ir',)), ('ava', ('ar',)), ('ou', ('ar',)), ('eu', ('er',)),
+    ('iu', ('ir',)), ('ei', ('ar',)), ('mente', ('',)), ('zinho', ('',)), ('zinha', ('',)),
+    ('inho', ('o', 'a', 'e')), ('inha', ('a', 'o', 'e')), ('inhos', ('os', 'as', 'es')),
+    ('inhas', ('as', 'os', 'es')), ('íssimo', ('o',)), ('íssima', ('a',)), ('s', ('',)),
+)
+# Sufixos que puxam a tônica para si: o agudo/circunflexo da base cai (rápida ->
+# rapidamente, café -> cafezinho), mas o til e a cedilha ficam (mãe -> mãezinha).
+_STRESS_SHIFTING_SUFFIXES = {
+    'mente', 'zinho', 'zinha', 'inho', 'inha', 'inhos', 'inhas', 'íssimo', 'íssima',
+}
+# O léxico vem de legendas e traz grafias sem acento ('musica', 'agua', 'mao').
+# Uma palavra sem acento muito mais rara que a grafia acentuada conta como
+# acento esquecido, tanto sozinha quanto como base de flexão ('musicas').
+SPELL_ACCENT_VARIANT_RATIO = 20
+# Homógrafos legítimos que a regra acima marcaria como erro.
+_SPELL_UNACCENTED_WORDS = {
+    'copia', 'copias', 'facas', 'forca', 'forcas', 'ira', 'la', 'manha',
+    'peca', 'pecas', 'peco', 'replica', 'secretaria',
+}
+# O léxico não tem classe gramatical: '-mente' só vale sobre bases com cara de
+# adjetivo (vagarosa, efetiva, possível), senão 'casamente' passaria por 'casa'.
+_ADVERB_BASE_ENDINGS = (
+    'osa', 'iva', 'ica', 'vel', 'ada', 'ida', 'nte', 'ria', 'al', 'il', 'ar', 'or', 'ez', 'iz', 'ea', 'ua',
+)
+
+
+def strip_accents(text):
+    """Remove acentos e cedilha ('coração' -> 'coracao')."""
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def _drop_stress_marks(text):
+    """Remove só agudo, grave e circunflexo ('café' -> 'cafe', 'mãe' continua 'mãe')."""
+    decomposed = unicodedata.normalize('NFD', text)
+    return unicodedata.normalize('NFC', ''.join(c for c in decomposed if c not in '\u0300\u0301\u0302'))
+
+
+def _suffix_fits(base, suffix):
+    """A forma base (sem acentos) aceita esta terminação?"""
+    if base.endswith(strip_accents(suffix)):
+        return False  # Flexão dobrada: 'amigoss' não é plural de 'amigos'.
+    if suffix == 's':
+        return base[-1] in 'aeiou'  # 'flor' faz 'flores', não 'flors'.
+    if suffix == 'mente':
+        return base.endswith(_ADVERB_BASE_ENDINGS)
+    return True
+
+
+def _spell_deletes(word, max_distance):
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        nxt = set()
+        for item in frontier:
+            for i in range(len(item)):
+                nxt.add(item[:i] + item[i + 1:])
+        result |= nxt
+        frontier = nxt
+    return result
+
+
+def _osa_distance(a, b, max_distance):
+    """Distância de Damerau-Levenshtein (OSA), com corte em `max_distance`."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        row_min = cur[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if (prev_prev is not None and i > 1 and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                cur[j] = min(cur[j], prev_prev[j - 2] + 1)
+            row_min = min(row_min, cur[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, cur
+    return prev[-1]
+
+
+class SpellIndex:
+    """Índice de deleções sobre o léxico, montado uma vez por processo."""
+
+    def __init__(self, lex, max_distance, prefix_length):
+        self.lexicon = lex
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes = {}
+        self.unstressed = set()  # léxico sem agudo/circunflexo (bases dos sufixos que puxam a tônica)
+        self.variant_top = {}  # palavra sem acentos -> maior frequência entre as grafias
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return self
+        with self._lock:
+            if self._loaded:
+                return self
+            start = time.perf_counter()
+            words = self.lexicon.ensure_loaded().words
+            deletes = defaultdict(list)
+            unstressed = set()
+            variant_top = {}
+            for word, (freq, _) in words.items():
+                plain = strip_accents(word)
+                unstressed.add(_drop_stress_marks(word))
+                variant_top[plain] = max(variant_top.get(plain, 0), freq)
+                for d in _spell_deletes(plain[:self.prefix_length], self.max_distance):
+                    deletes[d].append(word)
+            self.deletes = dict(deletes)
+            self.unstressed = unstressed
+            self.variant_top = variant_top
+            self._loaded = True
+            print(f"Índice ortográfico pronto: {len(self.deletes)} deleções "
+                  f"em {time.perf_counter() - start:.2f}s.")
+        return self
+
+    def is_known(self, word):
+        word = word.lower()
+        words = self.lexicon.words
+        if word in words:
+            return not self._accent_dropped(word)
+        if '-' in word:
+            return all(part in words for part in word.split('-') if part)
+        for suffix, replacements in _SPELL_SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                stem = word[:-len(suffix)]
+                if any(self._base_known(stem, r, suffix) for r in replacements):
+                    return True
+        return False
+
+    def _base_known(self, stem, ending, suffix):
+        """A base (radical com os acentos digitados + `ending`) é uma palavra que aceita o sufixo?"""
+        base = stem + ending
+        if not _suffix_fits(strip_accents(base), suffix):
+            return False
+        if suffix in _STRESS_SHIFTING_SUFFIXES:
+            return _drop_stress_marks(stem) == stem and base in self.unstressed
+        return base in self.lexicon.words and not self._accent_dropped(base)
+
+    def _accent_dropped(self, word):
+        """A palavra é a grafia sem acento de outra bem mais comum ('musica' -> 'música')?"""
+        if word in _SPELL_UNACCENTED_WORDS or strip_accents(word) != word:
+            return False
+        return self.lexicon.frequency(word) * SPELL_ACCENT_VARIANT_RATIO < self.variant_top.get(word, 0)
+
+    def suggestions(self, word):
+        """Candidatos como [(palavra, distância, frequência, só_acento)], já ordenados."""
+        self.ensure_loaded()
+        lowered = word.lower()
+        plain = strip_accents(lowered)
+        # Palavras curtas com distância 2 viram quase qualquer coisa.
+        max_distance = 1 if len(plain) <= 4 else self.max_distance
+        seen = {lowered}  # A própria grafia digitada nunca é sugestão.
+        results = []
+        for d in _spell_deletes(plain[:self.prefix_length], max_distance):
+            for candidate in self.deletes.get(d, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = _osa_distance(plain, strip_accents(candidate), max_distance)
+                if distance > max_distance:
+                    continue
+                accent_only = distance == 0
+                results.append((candidate, max(distance, 1), self.lexicon.frequency(candidate), accent_only))
+        results.sort(key=lambda r: (not r[3], r[1], -r[2], r[0]))
+        return results
+
+
+spell_index = SpellIndex(lexicon, SPELL_MAX_DISTANCE, SPELL_PREFIX_LENGTH)
+
+_TOKEN_RE = re.compile(r"[^\W\d_]+(?:[-'][^\W\d_]+)*")
+
+
+def _spelling_reason(original, suggestion, accent_only):
+    if accent_only:
+        return "Atenção ao acento (ou à cedilha) desta palavra."
+    pair = set(strip_accents(original.lower())) ^ set(strip_accents(suggestion.lower()))
+    if pair & {'s', 'z', 'c'} and len(pair) <= 2:
+        return "Cuidado com o uso de 's', 'ss', 'ç' ou 'z' nesta palavra."
+    if pair and (pair <= {'g', 'j'} or pair <= {'x', 'h'}):
+        return "Letras com som parecido: confira a grafia."
+    return "Parece que a palavra foi escrita de um jeito diferente. Confira!"
+
+
+def _match_case(original, suggestion):
+    if original.isupper() and len(original) > 1:
+        return suggestion.upper()
+    if original[:1].isupper():
+        return suggestion[:1].upper() + suggestion[1:]
+    return suggestion
+
+
+def local_spell_check(lines):
+    """Revisa as linhas do poema localmente.
+
+    Retorna (erros, pendentes): `erros` no formato original/suggestions/reason/
+    verse_number consumido pelo frontend, e `pendentes` com as palavras que o
+    dicionário não soube resolver, como [(verse_number, palavra)].
+    """
+    index = spell_index.ensure_loaded()
+    errors = []
+    unresolved = []
+    for i, line in enumerate(lines):
+        verse_number = i + 1
+        reported = set()
+        for match in _TOKEN_RE.finditer(line):
+            token = match.group(0)
+            if len(token) < 2 or token.lower() in reported or index.is_known(token):
+                continue
+            reported.add(token.lower())
+            # Maiúscula no meio do verso é provavelmente um nome próprio: a IA decide.
+            is_proper_noun = token[:1].isupper() and line[:match.start()].strip() != ''
+            candidates = [] if is_proper_noun else index.suggestions(token)
+            if not candidates:
+                unresolved.append((verse_number, token))
+                continue
+            best = candidates[:SPELL_MAX_SUGGESTIONS]
+            errors.append({
+                "original": token,
+                "suggestions": [_match_case(token, c[0]) for c in best],
+                "reason": _spelling_reason(token, best[0][0], best[0][3]),
+                "verse_number": verse_number,
+                "distance": best[0][1],
+            })
+    return errors, unresolved
+
+
+# --- 1.6 RESPOSTAS EM STREAMING (SERVER-SENT EVENTS) ---
+# Temas, ideias e rimas são listas JSON. Nas variantes /stream das rotas, o
+# texto do Gemini chega aos pedaços (geração em streaming) e um parser
+# incremental entrega cada elemento da lista assim que ele fecha; cada
+# elemento vira um evento SSE. O cache é o mesmo das rotas JSON: um acerto
+# devolve tudo de uma vez e uma lista completa e válida é gravada no fim.
+
+class JsonArrayStream:
+    """Parser incremental de uma lista JSON: devolve cada elemento assim que ele fecha."""
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._depth = 0  # relativa à lista externa (0 = ainda fora dela)
+        self._in_string = False
+        self._escape = False
+        self._item_start = None
+        self.closed = False
+        self.invalid = 0  # elementos descartados por não serem JSON válido
+
+    def feed(self, text):
+        """Consome mais um pedaço do texto e retorna os elementos completados."""
+        items = []
+        self._buffer += text
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf) and not self.closed:
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                # Ignora o que vier antes da lista (ex.: ```json).
+                if c == '[':
+                    self._depth = 1
+                    self._item_start = i + 1
+            elif c == '"':
+                self._in_string = True
+            elif c in '[{':
+                self._depth += 1
+            elif c in ']}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buf[self._item_start:i], items)
+                    self.closed = True
+            elif c == ',' and self._depth == 1:
+                self._emit(buf[self._item_start:i], items)
+                self._item_start = i + 1
+            i += 1
+
+        # Descarta o que já foi consumido.
+        cut = self._item_start if self._item_start is not None else i
+        self._buffer = buf[cut:]
+        self._pos = i - cut
+        if self._item_start is not None:
+            self._item_start -= cut
+        return items
+
+    def _emit(self, raw, items):
+        raw = raw.strip()
+        if not raw:
+            return
+        try:
+            items.append(json_loads(raw))
+        except ValueError:
+            self.invalid += 1
+            print(f"[Streaming] Elemento JSON inválido ignorado: {raw[:80]}")
+
+
+def stream_ai_list(prompt_text, cache_scope=None, validate=None):
+    """Como generate_ai_content(force_json=True) para listas, mas gera os elementos um a um.
+
+    Também passa pelo single-flight (só dentro do processo): se a mesma
+    chamada já está em voo, com ou sem stream, espera por ela e entrega a
+    lista pronta; se não, vira a líder e as chamadas iguais esperam por esta.
+    """
+    ttl = AI_CACHE_TTLS.get(cache_scope, 0) if AI_CACHE_ENABLED else 0
+    key = AIResponseCache.make_key(prompt_text, MODEL_NAME, True)
+    if ttl > 0:
+        hit, cached = ai_cache.get(key)
+        if hit and isinstance(cached, list):
+            yield from cached
+            return
+    if not SINGLE_FLIGHT_ENABLED:
+        yield from _stream_model_list(prompt_text, cache_scope, validate, key, ttl)
+        return
+
+    while True:
+        future, leader = single_flight.enter(key)
+        if leader:
+            break
+        try:
+            with phase('single_flight'):
+                result = future.result()
+        except FlightAbandoned:
+            continue
+        if isinstance(result, list):
+            yield from result
+        return
+
+    items = []
+    chunks = _stream_model_list(prompt_text, cache_scope, validate, key, ttl)
+    try:
+        for item in chunks:
+            items.append(item)
+            yield item
+    except GeneratorExit:
+        # O cliente fechou o stream: quem esperava por esta chamada tenta de novo.
+        future.set_exception(FlightAbandoned())
+        raise
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(items)
+    finally:
+        chunks.close()  # Devolve a sonda do disjuntor já, sem esperar o coletor de lixo.
+        single_flight.leave(key, future)
+
+
+def _stream_model_list(prompt_text, cache_scope, validate, key, ttl):
+    model = get_model()
+    if model is None:
+        raise Exception("Modelo de IA não inicializado. Verifique a API Key e as permissões no Google Cloud.")
+
+    generation_config = {"response_mime_type": "application/json"}
+    parser = JsonArrayStream()
+    items = []
+    timeout = LLM_TIMEOUTS.get(cache_scope, LLM_DEFAULT_TIMEOUT)
+    llm_breaker.allow()
+    try:
+        acquire_llm_slot(prompt_text)
+    except LLMRateLimited:
+        llm_breaker.release_probe()
+        raise
+    usage = []
+    # Se o cliente fechar o stream no meio (GeneratorExit no yield), nem sucesso
+    # nem falha é registrado: o finally devolve a sonda do disjuntor, senão ele
+    # ficaria meio-aberto para sempre, recusando todas as chamadas.
+    settled = False
+    try:
+        with llm_call_metrics(cache_scope), phase('model'):
+            if LLM_ASYNC_ENABLED:
+                chunks = llm_runner.stream(model, prompt_text, generation_config, idle_timeout=timeout,
+                                           on_usage=usage.append)
+            else:
+                response = model.generate_content(prompt_text, generation_config=generation_config, stream=True,
+                                                  request_options={'timeout': timeout})
+                chunks = (_chunk_text(c) for c in response)
+            for text in chunks:
+                for item in parser.feed(text):
+                    items.append(item)
+                    yield item
+            if not LLM_ASYNC_ENABLED:
+                usage.append(getattr(response, 'usage_metadata', None))
+    except Exception as e:
+        print(f"Erro na geração de conteúdo da IA (streaming): {e}")
+        if is_quota_error(e):
+            raise quota_error_to_rate_limit(e)
+        settled = True
+        if is_transient_error(e):
+            llm_breaker.record_failure()
+        else:
+            llm_breaker.record_success()
+        raise Exception(f"Falha ao gerar ou processar resposta da IA: {e}") from e
+    else:
+        settled = True
+        llm_breaker.record_success()
+    finally:
+        if not settled:
+            llm_breaker.release_probe()
+    record_llm_usage(cache_scope, usage[-1] if usage else None)
+    # Elementos inválidos e lista que nunca fechou contam como falha de parsing.
+    parse_failures = parser.invalid + (0 if parser.closed else 1)
+    if parse_failures:
+        metrics.inc('oficina_llm_json_parse_failures_total', parse_failures, scope=cache_scope or 'other')
+
+    if ttl > 0 and parser.closed and (validate is None or validate(items)):
+        ai_cache.set(key, items, ttl)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(events):
+    """Resposta text/event-stream; `events` é um gerador de strings já formatadas."""
+    # stream_with_context: o agendador do modelo precisa saber quem pediu.
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx: não segurar o stream em buffer
+    })
+
+
+# --- 1.7 TRABALHO ESPECULATIVO (PRÉ-BUSCA DE IDEIAS) ---
+# Depois que a lista de temas é enviada, as ideias de cada tema são geradas
+# em segundo plano, para que o clique do aluno já encontre a resposta pronta.
+# A especulação tem orçamento próprio (poucas threads, fila limitada), é
+# descartada quando o modelo está ocupado com requisições reais e, quando o
+# aluno escolhe um tema, os outros temas do mesmo lote que ainda estão na
+# fila são cancelados. Os resultados vivem pouco (SPECULATIVE_TTL).
+
+SPECULATIVE_ENABLED = os.environ.get('SPECULATIVE_ENABLED', '1') != '0'
+SPECULATIVE_WORKERS = int(os.environ.get('SPECULATIVE_WORKERS', 3))
+SPECULATIVE_MAX_QUEUED = int(os.environ.get('SPECULATIVE_MAX_QUEUED', 64))
+SPECULATIVE_TTL = int(os.environ.get('SPECULATIVE_TTL', 600))
+# Acima desta fração de LLM_MAX_CONCURRENCY em voo, a especulação é pulada.
+SPECULATIVE_MAX_LLM_LOAD = float(os.environ.get('SPECULATIVE_MAX_LLM_LOAD', 0.5))
+# Quanto um clique espera por uma especulação que já está rodando. A
+# especulação roda com prioridade de fundo; passado este tempo o clique
+# desiste dela e faz a chamada interativa normal.
+SPECULATIVE_JOIN_TIMEOUT = float(os.environ.get('SPECULATIVE_JOIN_TIMEOUT', 3))
+
+
+class SpeculativeCache:
+    """Resultados calculados por antecipação, com orçamento e cancelamento próprios."""
+
+    def __init__(self, workers, max_queued, ttl, max_llm_load):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_llm_load = max_llm_load
+        self._entries = {}  # chave -> (future, lote, expira_em)
+        self._batches = defaultdict(set)
+        self._next_batch = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.stats = defaultdict(int)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _busy(self):
+        return llm_runner.in_flight >= self.max_llm_load * LLM_MAX_CONCURRENCY
+
+    def _forget(self, key):
+        future, batch, _ = self._entries.pop(key)
+        self._batches[batch].discard(key)
+        if not self._batches[batch]:
+            del self._batches[batch]
+        return future
+
+    def _purge(self, now):
+        for key in [k for k, (_, _, expires) in self._entries.items() if expires < now]:
+            if self._forget(key).cancel():
+                self.stats['cancelled'] += 1
+            self.stats['expired'] += 1
+
+    def schedule(self, jobs):
+        """Agenda um lote de (chave, função); chaves já especuladas são ignoradas."""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='speculative')
+                self._executor_pid = os.getpid()
+            batch = self._next_batch
+            self._next_batch += 1
+            queued = sum(1 for future, _, _ in self._entries.values() if not future.done())
+            for key, fn in jobs:
+                if key in self._entries:
+                    continue
+                if queued >= self.max_queued:
+                    self.stats['dropped'] += 1
+                    continue
+                self._entries[key] = (self._executor.submit(self._run, fn), batch, now + self.ttl)
+                self._batches[batch].add(key)
+                queued += 1
+                self.stats['scheduled'] += 1
+
+    def _run(self, fn):
+        if self._busy():
+            self._count('skipped_busy')
+            return None
+        try:
+            result = fn()
+        except Exception as e:
+            print(f"[Especulação] Falhou: {e}")
+            self._count('errors')
+            return None
+        self._count('computed')
+        return result
+
+    def take(self, key, timeout=SPECULATIVE_JOIN_TIMEOUT):
+        """Resultado especulado para a chave, ou None (a requisição faz o trabalho).
+
+        Se a especulação ainda está rodando, espera por ela até `timeout`
+        segundos (ela continua e ainda abastece o cache de respostas); se
+        ainda está na fila, é cancelada. Os outros itens do lote que não
+        começaram também são.
+        """
+        with self._lock:
+            self._purge(time.monotonic())
+            entry = self._entries.get(key)
+            if entry is not None:
+                for other in list(self._batches.get(entry[1], ())):
+                    if other != key and self._entries[other][0].cancel():
+                        self._forget(other)
+                        self.stats['cancelled'] += 1
+        if entry is None:
+            self._count('misses')
+            return None
+
+        future = entry[0]
+        if future.cancel():
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._forget(key)
+                self.stats['cancelled'] += 1
+                self.stats['misses'] += 1
+            return None
+        was_done = future.done()
+        try:
+            result = future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            self._count('join_timeouts')
+            result = None
+        except Exception:
+            result = None
+        self._count('misses' if result is None else 'hits' if was_done else 'joined')
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        served = stats.get('hits', 0) + stats.get('joined', 0)
+        total = served + stats.get('misses', 0)
+        stats['hit_rate'] = round(served / total, 3) if total else 0.0
+        return stats
+
+
+speculative = SpeculativeCache(SPECULATIVE_WORKERS, SPECULATIVE_MAX_QUEUED,
+                               SPECULATIVE_TTL, SPECULATIVE_MAX_LLM_LOAD)
+
+
+# --- 1.8 AGENDADOR DE COTA DO MODELO (RPM/TPM, FILA JUSTA, PRIORIDADES) ---
+# Toda chamada ao Gemini passa por aqui antes de sair. Dois baldes de fichas
+# (requisições e tokens por minuto) seguram o ritmo abaixo da cota. Quem não
+# tem vez espera numa fila justa: primeiro por prioridade (pedidos feitos
+# pelo aluno antes de trabalho em segundo plano), depois em rodízio entre
+# clientes (turma/sessão/IP), para uma turma não monopolizar o modelo. Se a
+# espera passar do prazo, a rota responde 429 com Retry-After. Um 429 do
+# próprio Gemini pausa o agendador pelo tempo que a API pedir.
+
+# Os limites são da conta inteira, mas cada worker do gunicorn tem os seus
+# baldes: cada processo fica com uma fatia (o gunicorn.conf.py informa o número
+# de workers em LLM_SCHEDULER_PROCESSES). Fora do gunicorn é um processo só.
+LLM_RPM_LIMIT = int(os.environ.get('LLM_RPM_LIMIT', 600))
+LLM_TPM_LIMIT = int(os.environ.get('LLM_TPM_LIMIT', 1000000))
+LLM_SCHEDULER_PROCESSES = max(1, int(os.environ.get('LLM_SCHEDULER_PROCESSES', 1)))
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.environ.get('LLM_EXPECTED_OUTPUT_TOKENS', 400))
+LLM_QUEUE_DEADLINE = float(os.environ.get('LLM_QUEUE_DEADLINE', 10))
+LLM_BACKGROUND_DEADLINE = float(os.environ.get('LLM_BACKGROUND_DEADLINE', 30))
+# Fração dos baldes que o trabalho em segundo plano não pode usar.
+LLM_BACKGROUND_RESERVE = float(os.environ.get('LLM_BACKGROUND_RESERVE', 0.2))
+LLM_UPSTREAM_BACKOFF = 10
+LLM_PRIORITIES = ('interactive', 'background')
+
+
+class LLMRateLimited(Exception):
+    """Sem capacidade de chamar o modelo dentro do prazo."""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"Muitos pedidos ao assistente agora. Tente de novo em {self.retry_after} segundos.")
+
+
+class TokenBucket:
+    """Balde de fichas: `per_minute` fichas por minuto, acumulando até um minuto."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now, reserve=0.0):
+        """Segundos até haver `amount` fichas, deixando `reserve` do balde livre."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(amount, self.capacity) + reserve * self.capacity - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def take(self, amount):
+        self.tokens -= amount
+
+
+class LLMScheduler:
+    """Fila justa com prioridades na frente dos baldes de RPM e TPM."""
+
+    def __init__(self, rpm, tpm, deadline, background_deadline, background_reserve):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.deadlines = {'interactive': deadline, 'background': background_deadline}
+        self.background_reserve = background_reserve
+        self._queues = {p: OrderedDict() for p in LLM_PRIORITIES}  # cliente -> deque de tickets
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waits = deque(maxlen=1000)
+        self.stats = defaultdict(int)
+
+    def _head(self):
+        for priority in LLM_PRIORITIES:
+            queue_ = self._queues[priority]
+            if queue_:
+                client, tickets = next(iter(queue_.items()))
+                return priority, client, tickets[0]
+        return None
+
+    def _remove(self, priority, client, ticket):
+        tickets = self._queues[priority].get(client)
+        if tickets is None or ticket not in tickets:
+            return
+        tickets.remove(ticket)
+        if tickets:
+            # Rodízio: o cliente atendido vai para o fim da fila.
+            self._queues[priority].move_to_end(client)
+        else:
+            del self._queues[priority][client]
+
+    def _wait_time(self, tokens, priority, now):
+        reserve = self.background_reserve if priority == 'background' else 0.0
+        wait = self._blocked_until - now
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            if bucket is not None:
+                wait = max(wait, bucket.wait_time(amount, now, reserve))
+        return wait
+
+    def _retry_after(self):
+        queued = sum(len(t) for q in self._queues.values() for t in q.values())
+        per_second = self.requests.rate if self.requests is not None else 1.0
+        return max(queued / per_second, self._blocked_until - time.monotonic())
+
+    def acquire(self, tokens, client, priority):
+        """Bloqueia até a vez desta chamada (ou levanta LLMRateLimited no prazo)."""
+        start = time.monotonic()
+        if self.requests is None and self.tokens is None and start >= self._blocked_until:
+            return
+        deadline = start + self.deadlines[priority]
+        ticket = object()
+        with self._cond:
+            self._queues[priority].setdefault(client, deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._head() == (priority, client, ticket):
+                        wait = self._wait_time(tokens, priority, now)
+                        if wait <= 0:
+                            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                                if bucket is not None:
+                                    bucket.take(amount)
+                            break
+                        if now + wait > deadline:
+                            raise LLMRateLimited(wait)
+                        self._cond.wait(wait)
+                    else:
+                        if now >= deadline:
+                            raise LLMRateLimited(self._retry_after())
+                        self._cond.wait(deadline - now)
+            except LLMRateLimited:
+                self.stats[f'rejected_{priority}'] += 1
+                raise
+            finally:
+                self._remove(priority, client, ticket)
+                self._cond.notify_all()
+            waited = time.monotonic() - start
+            self._waits.append(waited)
+            self.stats[f'granted_{priority}'] += 1
+            if waited > 0.001:
+                self.stats['waited'] += 1
+
+    def try_acquire(self, tokens):
+        """Reserva capacidade só se ela estiver livre agora e a fila vazia (sem esperar).
+
+        Usado nas chamadas extras (hedge), que contam como segundo plano.
+        """
+        with self._cond:
+            if self.requests is None and self.tokens is None:
+                return time.monotonic() >= self._blocked_until
+            if self._head() is not None or self._wait_time(tokens, 'background', time.monotonic()) > 0:
+                return False
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.take(amount)
+            return True
+
+    def settle(self, estimated, actual):
+        """Acerta o balde de tokens com o uso real informado pela API."""
+        if self.tokens is not None and actual:
+            with self._cond:
+                self.tokens.take(actual - estimated)
+
+    def penalize(self, seconds):
+        """A API devolveu 429: ninguém chama o modelo pelos próximos `seconds`."""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self.stats['upstream_429'] += 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            waits = sorted(self._waits)
+            stats['queued'] = {p: sum(len(t) for t in q.values()) for p, q in self._queues.items()}
+            stats['limits_per_process'] = {name: int(bucket.capacity) if bucket is not None else 0
+                                           for name, bucket in (('rpm', self.requests), ('tpm', self.tokens))}
+        if waits:
+            stats['wait_ms_p50'] = round(waits[len(waits) // 2] * 1000, 1)
+            stats['wait_ms_p95'] = round(waits[int(len(waits) * 0.95)] * 1000, 1)
+            stats['wait_ms_max'] = round(waits[-1] * 1000, 1)
+        return stats
+
+
+def _per_process_limit(limit):
+    """Fatia deste worker num limite da conta (0 continua desligado)."""
+    return max(1, limit // LLM_SCHEDULER_PROCESSES) if limit > 0 else 0
+
+
+llm_scheduler = LLMScheduler(_per_process_limit(LLM_RPM_LIMIT), _per_process_limit(LLM_TPM_LIMIT),
+                             LLM_QUEUE_DEADLINE, LLM_BACKGROUND_DEADLINE, LLM_BACKGROUND_RESERVE)
+
+
+def estimate_tokens(prompt_text):
+    """Estimativa grosseira (≈4 caracteres por token) + a saída esperada."""
+    return len(prompt_text) // 4 + LLM_EXPECTED_OUTPUT_TOKENS
+
+
+def llm_caller():
+    """(cliente, prioridade) de quem está chamando o modelo.
+
+    Dentro de uma requisição, o cliente é a turma (X-Classroom-Id), a sessão
+    (X-Client-Id) ou o IP; fora dela (threads de especulação e pré-geração) é
+    trabalho em segundo plano.
+    """
+    if not has_request_context():
+        return 'background', 'background'
+    forwarded = request.headers.get('X-Forwarded-For', '').split(',')[0].strip()
+    client = (request.headers.get('X-Classroom-Id') or request.headers.get('X-Client-Id')
+              or forwarded or request.remote_addr or 'anon')
+    return client, 'interactive'
+
+
+def acquire_llm_slot(prompt_text):
+    """Espera a vez desta chamada no agendador e retorna os tokens reservados."""
+    tokens = estimate_tokens(prompt_text)
+    client, priority = llm_caller()
+    with phase('queue'):
+        llm_scheduler.acquire(tokens, client, priority)
+    return tokens
+
+
+def is_quota_error(error):
+    """429 de verdade, pelo tipo ou pelo status (um '429' no texto do erro não conta)."""
+    if type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    return 429 in (getattr(error, 'code', None), getattr(error, 'status_code', None))
+
+
+def quota_error_to_rate_limit(error):
+    """Converte o 429 do Gemini em LLMRateLimited, pausando o agendador."""
+    match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', str(error))
+    seconds = int(match.group(1)) if match else LLM_UPSTREAM_BACKOFF
+    llm_scheduler.penalize(seconds)
+    return LLMRateLimited(seconds)
+
+
+def error_payload(error):
+    payload = {"error": str(error)}
+    if isinstance(error, (LLMRateLimited, LLMUnavailable)):
+        payload["retry_after"] = error.retry_after
+    return payload
+
+
+def api_error(error, status=500):
+    """Resposta de erro das rotas: falta de cota vira 429, disjuntor aberto 503 e prazo estourado 504."""
+    if isinstance(error, LLMRateLimited):
+        return jsonify(error_payload(error)), 429, {"Retry-After": str(error.retry_after)}
+    if isinstance(error, LLMUnavailable):
+        return jsonify(error_payload(error)), 503, {"Retry-After": str(error.retry_after)}
+    if isinstance(error, TimeoutError):
+        return jsonify(error_payload(error)), 504
+    return jsonify(error_payload(error)), status
+
+
+# --- 1.9 RESILIÊNCIA: PRAZOS, RETRY, HEDGE E DISJUNTOR ---
+# Cada endpoint tem um prazo total para a chamada ao modelo (LLM_TIMEOUTS).
+# Erros transitórios (timeout, 5xx, conexão) são repetidos com backoff
+# exponencial e jitter, dentro do prazo. Opcionalmente (LLM_HEDGING=1), uma
+# chamada interativa que passa do p95 de latência do endpoint ganha uma
+# cópia; vale a primeira resposta. Falhas seguidas abrem o disjuntor: por
+# BREAKER_OPEN_SECONDS ninguém chama o modelo e as rotas usam o que têm de
+# local (ideias-modelo, rimas do léxico, revisão do dicionário).
+
+LLM_TIMEOUTS = {
+    'themes': 20,
+    'ideas': 15,
+    'ideas_batch': 40,
+    'rhymes': 15,
+    'check': 20,
+    'pdf_style': 30,
+}
+for _scope in LLM_TIMEOUTS:
+    _env_timeout = os.environ.get(f'LLM_TIMEOUT_{_scope.upper()}')
+    if _env_timeout is not None:
+        LLM_TIMEOUTS[_scope] = float(_env_timeout)
+
+LLM_DEFAULT_TIMEOUT = float(os.environ.get('LLM_DEFAULT_TIMEOUT', 30))
+LLM_RETRIES = int(os.environ.get('LLM_RETRIES', 2))
+LLM_RETRY_BASE_DELAY = 0.5
+LLM_HEDGING = os.environ.get('LLM_HEDGING', '0') == '1'
+LLM_HEDGE_MIN_SAMPLES = 20
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+
+_TRANSIENT_ERROR_NAMES = {
+    'ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout',
+    'BadGateway', 'ServerError', 'RemoteDisconnected', 'ReadTimeout', 'ConnectTimeout',
+}
+
+
+class LLMUnavailable(Exception):
+    """Disjuntor aberto: o modelo está fora do ar ou falhando."""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__("O assistente está indisponível no momento. Tente de novo em instantes.")
+
+
+def is_transient_error(error):
+    if isinstance(error, (TimeoutError, concurrent.futures.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in _TRANSIENT_ERROR_NAMES:
+        return True
+    return re.search(r'\b(500|502|503|504)\b', str(error)) is not None
+
+
+def upstream_unhealthy(error):
+    """O erro (ou a causa dele) indica modelo fora do ar? Então vale o plano B local."""
+    while error is not None:
+        if isinstance(error, LLMUnavailable) or is_transient_error(error):
+            return True
+        error = error.__cause__
+    return False
+
+
+class CircuitBreaker:
+    """Disjuntor: fechado -> aberto após N falhas seguidas -> meio-aberto (uma sonda)."""
+
+    def __init__(self, failure_threshold, open_seconds):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def allow(self):
+        """Levanta LLMUnavailable se a chamada não deve ir ao modelo agora."""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining > 0 or self._probing:
+                self.stats['short_circuited'] += 1
+                raise LLMUnavailable(max(remaining, 1))
+            # Meio-aberto: só esta chamada testa o modelo.
+            self.state = 'half_open'
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print("[Disjuntor] Modelo respondeu de novo: fechado.")
+                self.stats['closed'] += 1
+            self.state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """A chamada não chegou ao modelo (ex.: fila cheia): outra pode sondar."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    print(f"[Disjuntor] {self._failures} falhas seguidas: aberto por {self.open_seconds:.0f}s.")
+                    self.stats['opened'] += 1
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self._failures
+        return stats
+
+
+class LatencyTracker:
+    """Latências recentes por endpoint, para o p95 do hedge."""
+
+    def __init__(self, window=200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, scope, seconds):
+        with self._lock:
+            self._samples[scope].append(seconds)
+
+    def p95(self, scope):
+        with self._lock:
+            samples = sorted(self._samples[scope])
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[int(len(samples) * 0.95)]
+
+
+llm_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS)
+llm_latency = LatencyTracker()
+llm_resilience_stats = defaultdict(int)
+_resilience_lock = threading.Lock()
+
+
+def _count_resilience(name):
+    with _resilience_lock:
+        llm_resilience_stats[name] += 1
+
+
+def _wait_first_response(model, prompt_text, generation_config, tokens, deadline, hedge_after):
+    """Espera a resposta do loop assíncrono, disparando a cópia (hedge) se demorar."""
+    started = time.monotonic()
+    first = llm_runner.submit(model, prompt_text, generation_config)
+    pending = {first}
+    errors = []
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        wait_for = deadline - now
+        if hedge_after is not None:
+            wait_for = min(wait_for, max(0.0, started + hedge_after - now))
+        done, pending = concurrent.futures.wait(pending, timeout=wait_for,
+                                                return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            for other in pending:
+                other.cancel()
+            if future is not first:
+                _count_resilience('hedge_wins')
+            return response
+        if hedge_after is not None and time.monotonic() >= started + hedge_after:
+            if pending and llm_scheduler.try_acquire(tokens):
+                pending.add(llm_runner.submit(model, prompt_text, generation_config))
+                _count_resilience('hedges')
+            hedge_after = None
+    for future in pending:
+        future.cancel()
+    if errors and not pending:
+        raise errors[-1]
+    raise TimeoutError("O modelo demorou demais para responder.")
+
+
+def _attempt_model(model, prompt_text, generation_config, scope, deadline):
+    tokens = acquire_llm_slot(prompt_text)
+    started = time.monotonic()
+    if started >= deadline:
+        raise TimeoutError("O prazo acabou esperando a vez na fila do modelo.")
+    with llm_call_metrics(scope), phase('model'):
+        if LLM_ASYNC_ENABLED:
+            hedge_after = llm_latency.p95(scope) if LLM_HEDGING and llm_caller()[1] == 'interactive' else None
+            response = _wait_first_response(model, prompt_text, generation_config, tokens, deadline, hedge_after)
+        else:
+            response = model.generate_content(prompt_text, generation_config=generation_config,
+                                              request_options={'timeout': deadline - started})
+    llm_latency.observe(scope, time.monotonic() - started)
+    usage = getattr(response, 'usage_metadata', None)
+    record_llm_usage(scope, usage)
+    llm_scheduler.settle(tokens, getattr(usage, 'total_token_count', 0))
+    return response
+
+
+def call_model(model, prompt_text, generation_config, scope=None, timeout=None):
+    """Chamada ao modelo com disjuntor, agendador, prazo, retry com backoff e hedge."""
+    timeout = timeout or LLM_TIMEOUTS.get(scope, LLM_DEFAULT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    llm_breaker.allow()
+    attempt = 0
+    while True:
+        try:
+            response = _attempt_model(model, prompt_text, generation_config, scope, deadline)
+        except LLMRateLimited:
+            llm_breaker.release_probe()  # Não chegou ao modelo.
+            raise
+        except Exception as e:
+            if is_quota_error(e):
+                llm_breaker.release_probe()
+                raise quota_error_to_rate_limit(e)
+            if not is_transient_error(e):
+                llm_breaker.record_success()  # O modelo respondeu (com erro de pedido).
+                raise
+            attempt += 1
+            delay = random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+            if attempt > LLM_RETRIES or time.monotonic() + delay >= deadline:
+                _count_resilience('failures')
+                llm_breaker.record_failure()
+                raise
+            print(f"[Resiliência] Erro transitório ({e}); nova tentativa em {delay:.2f}s.")
+            _count_resilience('retries')
+            time.sleep(delay)
+            continue
+        llm_breaker.record_success()
+        return response
+
+
+# --- 1.10 MÉTRICAS (FORMATO PROMETHEUS) ---
+# /metrics expõe contadores, gauges e histogramas no formato texto do
+# Prometheus: latência por rota, latência e tokens das chamadas ao modelo,
+# falhas de parsing do JSON, acionamentos do plano B local e tempo/tamanho
+# dos PDFs. Cada processo acumula em memória e grava um retrato num SQLite
+# compartilhado a cada METRICS_FLUSH_INTERVAL segundos; o worker que atender
+# o /metrics soma os retratos de todos. Contadores e histogramas de workers
+# que já morreram continuam na soma (senão o total "andaria para trás");
+# gauges só contam os processos que deram sinal de vida recentemente. Para a
+# tabela não crescer a cada reinício, um worker novo junta as linhas paradas
+# há mais de METRICS_ARCHIVE_AFTER segundos numa só ('archived', sem gauges).
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+METRICS_DB_PATH = os.environ.get(
+    'METRICS_DB_PATH', os.path.join(tempfile.gettempdir(), 'oficina_metrics.sqlite3')
+)
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Bem acima do intervalo de gravação: um worker só lento não pode ser arquivado
+# (ele regravaria a própria linha e seria contado duas vezes).
+METRICS_ARCHIVE_AFTER = float(os.environ.get('METRICS_ARCHIVE_AFTER', 600))
+METRICS_ARCHIVE_INSTANCE = 'archived'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+STARTUP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60)
+PDF_SIZE_BUCKETS = (10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000)
+
+# nome -> (tipo, descrição, buckets do histograma)
+METRIC_DEFINITIONS = {
+    'oficina_http_requests_total': (
+        'counter', 'Requisições HTTP atendidas, por rota, método e status.', None),
+    'oficina_http_request_duration_seconds': (
+        'histogram', 'Duração das requisições HTTP até o fim do corpo (inclusive streams).', LATENCY_BUCKETS),
+    'oficina_http_requests_in_flight': (
+        'gauge', 'Requisições HTTP em andamento.', None),
+    'oficina_llm_request_duration_seconds': (
+        'histogram', 'Duração de cada tentativa de chamada ao modelo, sem a fila do agendador.', LATENCY_BUCKETS),
+    'oficina_llm_requests_in_flight': (
+        'gauge', 'Chamadas ao modelo em andamento.', None),
+    'oficina_llm_tokens_total': (
+        'counter', 'Tokens contabilizados pelo modelo (usage_metadata).', None),
+    'oficina_llm_json_parse_failures_total': (
+        'counter', 'Respostas (ou elementos de uma lista em streaming) que não eram JSON válido.', None),
+    'oficina_llm_json_repairs_total': (
+        'counter', 'Respostas JSON cortadas que foram aproveitadas até o último elemento completo.', None),
+    'oficina_fallbacks_total': (
+        'counter', 'Vezes em que a rota usou o plano B local no lugar da resposta da IA.', None),
+    'oficina_pdf_render_duration_seconds': (
+        'histogram', 'Tempo de renderização de cada PDF, sem a espera na fila.', LATENCY_BUCKETS),
+    'oficina_pdf_size_bytes': (
+        'histogram', 'Tamanho dos PDFs gerados.', PDF_SIZE_BUCKETS),
+    'oficina_pdf_render_failures_total': (
+        'counter', 'PDFs que não foram gerados.', None),
+    'oficina_pdf_cache_total': (
+        'counter', 'Pedidos de PDF de um poema atendidos pelo cache de PDFs prontos (hit) ou renderizados (miss).', None),
+    'oficina_pdf_jobs_total': (
+        'counter', 'Jobs de PDF assíncronos, por desfecho (done, failed, rejected).', None),
+    'oficina_theme_bank_total': (
+        'counter', 'Consultas ao banco local de temas (hit, miss) e respostas da IA aprendidas (learned).', None),
+    'oficina_similar_interest_total': (
+        'counter', 'Consultas ao cache de temas por semelhança de interesse (hit, miss).', None),
+    'oficina_worker_startup_seconds': (
+        'histogram', 'Tempo de cada etapa da subida de um worker (carga do app e aquecimento).', STARTUP_BUCKETS),
+    'oficina_worker_startup_resident_memory_bytes': (
+        'gauge', 'Memória residente de cada worker vivo ao terminar o aquecimento.', None),
+}
+
+
+class MetricsRegistry:
+    """Métricas do processo, somadas entre os workers do gunicorn via SQLite."""
+
+    def __init__(self, definitions, db_path, flush_interval, enabled=True, archive_after=600):
+        self.definitions = definitions
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.archive_after = archive_after
+        self._values = {}  # (nome, labels) -> número, ou [contagens por bucket, soma, total]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+        self._instance = None
+        self._disk_ok = True
+
+    def _ensure_process(self):
+        # Como no loop do modelo: depois de um fork o worker começa do zero,
+        # com a própria linha no SQLite e a própria thread de gravação.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._values = {}
+            self._local = threading.local()
+            self._pid = os.getpid()
+            self._instance = f"{self._pid}-{time.time():.6f}"
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Soma `amount` a um contador ou gauge (negativo para descer o gauge)."""
+        if not self.enabled:
+            return
+        self._ensure_process()
+        key = (name, self._labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Fixa o valor de um gauge."""
+        if not self.enabled:
+            return
+        self._ensure_process()
+        with self._lock:
+            self._values[(name, self._labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        """Registra uma amostra num histograma."""
+        if not self.enabled:
+            return
+        self._ensure_process()
+        buckets = self.definitions[name][2]
+        key = (name, self._labels(labels))
+        index = bisect.bisect_left(buckets, value)  # primeiro bucket com limite >= valor
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _dump(self):
+        with self._lock:
+            return [[name, labels, [list(v[0]), v[1], v[2]] if isinstance(v, list) else v]
+                    for (name, labels), v in self._values.items()]
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                " instance TEXT PRIMARY KEY, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def flush(self):
+        """Grava o retrato deste processo (também serve de sinal de vida para os gauges)."""
+        if not self._disk_ok or self._pid != os.getpid():
+            return
+        try:
+            self._db().execute(
+                "INSERT OR REPLACE INTO metrics (instance, updated_at, data) VALUES (?, ?, ?)",
+                (self._instance, time.time(), json.dumps(self._dump())),
+            )
+        except sqlite3.Error as e:
+            self._disable_disk(e)
+
+    def _flush_loop(self):
+        self.archive_stale()
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def archive_stale(self):
+        """Junta contadores e histogramas de processos mortos na linha 'archived' e apaga as linhas deles."""
+        if not self._disk_ok:
+            return
+        try:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")  # Dois workers subindo juntos não arquivam a mesma linha.
+            try:
+                rows = conn.execute(
+                    "SELECT instance, data FROM metrics WHERE updated_at < ? AND instance != ?",
+                    (time.time() - self.archive_after, METRICS_ARCHIVE_INSTANCE),
+                ).fetchall()
+                if rows:
+                    archived = conn.execute("SELECT data FROM metrics WHERE instance = ?",
+                                            (METRICS_ARCHIVE_INSTANCE,)).fetchone()
+                    snapshots = [(False, json.loads(data)) for _, data in rows]
+                    if archived is not None:
+                        snapshots.append((False, json.loads(archived[0])))
+                    series = [[name, labels, value] for (name, labels), value in self._merge(snapshots).items()]
+                    conn.execute("INSERT OR REPLACE INTO metrics (instance, updated_at, data) VALUES (?, ?, ?)",
+                                 (METRICS_ARCHIVE_INSTANCE, time.time(), json.dumps(series)))
+                    conn.executemany("DELETE FROM metrics WHERE instance = ?", [(row[0],) for row in rows])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._disable_disk(e)
+            return
+        if rows:
+            print(f"Métricas: {len(rows)} processo(s) parado(s) arquivado(s).")
+
+    def _disable_disk(self, error):
+        print(f"Métricas em disco desativadas (só este processo no /metrics). Erro: {error}")
+        self._disk_ok = False
+
+    def collect(self):
+        """Soma os retratos de todos os processos: {(nome, labels): valor}."""
+        self._ensure_process()
+        self.flush()
+        snapshots = []
+        if self._disk_ok:
+            try:
+                rows = self._db().execute("SELECT instance, updated_at, data FROM metrics").fetchall()
+                alive_since = time.time() - 3 * self.flush_interval
+                snapshots = [(updated_at >= alive_since, json.loads(data))
+                             for instance, updated_at, data in rows if instance != self._instance]
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+        snapshots.append((True, self._dump()))
+        return self._merge(snapshots)
+
+    def _merge(self, snapshots):
+        """Soma retratos [(vivo, série)]; gauges de processos que não estão vivos ficam de fora."""
+        totals = {}
+        for alive, series in snapshots:
+            for name, labels, value in series:
+                definition = self.definitions.get(name)
+                if definition is None or (definition[0] == 'gauge' and not alive):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                current = totals.get(key)
+                if definition[0] != 'histogram':
+                    totals[key] = (current or 0) + value
+                elif current is None:
+                    totals[key] = [list(value[0]), value[1], value[2]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                    current[2] += value[2]
+        return totals
+
+    def render(self):
+        """Texto no formato de exposição do Prometheus (0.0.4)."""
+        by_name = defaultdict(list)
+        for (name, labels), value in self.collect().items():
+            by_name[name].append((labels, value))
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name.get(name, []), key=lambda item: item[0]):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_metric_labels(labels)} {_metric_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, n in zip(list(buckets) + [float('inf')], counts):
+                    cumulative += n
+                    le = (('le', _metric_value(bound)),)
+                    lines.append(f"{name}_bucket{_metric_labels(labels + le)} {cumulative}")
+                lines.append(f"{name}_sum{_metric_labels(labels)} {_metric_value(total)}")
+                lines.append(f"{name}_count{_metric_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels) + '}'
+
+
+def _metric_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+metrics = MetricsRegistry(METRIC_DEFINITIONS, METRICS_DB_PATH, METRICS_FLUSH_INTERVAL, METRICS_ENABLED,
+                          METRICS_ARCHIVE_AFTER)
+
+
+def record_fallback(kind, amount=1):
+    """Conta um acionamento do plano B local (ideias-modelo, rimas do léxico...)."""
+    metrics.inc('oficina_fallbacks_total', amount, kind=kind)
+
+
+def record_llm_usage(scope, usage):
+    """Soma os tokens do usage_metadata da resposta do modelo."""
+    if usage is None:
+        return
+    for kind, attr in (('prompt', 'prompt_token_count'), ('output', 'candidates_token_count')):
+        count = getattr(usage, attr, 0) or 0
+        if count:
+            metrics.inc('oficina_llm_tokens_total', int(count), scope=scope or 'other', kind=kind)
+
+
+@contextlib.contextmanager
+def llm_call_metrics(scope):
+    """Mede uma tentativa de chamada ao modelo (gauge em voo + histograma por resultado)."""
+    scope = scope or 'other'
+    metrics.inc('oficina_llm_requests_in_flight', scope=scope)
+    started = time.monotonic()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    except (TimeoutError, concurrent.futures.TimeoutError):
+        outcome = 'timeout'
+        raise
+    except GeneratorExit:
+        outcome = 'cancelled'  # Cliente desconectou no meio do stream.
+        raise
+    finally:
+        metrics.inc('oficina_llm_requests_in_flight', -1, scope=scope)
+        metrics.observe('oficina_llm_request_duration_seconds', time.monotonic() - started,
+                        scope=scope, outcome=outcome)
+
+
+def observe_pdf(kind, seconds, pdf_bytes):
+    metrics.observe('oficina_pdf_render_duration_seconds', seconds, kind=kind)
+    metrics.observe('oficina_pdf_size_bytes', len(pdf_bytes), kind=kind)
+
+
+def _route_label():
+    # O padrão da rota (ex.: /assets/<name>), nunca a URL crua: cardinalidade fixa.
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def _metrics_request_started():
+    g.metrics_started = time.perf_counter()
+    metrics.inc('oficina_http_requests_in_flight', route=_route_label())
+
+
+@app.after_request
+def _metrics_request_finished(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    route, method, status = _route_label(), request.method, str(response.status_code)
+
+    def finish():
+        # Só no fechamento da resposta: streams (SSE, ZIP) contam até o último byte.
+        metrics.inc('oficina_http_requests_in_flight', -1, route=route)
+        metrics.inc('oficina_http_requests_total', route=route, method=method, status=status)
+        metrics.observe('oficina_http_request_duration_seconds', time.perf_counter() - started,
+                        route=route, method=method)
+
+    response.call_on_close(finish)
+    return response
+
+
+# --- 1.11 SERVER-TIMING, TRACE E PERFIL POR REQUISIÇÃO ---
+# Para investigar uma requisição lenta específica (as métricas acima são
+# agregadas): cada requisição cronometra as suas fases (prompt, fila do
+# agendador, chamada ao modelo, extração e validação do JSON, CSS, HTML e
+# write_pdf) e devolve tudo no cabeçalho Server-Timing, que o DevTools do
+# navegador mostra na aba Network. As fases podem se sobrepor (o CSS do PDF
+# inclui a chamada ao modelo que o gerou) e o cabeçalho só leva o que
+# terminou antes do primeiro byte; nas respostas em streaming o resto
+# aparece no trace. Com TRACE_SAMPLE_RATE > 0, uma amostra das requisições
+# vira uma linha JSON no log. Com PROFILE_SLOW_MS > 0, cada requisição é
+# perfilada (PROFILE_MODE: 'sampling', amostras da pilha da thread, ou
+# 'cprofile') e o perfil das que passarem do limite é salvo em PROFILE_DIR.
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sampling')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'oficina_profiles'))
+
+
+class RequestTiming:
+    """Tempo acumulado por fase numa requisição."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # fase -> [ms, vezes]
+
+    def add(self, name, ms):
+        entry = self.phases.setdefault(name, [0.0, 0])
+        entry[0] += ms
+        entry[1] += 1
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        parts = [f"{name};dur={ms:.1f}" + (f';desc="{count}x"' if count > 1 else '')
+                 for name, (ms, count) in self.phases.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Cronometra uma fase da requisição atual; fora de uma requisição não faz nada.
+
+    Também serve de decorador: @phase('prompt').
+    """
+    timing = g.get('request_timing') if has_request_context() else None
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
     try:
-        genai.configure(api_key=API_KEY)
-        model = genai.GenerativeModel('gemini-flash-latest')
-        print("Modelo 'gemini-flash-latest' configurado com sucesso.")
-        return model
-    except Exception as e:
-        print(f"Erro ao configurar o 'gemini-flash-latest': {e}")
+        yield
+    finally:
+        timing.add(name, (time.perf_counter() - started) * 1000)
+
+
+class StackSampler:
+    """Perfil por amostragem: a cada intervalo, anota a pilha das threads registradas.
+
+    Mede tempo de parede (inclusive esperas de rede e de trava), não só CPU,
+    e funciona com várias requisições perfiladas ao mesmo tempo.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._threads = {}  # ident da thread -> {pilha: amostras}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._pid = None
+
+    def start(self, ident):
+        with self._lock:
+            self._threads[ident] = defaultdict(int)
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+                self._pid = os.getpid()
+            self._active.set()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._threads.pop(ident, None)
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    self._active.clear()
+                    continue
+                frames = sys._current_frames()
+                for ident, counts in self._threads.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                        frame = frame.f_back
+                    if stack:
+                        counts[';'.join(reversed(stack))] += 1
+
+
+stack_sampler = StackSampler(PROFILE_SAMPLE_INTERVAL)
+
+
+class RequestProfile:
+    """Perfil de uma requisição; só é gravado em disco se ela passar de PROFILE_SLOW_MS."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.ident = threading.get_ident()
+        self._profiler = None
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profiler = profiler
+            except ValueError:
+                pass  # Python 3.12+: só um cProfile ativo por processo; esta fica sem perfil.
+        else:
+            stack_sampler.start(self.ident)
+
+    def finish(self, route, elapsed_ms):
+        if self._profiler is not None:
+            self._profiler.disable()
+        samples = stack_sampler.stop(self.ident) if self.mode != 'cprofile' else None
+        if elapsed_ms < PROFILE_SLOW_MS or (self._profiler is None and not samples):
+            return
+        label = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'home'
+        name = f"{datetime.now():%Y%m%d-%H%M%S}-{label}-{elapsed_ms:.0f}ms-{os.getpid()}"
         try:
-            print("Tentando fallback para 'gemini-flash-latest'...")
-            model = genai.GenerativeModel('gemini-flash-latest')
-            print("Modelo 'gemini-flash-latest' configurado com sucesso.")
-            return model
-        except Exception as e2:
-            print(f"Erro ao configurar 'gemini-flash-latest' também: {e2}")
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if self._profiler is not None:
+                path = os.path.join(PROFILE_DIR, name + '.prof')
+                self._profiler.dump_stats(path)
+            else:
+                # Formato "folded" (uma pilha por linha), aceito pelo flamegraph.pl e pelo speedscope.
+                path = os.path.join(PROFILE_DIR, name + '.folded')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.writelines(f"{stack} {count}\n" for stack, count in samples.items())
+        except OSError as e:
+            print(f"[Perfil] Não foi possível gravar o perfil: {e}")
+            return
+        print(f"[Perfil] {route} levou {elapsed_ms:.0f} ms: perfil salvo em {path}")
+
+
+@app.before_request
+def _timing_request_started():
+    g.request_timing = RequestTiming()
+    if PROFILE_SLOW_MS > 0:
+        g.request_profile = RequestProfile(PROFILE_MODE)
+
+
+@app.after_request
+def _timing_request_finished(response):
+    timing = g.get('request_timing')
+    if timing is None:
+        return response
+    response.headers['Server-Timing'] = timing.server_timing()
+    profile = g.pop('request_profile', None)
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    route, method, status = _route_label(), request.method, response.status_code
+
+    def finish():
+        elapsed_ms = timing.elapsed_ms()
+        if profile is not None:
+            profile.finish(route, elapsed_ms)
+        if sampled:
+            print("[Trace] " + json.dumps({
+                "route": route, "method": method, "status": status, "pid": os.getpid(),
+                "total_ms": round(elapsed_ms, 1),
+                "phases": {name: {"ms": round(ms, 1), "count": count} for name, (ms, count) in timing.phases.items()},
+            }, ensure_ascii=False))
+
+    response.call_on_close(finish)
+    return response
+
+
+# --- 1.12 BANCO LOCAL DE TEMAS (SEM IA PARA OS INTERESSES COMUNS) ---
+# A maioria dos interesses da turma cai em poucos assuntos (futebol, games,
+# escola, amigos, animais...). O interesse vira palavras-chave normalizadas
+# (sem acento, no singular, sem palavras vazias) e, se quase todas caem em
+# assuntos do banco curado (temas_ptbr.txt), os 9 temas saem dele, sorteados
+# em rodízio entre os assuntos, sem chamar a IA. Só os interesses que o banco
+# não cobre vão ao modelo, e a resposta alimenta o banco aprendido (SQLite,
+# compartilhado entre os workers) sob as palavras-chave que faltavam. Com o
+# modelo fora do ar, o banco também serve de plano B.
+
+THEME_BANK_PATH = os.environ.get(
+    'THEME_BANK_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temas_ptbr.txt')
+)
+THEME_BANK_DB_PATH = os.environ.get(
+    'THEME_BANK_DB_PATH', os.path.join(tempfile.gettempdir(), 'oficina_theme_bank.sqlite3')
+)
+THEME_BANK_ENABLED = os.environ.get('THEME_BANK_ENABLED', '1') != '0'
+# Fração das palavras-chave do interesse que o banco precisa cobrir.
+THEME_BANK_MIN_COVERAGE = float(os.environ.get('THEME_BANK_MIN_COVERAGE', 0.75))
+THEME_BANK_MAX_LEARNED = int(os.environ.get('THEME_BANK_MAX_LEARNED', 30))  # temas aprendidos por palavra
+THEME_COUNT = 9
+THEME_MAX_CHARS = 60
+THEME_FALLBACK_INTEREST = 'amigos e escola'
+
+_INTEREST_STOPWORDS = {
+    'a', 'o', 'as', 'os', 'um', 'uma', 'uns', 'umas', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'no',
+    'na', 'nos', 'nas', 'com', 'sem', 'para', 'pra', 'pro', 'por', 'pelo', 'pela', 'ao', 'aos', 'que',
+    'se', 'ou', 'mas', 'como', 'quando', 'eu', 'me', 'mim', 'meu', 'minha', 'meus', 'minhas', 'muito',
+    'muita', 'muitos', 'muitas', 'mais', 'tambem', 'gosto', 'gostar', 'gosta', 'adoro', 'amo', 'curto',
+    'sou', 'ser', 'estar', 'ter', 'tenho', 'fazer', 'coisa', 'coisas', 'tudo', 'todo', 'toda', 'todos',
+    'dia', 'dias', 'favorito', 'favorita', 'legal', 'bem', 'quase', 'sempre', 'nao', 'sim', 'and', 'the',
+}
+
+
+def _singular(word):
+    """Plural -> singular, o bastante para casar palavras-chave ('animais' -> 'animal')."""
+    if len(word) <= 3 or not word.endswith('s'):
+        return word
+    if word.endswith(('oes', 'aes')):
+        return word[:-3] + 'ao'
+    if len(word) > 4:
+        for suffix, replacement in (('ais', 'al'), ('eis', 'el'), ('ois', 'ol'), ('uis', 'ul')):
+            if word.endswith(suffix):
+                return word[:-3] + replacement
+    if word.endswith('ns'):
+        return word[:-2] + 'm'
+    if word.endswith(('res', 'zes')):
+        return word[:-2]
+    if word.endswith(('is', 'us')):  # lápis, tênis, ônibus
+        return word
+    return word[:-1]
+
+
+def interest_keywords(text):
+    """Palavras-chave normalizadas de um texto livre, na ordem em que aparecem."""
+    words = re.findall(r"[a-z]+(?:-[a-z]+)*", strip_accents(str(text or '')).lower())
+    return list(dict.fromkeys(_singular(w) for w in words if w not in _INTEREST_STOPWORDS and len(w) > 1))
+
+
+# A mesma lista de palavras proibidas das rimas, já normalizada.
+_THEME_BLOCKLIST = set(interest_keywords(' '.join(RHYME_BLOCKLIST)))
+
+
+class ThemeBank:
+    """Banco curado (arquivo) + banco aprendido com a IA (SQLite)."""
+
+    def __init__(self, path, db_path, min_coverage, max_learned):
+        self.path = path
+        self.db_path = db_path
+        self.min_coverage = min_coverage
+        self.max_learned = max_learned
+        self.topics = {}  # assunto -> lista de temas
+        self.keyword_topics = {}  # palavra-chave -> assuntos
+        self.stats = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._loaded = False
+        self._disk_ok = True
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return self
+        with self._lock:
+            if self._loaded:
+                return self
+            topics, keyword_topics = {}, defaultdict(list)
+            topic = None
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    for line in f:
+                        line = line.strip()
+                        if not line or line.startswith('#'):
+                            continue
+                        header = re.match(r'\[([^\]]+)\]\s*(.*)', line)
+                        if header:
+                            topic = header.group(1).strip()
+                            topics.setdefault(topic, [])
+                            for keyword in interest_keywords(topic + ' ' + header.group(2)):
+                                if topic not in keyword_topics[keyword]:
+                                    keyword_topics[keyword].append(topic)
+                        elif topic is not None:
+                            topics[topic].append(line)
+            except OSError as e:
+                print(f"Banco de temas não encontrado em '{self.path}': {e}")
+            self.topics = topics
+            self.keyword_topics = dict(keyword_topics)
+            self._loaded = True
+        return self
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS learned_themes ("
+                " keyword TEXT NOT NULL, theme TEXT NOT NULL, added_at REAL NOT NULL,"
+                " PRIMARY KEY (keyword, theme))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _learned(self, keywords):
+        """{palavra-chave: [temas aprendidos]} para as palavras fora do banco curado."""
+        if not keywords or not self._disk_ok:
+            return {}
+        learned = defaultdict(list)
+        try:
+            rows = self._db().execute(
+                f"SELECT keyword, theme FROM learned_themes WHERE keyword IN ({','.join('?' * len(keywords))})",
+                list(keywords),
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._disable_disk(e)
+            return {}
+        for keyword, theme in rows:
+            learned[keyword].append(theme)
+        return learned
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        metrics.inc('oficina_theme_bank_total', outcome=name)
+
+    def suggest(self, interest, min_coverage=None, count=THEME_COUNT):
+        """`count` temas do banco para o interesse, ou None se o banco não o cobre."""
+        self.ensure_loaded()
+        min_coverage = self.min_coverage if min_coverage is None else min_coverage
+        keywords = interest_keywords(interest)
+        unknown = [k for k in keywords if k not in self.keyword_topics]
+        learned = self._learned(unknown)
+        covered = len(keywords) - len(unknown) + len(learned)
+        if not covered or covered < min_coverage * len(keywords):
+            self._count('miss')
             return None
 
-def generate_ai_content(prompt_text, force_json=False):
-    """Função central para chamadas de IA, com retry e parsing de JSON."""
-    model = get_model()
-    if model is None:
-        raise Exception("Modelo de IA não inicializado. Verifique a API Key e as permissões no Google Cloud.")
+        # Um "monte" de temas por assunto (ou palavra aprendida), embaralhado;
+        # os temas são tirados em rodízio para a lista variar de assunto.
+        pools = []
+        for keyword in keywords:
+            for topic in self.keyword_topics.get(keyword, ()):
+                pools.append(self.topics[topic])
+            if keyword in learned:
+                pools.append(learned[keyword])
+        piles, seen = [], set()
+        for pool in pools:
+            if id(pool) not in seen:
+                seen.add(id(pool))
+                piles.append(random.sample(pool, len(pool)))
+        themes = []
+        while piles and len(themes) < count:
+            for pile in list(piles):
+                if not pile:
+                    piles.remove(pile)
+                    continue
+                theme = pile.pop()
+                if theme not in themes and len(themes) < count:
+                    themes.append(theme)
+        if len(themes) < count:
+            self._count('miss')
+            return None
+        self._count('hit')
+        return themes
 
-    try:
-        generation_config = {}
-        if force_json:
-            generation_config["response_mime_type"] = "application/json"
+    def learn(self, interest, themes):
+        """Guarda os temas da IA sob as palavras-chave do interesse que o banco não tinha."""
+        self.ensure_loaded()
+        unknown = [k for k in interest_keywords(interest) if k not in self.keyword_topics]
+        if not unknown or not self._disk_ok:
+            return 0
+        rows = []
+        for theme in themes:
+            if not isinstance(theme, str) or not theme.strip() or len(theme) > THEME_MAX_CHARS:
+                continue
+            theme = theme.strip()
+            words = set(interest_keywords(theme))
+            if words & _THEME_BLOCKLIST:
+                continue
+            # O tema vai para as palavras que ele cita; se não cita nenhuma, para todas.
+            for keyword in [k for k in unknown if k in words] or unknown:
+                rows.append((keyword, theme))
+        if not rows:
+            return 0
+        now = time.time()
+        try:
+            conn = self._db()
+            conn.executemany(
+                "INSERT OR IGNORE INTO learned_themes (keyword, theme, added_at) VALUES (?, ?, ?)",
+                [(keyword, theme, now) for keyword, theme in rows],
+            )
+            for keyword in {keyword for keyword, _ in rows}:
+                conn.execute(
+                    "DELETE FROM learned_themes WHERE keyword = ? AND theme NOT IN ("
+                    " SELECT theme FROM learned_themes WHERE keyword = ? ORDER BY added_at DESC LIMIT ?)",
+                    (keyword, keyword, self.max_learned),
+                )
+        except sqlite3.Error as e:
+            self._disable_disk(e)
+            return 0
+        self._count('learned')
+        return len(rows)
 
-        response = model.generate_content(prompt_text, generation_config=generation_config)
-        
-        text = response.text
-        
-        if force_json or '[' in text or '{' in text:
-            match = re.search(r'```(json)?(.*)```', text, re.DOTALL | re.IGNORECASE)
-            if match:
-                text = match.group(2).strip()
-            
-            return json.loads(text)
-        
-        return text
+    def fallback(self, interest):
+        """Temas do banco para quando a IA está fora do ar (cobertura parcial, ou os genéricos)."""
+        return self.suggest(interest, min_coverage=0) or self.suggest(THEME_FALLBACK_INTEREST, min_coverage=0)
+
+    def _disable_disk(self, error):
+        print(f"Banco de temas aprendido desativado (usando só o curado). Erro: {error}")
+        self._disk_ok = False
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['topics'] = len(self.topics)
+        stats['curated_themes'] = sum(len(themes) for themes in self.topics.values())
+        stats['enabled'] = THEME_BANK_ENABLED
+        return stats
+
+
+theme_bank = ThemeBank(THEME_BANK_PATH, THEME_BANK_DB_PATH, THEME_BANK_MIN_COVERAGE, THEME_BANK_MAX_LEARNED)
+
+
+# Cache por semelhança: interesses em texto livre quase nunca se repetem
+# letra por letra ("futebol e videogame", "videogames e futebol!"), então o
+# cache exato do modelo pouco acerta. Cada interesse que foi à IA é guardado
+# pelas suas palavras-chave; um interesse novo vira trigramas de caracteres,
+# assinatura MinHash e faixas LSH, e os candidatos das mesmas faixas são
+# conferidos pelo Jaccard exato. Acima do limiar, a lista de temas do vizinho
+# mais próximo é servida embaralhada. As entradas ficam num SQLite (mesmo
+# arquivo do banco aprendido) e cada worker puxa as novas a cada
+# SIMILAR_INTEREST_SYNC_INTERVAL segundos para o seu índice em memória.
+
+SIMILAR_INTEREST_ENABLED = os.environ.get('SIMILAR_INTEREST_ENABLED', '1') != '0'
+SIMILAR_INTEREST_THRESHOLD = float(os.environ.get('SIMILAR_INTEREST_THRESHOLD', 0.6))
+SIMILAR_INTEREST_MAX_ENTRIES = int(os.environ.get('SIMILAR_INTEREST_MAX_ENTRIES', 5000))
+SIMILAR_INTEREST_TTL = float(os.environ.get('SIMILAR_INTEREST_TTL', AI_CACHE_TTLS['themes']))
+# bandas x linhas = número de permutações. Com 16 x 3, um par com Jaccard
+# 0.6 cai na mesma faixa em ~98% dos casos; os candidatos a mais são
+# descartados pela conferência exata.
+SIMILAR_INTEREST_BANDS = int(os.environ.get('SIMILAR_INTEREST_BANDS', 16))
+SIMILAR_INTEREST_ROWS = int(os.environ.get('SIMILAR_INTEREST_ROWS', 3))
+SIMILAR_INTEREST_SYNC_INTERVAL = float(os.environ.get('SIMILAR_INTEREST_SYNC_INTERVAL', 5))
+
+_MINHASH_PRIME = (1 << 61) - 1
 
-    except Exception as e:
-        print(f"Erro na geração de conteúdo da IA: {e}")
-        error_message = str(e)
-        if "is not found" in error_message:
-             print("!! ERRO 404 DETECTADO: Verifique o nome do modelo e as permissões da API Key !!")
-             raise Exception(f"Erro 404 da API Gemini: {error_message}")
-        
-        raise Exception(f"Falha ao gerar ou processar resposta da IA: {error_message}")
+
+def interest_shingles(keywords):
+    """Trigramas de caracteres das palavras-chave (com bordas), sem ordem."""
+    shingles = set()
+    for keyword in keywords:
+        padded = f" {keyword} "
+        shingles.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(shingles)
+
+
+class SimilarInterestCache:
+    """Índice MinHash/LSH de interesses já respondidos pela IA -> temas."""
+
+    def __init__(self, db_path, threshold, max_entries, ttl, bands, rows, sync_interval):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = rows
+        self.sync_interval = sync_interval
+        rng = random.Random(1)  # as mesmas permutações em todos os workers
+        self._perms = [(rng.randrange(1, _MINHASH_PRIME), rng.randrange(_MINHASH_PRIME))
+                       for _ in range(bands * rows)]
+        self._entries = OrderedDict()  # chave -> (trigramas, assinatura, temas, gravado_em)
+        self._buckets = defaultdict(set)  # (banda, valores) -> chaves
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._synced_at = 0.0
+        self._next_sync = 0.0
+        self._disk_ok = True
+        self.stats = defaultdict(int)
+
+    def _signature(self, shingles):
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for s in shingles]
+        return tuple(min([(a * h + b) % _MINHASH_PRIME for h in hashes]) for a, b in self._perms)
+
+    def _bands(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS similar_interests ("
+                " key TEXT PRIMARY KEY, themes TEXT NOT NULL, added_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS similar_interests_added_at ON similar_interests (added_at)")
+            self._local.conn = conn
+        return conn
+
+    def _put(self, key, themes, added_at):
+        """Insere/atualiza no índice em memória (com a trava tomada)."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            shingles, signature = entry[0], entry[1]
+        else:
+            shingles = interest_shingles(key.split())
+            if not shingles:
+                return
+            signature = self._signature(shingles)
+            for band in self._bands(signature):
+                self._buckets[band].add(key)
+        self._entries[key] = (shingles, signature, themes, added_at)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        shingles, signature, _, _ = self._entries.pop(key)
+        for band in self._bands(signature):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _sync(self):
+        """Traz as entradas gravadas por outros workers desde a última vez."""
+        now = time.time()
+        if not self._disk_ok or now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        since = max(self._synced_at, now - self.ttl)
+        try:
+            rows = self._db().execute(
+                "SELECT key, themes, added_at FROM similar_interests WHERE added_at > ?"
+                " ORDER BY added_at DESC LIMIT ?", (since, self.max_entries),
+            ).fetchall()
+            self._db().execute("DELETE FROM similar_interests WHERE added_at <= ?", (now - self.ttl,))
+        except sqlite3.Error as e:
+            self._disable_disk(e)
+            return
+        with self._lock:
+            for key, themes, added_at in reversed(rows):
+                self._put(key, json.loads(themes), added_at)
+            self._synced_at = max([self._synced_at] + [row[2] for row in rows])
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        metrics.inc('oficina_similar_interest_total', outcome=name)
+
+    def get(self, interest):
+        """Temas (embaralhados) do interesse parecido mais próximo, ou None."""
+        shingles = interest_shingles(interest_keywords(interest))
+        if not shingles:
+            return None
+        self._sync()
+        signature = self._signature(shingles)
+        fresh_since = time.time() - self.ttl
+        best, best_score = None, self.threshold
+        with self._lock:
+            candidates = set()
+            for band in self._bands(signature):
+                candidates |= self._buckets.get(band, set())
+            for key in candidates:
+                other, _, themes, added_at = self._entries[key]
+                if added_at < fresh_since:
+                    continue
+                score = len(shingles & other) / len(shingles | other)
+                if score >= best_score:
+                    best, best_score = themes, score
+        if best is None:
+            self._count('miss')
+            return None
+        self._count('hit')
+        return random.sample(best, len(best))
+
+    def add(self, interest, themes):
+        """Guarda a resposta da IA para um interesse (em memória e no SQLite)."""
+        key = ' '.join(interest_keywords(interest))
+        themes = [t for t in themes if isinstance(t, str) and t.strip()]
+        if not key or not themes:
+            return
+        now = time.time()
+        with self._lock:
+            self._put(key, themes, now)
+        if self._disk_ok:
+            try:
+                self._db().execute(
+                    "INSERT OR REPLACE INTO similar_interests (key, themes, added_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(themes, ensure_ascii=False), now),
+                )
+            except sqlite3.Error as e:
+                self._disable_disk(e)
+
+    def _disable_disk(self, error):
+        print(f"Cache por semelhança em disco desativado (só este worker). Erro: {error}")
+        self._disk_ok = False
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['buckets'] = len(self._buckets)
+        total = stats.get('hit', 0) + stats.get('miss', 0)
+        stats['hit_rate'] = round(stats.get('hit', 0) / total, 4) if total else 0.0
+        stats['threshold'] = self.threshold
+        stats['disk_enabled'] = self._disk_ok
+        return stats
+
+
+similar_interests = SimilarInterestCache(
+    THEME_BANK_DB_PATH, SIMILAR_INTEREST_THRESHOLD, SIMILAR_INTEREST_MAX_ENTRIES, SIMILAR_INTEREST_TTL,
+    SIMILAR_INTEREST_BANDS, SIMILAR_INTEREST_ROWS, SIMILAR_INTEREST_SYNC_INTERVAL,
+)
 
 
 # --- 2. LÓGICA DE IA PEDAGÓGICA (PROMPTS OTIMIZADOS - V3) ---
 # (Toda a lógica do backend Python permanece inalterada)
 
-@app.route('/api/generate-themes', methods=['POST'])
-def api_generate_themes():
-    data = request.json
-    interest = data.get('interest', 'amigos e escola')
-    prompt = f"""
+@phase('prompt')
+def _themes_prompt(interest):
+    return f"""
     Aja como um pedagogo e poeta, especialista em alunos do 6º ano (11-13 anos).
     O aluno escreveu sobre seus interesses: "{interest}"
     Sua tarefa é gerar 9 temas de poemas.
@@ -97,20 +3237,52 @@ def api_generate_themes():
     Exemplo de Resposta:
     ["O cheiro da chuva no asfalto", "A cor do meu jogo favorito", "O silêncio do meu quarto à noite"]
     """
+
+def _local_themes(interest):
+    """Temas sem chamar a IA: do banco curado/aprendido ou de um interesse parecido."""
+    themes = theme_bank.suggest(interest) if THEME_BANK_ENABLED else None
+    if themes is None and SIMILAR_INTEREST_ENABLED:
+        themes = similar_interests.get(interest)
+    return themes
+
+def _remember_themes(interest, themes):
+    """Alimenta o banco aprendido e o cache por semelhança com a resposta da IA."""
+    if THEME_BANK_ENABLED:
+        theme_bank.learn(interest, themes)
+    if SIMILAR_INTEREST_ENABLED:
+        similar_interests.add(interest, themes)
+
+@app.route('/api/generate-themes', methods=['POST'])
+def api_generate_themes():
+    data = request.json
+    interest = data.get('interest', 'amigos e escola')
+    # Interesse comum (banco local) ou parecido com um já respondido: sem IA.
+    themes = _local_themes(interest)
     try:
-        themes = generate_ai_content(prompt, force_json=True)
-        if not isinstance(themes, list) or len(themes) == 0:
-            raise Exception("A IA não retornou uma lista de temas.")
-        return jsonify({"themes": themes})
+        if themes is None:
+            prompt = _themes_prompt(interest)
+            themes = generate_ai_content(
+                prompt, force_json=True, cache_scope='themes',
+                validate=lambda r: isinstance(r, list) and len(r) > 0,
+            )
+            if not isinstance(themes, list) or len(themes) == 0:
+                raise Exception("A IA não retornou uma lista de temas.")
+            _remember_themes(interest, themes)
+        response = jsonify({"themes": themes})
+        # Só depois de enviar a lista: adianta as ideias de cada tema.
+        response.call_on_close(lambda: prefetch_ideas(themes))
+        return response
     except Exception as e:
         print(f"[API /api/generate-themes] Erro: {e}")
-        return jsonify({"error": str(e)}), 500
+        if THEME_BANK_ENABLED and upstream_unhealthy(e):
+            # Modelo fora do ar: os temas do banco seguram a aula.
+            record_fallback('theme_bank')
+            return jsonify({"themes": theme_bank.fallback(interest)})
+        return api_error(e)
 
-@app.route('/api/get-ideas', methods=['POST'])
-def api_get_ideas():
-    data = request.json
-    theme = data.get('theme')
-    prompt = f"""
+@phase('prompt')
+def _ideas_prompt(theme):
+    return f"""
     Aja como um professor de escrita criativa experiente, guiando um aluno de 11 a 13 anos.
     O tema do poema é '{theme}'.
     Sua tarefa é criar uma lista de 5 ideias de como progredir na escrita, focando nos sentidos.
@@ -129,29 +3301,189 @@ def api_get_ideas():
         "Ideia 5..."
     ]
     """
+
+def _valid_ideas(ideas):
+    return isinstance(ideas, list) and len(ideas) == 5 and all(isinstance(i, str) and i.strip() for i in ideas)
+
+# Ideias de vários temas numa única chamada: um objeto {tema: [5 ideias]}.
+# Cada entrada válida também é gravada no cache com a chave da chamada de um
+# tema só, então o clique seguinte em /api/get-ideas já encontra a resposta.
+IDEAS_BATCH_SIZE = int(os.environ.get('IDEAS_BATCH_SIZE', 10))
+IDEAS_BATCH_MAX_THEMES = 30
+
+@phase('prompt')
+def _ideas_batch_prompt(themes):
+    return f"""
+    Aja como um professor de escrita criativa experiente, guiando alunos de 11 a 13 anos.
+    Para CADA tema de poema da lista abaixo, crie 5 ideias de como progredir na escrita, focando nos sentidos.
+    Temas: {json.dumps(themes, ensure_ascii=False)}
+    REGRAS:
+    1.  **Foco nos Sentidos:** Incentive o aluno a pensar em cheiros, sons, cores e sensações.
+    2.  **Simplicidade:** Use um vocabulário direto e acessível.
+    3.  **Formato:** As ideias devem ser perguntas curtas ou comandos criativos.
+    4.  **NÃO ESCREVA VERSOS:** Apenas as 5 ideias de cada tema.
+
+    Formato da Resposta OBRIGATÓRIO (JSON): um objeto em que cada chave é um tema,
+    escrito exatamente como na lista, e o valor é a lista com as 5 ideias.
+    {{"Tema": ["Ideia 1...", "Ideia 2...", "Ideia 3...", "Ideia 4...", "Ideia 5..."]}}
+    """
+
+def generate_ideas_batch(themes, fallback=True):
+    """Ideias para vários temas: {tema: [5 ideias]}.
+
+    Temas já cacheados não vão ao modelo; os demais são pedidos em lotes de
+    IDEAS_BATCH_SIZE. Entradas faltando ou fora do formato recebem as
+    ideias-modelo (ou ficam de fora, com `fallback=False`).
+    """
+    themes = list(dict.fromkeys(t for t in themes if isinstance(t, str) and t.strip()))
+    ttl = AI_CACHE_TTLS.get('ideas', 0) if AI_CACHE_ENABLED else 0
+    keys = {t: AIResponseCache.make_key(_ideas_prompt(t), MODEL_NAME, True) for t in themes}
+    result = {}
+    if ttl > 0:
+        for theme in themes:
+            hit, cached = ai_cache.get(keys[theme])
+            if hit and _valid_ideas(cached):
+                result[theme] = cached
+
+    missing = [t for t in themes if t not in result]
+    for start in range(0, len(missing), IDEAS_BATCH_SIZE):
+        chunk = missing[start:start + IDEAS_BATCH_SIZE]
+        try:
+            answer = generate_ai_content(_ideas_batch_prompt(chunk), force_json=True,
+                                         timeout=LLM_TIMEOUTS['ideas_batch'])
+        except Exception as e:
+            print(f"[Ideias em lote] Erro: {e}")
+            continue
+        if not isinstance(answer, dict):
+            continue
+        by_name = {normalize_theme(k): v for k, v in answer.items()}
+        for theme in chunk:
+            ideas = by_name.get(normalize_theme(theme))
+            if _valid_ideas(ideas):
+                result[theme] = ideas
+                if ttl > 0:
+                    ai_cache.set(keys[theme], ideas, ttl)
+
+    if fallback:
+        filled = [t for t in themes if t not in result]
+        if filled:
+            record_fallback('template_ideas', len(filled))
+        for theme in filled:
+            result[theme] = _template_ideas(theme)
+    return {t: result[t] for t in themes if t in result}
+
+class _SharedIdeasBatch:
+    """Uma chamada em lote compartilhada pelos itens especulativos de um lote de temas."""
+
+    def __init__(self, themes):
+        self.themes = themes
+        self._ideas = None
+        self._lock = threading.Lock()
+
+    def get(self, theme):
+        with self._lock:
+            if self._ideas is None:
+                self._ideas = generate_ideas_batch(self.themes, fallback=False)
+        return self._ideas.get(theme)
+
+def prefetch_ideas(themes):
+    """Agenda, com baixa prioridade, as ideias dos temas que o aluno acabou de receber."""
+    if not SPECULATIVE_ENABLED:
+        return
+    themes = [t for t in themes if isinstance(t, str) and t.strip()]
+    batch = _SharedIdeasBatch(themes)
+    speculative.schedule([(('ideas', t), functools.partial(batch.get, t)) for t in themes])
+
+def _speculative_join_timeout(scope):
+    """Espera por uma especulação em andamento, nunca além do prazo interativo da rota."""
+    return min(SPECULATIVE_JOIN_TIMEOUT, LLM_TIMEOUTS.get(scope, LLM_DEFAULT_TIMEOUT))
+
+def _template_ideas(theme):
+    return [
+        f"Que *cor* o tema '{theme}' teria?",
+        f"Qual é o *cheiro* que te lembra '{theme}'?",
+        f"Tente descrever o *som* principal de '{theme}'.",
+        f"Como seria *tocar* em '{theme}'? (É macio, áspero, frio?)",
+        "Tente usar uma *comparação* (ex: 'rápido como...' ou 'brilhante como...')."
+    ]
+
+@app.route('/api/get-ideas', methods=['POST'])
+def api_get_ideas():
+    data = request.json
+    theme = data.get('theme')
+    # O aluno acabou de escolher o tema: já adianta o estilo do PDF.
+    if theme:
+        pdf_styles.prefetch(theme)
+    prompt = _ideas_prompt(theme)
     try:
-        ideas = generate_ai_content(prompt, force_json=True)
-        if not isinstance(ideas, list) or len(ideas) != 5:
-            ideas = [
-                f"Que *cor* o tema '{theme}' teria?",
-                f"Qual é o *cheiro* que te lembra '{theme}'?",
-                f"Tente descrever o *som* principal de '{theme}'.",
-                f"Como seria *tocar* em '{theme}'? (É macio, áspero, frio?)",
-                "Tente usar uma *comparação* (ex: 'rápido como...' ou 'brilhante como...')."
-            ]
+        # Ideias já adiantadas depois da lista de temas (ver prefetch_ideas).
+        ideas = speculative.take(('ideas', theme), timeout=_speculative_join_timeout('ideas'))
+        if ideas is None:
+            ideas = generate_ai_content(prompt, force_json=True, cache_scope='ideas', validate=_valid_ideas)
+        if not _valid_ideas(ideas):
+            record_fallback('template_ideas')
+            ideas = _template_ideas(theme)
         return jsonify({"ideas": ideas})
     except Exception as e:
         print(f"[API /api/get-ideas] Erro: {e}")
-        return jsonify({"error": str(e)}), 500
+        if upstream_unhealthy(e):
+            # Modelo fora do ar: as ideias-modelo seguram a aula.
+            record_fallback('template_ideas')
+            return jsonify({"ideas": _template_ideas(theme)})
+        return api_error(e)
 
-@app.route('/api/find-rhymes', methods=['POST'])
-def api_find_rhymes():
-    data = request.json
-    word = data.get('word')
-    theme = data.get('theme')
-    if not word:
-        return jsonify({"error": "Nenhuma palavra fornecida."}), 400
-    prompt = f"""
+@app.route('/api/get-ideas/batch', methods=['POST'])
+def api_get_ideas_batch():
+    """Ideias para vários temas de uma vez (ex.: professor preparando a aula)."""
+    data = request.json or {}
+    themes = data.get('themes')
+    if not isinstance(themes, list) or not themes:
+        return jsonify({"error": "Envie 'themes' (lista de temas)."}), 400
+    if len(themes) > IDEAS_BATCH_MAX_THEMES:
+        return jsonify({"error": f"No máximo {IDEAS_BATCH_MAX_THEMES} temas por pedido."}), 400
+    return jsonify({"ideas": generate_ideas_batch(themes)})
+
+def _rhyme_definitions_prompt(words):
+    return f"""
+    Para um aluno de 11 anos, dê uma definição muito curta e simples (máximo 5 palavras)
+    para cada uma destas palavras: {json.dumps(words, ensure_ascii=False)}
+    Formato da Resposta OBRIGATÓRIO (JSON): um objeto {{"palavra": "definição"}}.
+    """
+
+def _clean_definitions(definitions):
+    if not isinstance(definitions, dict):
+        return {}
+    return {str(k).lower(): str(v) for k, v in definitions.items()}
+
+def _rhyme_definitions(words):
+    """Pede à IA, numa única chamada (cacheada), definições curtas para as rimas locais."""
+    try:
+        definitions = generate_ai_content(
+            _rhyme_definitions_prompt(words), force_json=True, cache_scope='rhymes',
+            validate=lambda r: isinstance(r, dict) and len(r) > 0,
+        )
+    except Exception as e:
+        print(f"[API /api/find-rhymes] Definições indisponíveis: {e}")
+        return {}
+    return _clean_definitions(definitions)
+
+def _cached_rhyme_definitions(words):
+    """Definições só se já estiverem no cache; senão, agenda a busca em segundo plano.
+
+    Assim as rimas do léxico respondem sem esperar a IA, e a próxima busca
+    pela mesma palavra já encontra as definições prontas.
+    """
+    key = AIResponseCache.make_key(_rhyme_definitions_prompt(words), MODEL_NAME, True)
+    hit, cached = ai_cache.get(key) if AI_CACHE_ENABLED else (False, None)
+    if hit:
+        return _clean_definitions(cached)
+    if SPECULATIVE_ENABLED:
+        speculative.schedule([(('rhyme_definitions', key), functools.partial(_rhyme_definitions, words))])
+    return {}
+
+@phase('prompt')
+def _rhymes_prompt(word, theme):
+    return f"""
     Aja como um linguista computacional e poeta, especialista em fonética do português brasileiro.
     Sua tarefa é gerar uma lista de palavras que rimam com '{word}' para um aluno de 11 anos, com o tema '{theme}'.
     **REGRA 1: PRECISÃO FONÉTICA TOTAL (A MAIS IMPORTANTE)**
@@ -168,31 +3500,186 @@ def api_find_rhymes():
     - "definicao": Uma definição muito curta e simples (máximo 5 palavras).
     Retorne no mínimo 8 sugestões, se possível.
     """
+
+@app.route('/api/find-rhymes', methods=['POST'])
+def api_find_rhymes():
+    data = request.json
+    word = data.get('word')
+    theme = data.get('theme')
+    if not word:
+        return jsonify({"error": "Nenhuma palavra fornecida."}), 400
+
+    # 1. Motor fonético local: resolve palavras do léxico sem chamar a IA.
+    # As definições vêm do cache; só quem pede "definitions": true espera a IA.
+    local_words, known = find_local_rhymes(word)
+    if known and local_words:
+        definitions = {}
+        want_definitions = data.get('definitions')
+        if RHYME_DEFINITIONS and want_definitions:
+            definitions = _rhyme_definitions(local_words)
+        elif RHYME_DEFINITIONS and want_definitions is None:
+            definitions = _cached_rhyme_definitions(local_words)
+        rhymes = [{"palavra": w, "definicao": definitions.get(w, "")} for w in local_words]
+        return jsonify({"rhymes": rhymes})
+
+    # 2. Palavra fora do vocabulário: a IA decide (o índice local fica de reserva).
+    local_rhymes = [{"palavra": w, "definicao": ""} for w in local_words]
+    prompt = _rhymes_prompt(word, theme)
     try:
-        rhymes = generate_ai_content(prompt, force_json=True)
+        rhymes = generate_ai_content(
+            prompt, force_json=True, cache_scope='rhymes',
+            validate=lambda r: isinstance(r, list) and len(r) > 0,
+        )
         if not isinstance(rhymes, list):
             rhymes = []
         
         rhymes = [r for r in rhymes if isinstance(r, dict) and r.get('palavra', '').lower() != word.lower()]
         
         if not rhymes:
-            rhymes = [{"palavra": "Puxa!", "definicao": f"Não encontrei rimas para '{word}'."}]
+            if local_rhymes:
+                record_fallback('local_rhymes')
+            rhymes = local_rhymes or [{"palavra": "Puxa!", "definicao": f"Não encontrei rimas para '{word}'."}]
             
         return jsonify({"rhymes": rhymes})
     except Exception as e:
         print(f"[API /api/find-rhymes] Erro: {e}")
-        return jsonify({"error": str(e)}), 500
+        if local_rhymes:
+            record_fallback('local_rhymes')
+            return jsonify({"rhymes": local_rhymes})
+        return api_error(e)
 
-@app.route('/api/check-poem', methods=['POST'])
-def api_check_poem():
+# Variantes em streaming (SSE) das três rotas acima. Eventos: "item" (um
+# tema, ideia ou rima), "definitions" (definições das rimas locais, que
+# chegam depois das palavras), "error" e "done".
+
+@app.route('/api/generate-themes/stream', methods=['POST'])
+def api_generate_themes_stream():
     data = request.json
-    text = data.get('text')
-    if not text:
-        return jsonify({"errors": []})
+    interest = data.get('interest', 'amigos e escola')
+    local = _local_themes(interest)
+
+    def events():
+        count = 0
+        themes = []
+        try:
+            if local is not None:
+                items = local
+            else:
+                items = stream_ai_list(_themes_prompt(interest), cache_scope='themes',
+                                       validate=lambda r: len(r) > 0 and all(isinstance(t, str) for t in r))
+            for theme in items:
+                if isinstance(theme, str) and theme.strip():
+                    count += 1
+                    themes.append(theme)
+                    yield sse_event('item', theme)
+            if count == 0:
+                raise Exception("A IA não retornou uma lista de temas.")
+            if local is None:
+                _remember_themes(interest, themes)
+            prefetch_ideas(themes)
+        except Exception as e:
+            print(f"[API /api/generate-themes/stream] Erro: {e}")
+            if count == 0 and THEME_BANK_ENABLED and upstream_unhealthy(e):
+                record_fallback('theme_bank')
+                for theme in theme_bank.fallback(interest):
+                    count += 1
+                    yield sse_event('item', theme)
+            else:
+                yield sse_event('error', error_payload(e))
+        yield sse_event('done', {"count": count})
+
+    return sse_response(events())
+
+@app.route('/api/get-ideas/stream', methods=['POST'])
+def api_get_ideas_stream():
+    data = request.json
+    theme = data.get('theme')
+    if theme:
+        pdf_styles.prefetch(theme)
+    prompt = _ideas_prompt(theme)
+
+    def events():
+        count = 0
+        try:
+            ideas = speculative.take(('ideas', theme), timeout=_speculative_join_timeout('ideas')) or \
+                stream_ai_list(prompt, cache_scope='ideas', validate=lambda r: len(r) == 5)
+            for idea in ideas:
+                if isinstance(idea, str) and count < 5:
+                    count += 1
+                    yield sse_event('item', idea)
+        except Exception as e:
+            print(f"[API /api/get-ideas/stream] Erro: {e}")
+        # Como na rota JSON: completa com as ideias-modelo se a IA falhar.
+        if count < 5:
+            record_fallback('template_ideas')
+        for idea in _template_ideas(theme)[count:5]:
+            yield sse_event('item', idea)
+        yield sse_event('done', {"count": 5})
+
+    return sse_response(events())
+
+@app.route('/api/find-rhymes/stream', methods=['POST'])
+def api_find_rhymes_stream():
+    data = request.json
+    word = data.get('word')
+    theme = data.get('theme')
+    if not word:
+        return jsonify({"error": "Nenhuma palavra fornecida."}), 400
+    want_definitions = RHYME_DEFINITIONS and data.get('definitions', True)
+    local_words, known = find_local_rhymes(word)
+
+    def events():
+        # 1. Palavra do léxico: as rimas locais saem na hora; as definições depois.
+        if known and local_words:
+            for w in local_words:
+                yield sse_event('item', {"palavra": w, "definicao": ""})
+            if want_definitions:
+                yield sse_event('definitions', _rhyme_definitions(local_words))
+            yield sse_event('done', {"count": len(local_words)})
+            return
+
+        # 2. Fora do vocabulário: rimas da IA, uma a uma (as locais de reserva).
+        count = 0
+        try:
+            for rhyme in stream_ai_list(_rhymes_prompt(word, theme), cache_scope='rhymes',
+                                        validate=lambda r: len(r) > 0):
+                if isinstance(rhyme, dict) and rhyme.get('palavra', '').lower() != word.lower():
+                    count += 1
+                    yield sse_event('item', rhyme)
+        except Exception as e:
+            print(f"[API /api/find-rhymes/stream] Erro: {e}")
+            if count == 0 and not local_words:
+                yield sse_event('error', error_payload(e))
+                yield sse_event('done', {"count": 0})
+                return
+        if count == 0:
+            if local_words:
+                record_fallback('local_rhymes')
+            fallback = [{"palavra": w, "definicao": ""} for w in local_words] or \
+                [{"palavra": "Puxa!", "definicao": f"Não encontrei rimas para '{word}'."}]
+            for rhyme in fallback:
+                count += 1
+                yield sse_event('item', rhyme)
+        yield sse_event('done', {"count": count})
+
+    return sse_response(events())
+
+# Revisão por verso: cada verso não vazio tem um hash, e o resultado da
+# revisão (dicionário + IA) fica memorizado por hash no cache ('verse'). Só
+# os versos novos ou alterados são revisados, todos numa única chamada à IA,
+# e os erros voltam com o verse_number atual. O cliente pode mandar só o
+# hash dos versos que não mudaram (ver "verse_hashes" na resposta); se o
+# servidor não conhecer algum, responde com "missing" e o cliente reenvia.
 
-    lines = text.split('\n')
-    numbered_text = "\n".join(f"{i+1}: {line}" for i, line in enumerate(lines) if line.strip())
-    prompt = f"""
+def verse_hash(line):
+    return hashlib.sha256(line.strip().encode('utf-8')).hexdigest()[:16]
+
+def _verse_memo_key(digest):
+    return AIResponseCache.make_key(f"verse-check|{digest}", MODEL_NAME, True)
+
+@phase('prompt')
+def _check_prompt(numbered_text, pending_words):
+    return f"""
     Aja como um professor de português experiente e compreensivo, revisando um poema de um aluno de 11 anos.
     O aluno pode usar liberdade poética.
     **Texto do poema (para Contexto):**
@@ -210,34 +3697,347 @@ def api_check_poem():
     - "suggestions": UMA LISTA de strings (ex: ["começou"]).
     - "reason": Uma única string com o motivo (ex: "Palavra escrita com 's' no lugar de 'ç'").
     - "verse_number": O número da linha (começando em 1).
+    **Palavras a verificar:** {pending_words}
+    O restante do poema já foi revisado: analise APENAS essas palavras (nomes próprios e gírias estão corretos).
     
     Se não houver erros, retorne uma lista vazia [].
     """
+
+def _check_verses(verses):
+    """Revisa [(verse_number, texto)].
+
+    Retorna ({verse_number: [erros]}, verse_numbers revisados por completo,
+    exceção da IA ou None).
+    """
+    results = {}
+    unresolved = []
+    for number, line in verses:
+        errors, pending = local_spell_check([line])
+        results[number] = [dict(e, verse_number=number) for e in errors]
+        unresolved += [(number, word) for _, word in pending]
+    complete = {number for number, _ in verses} - {number for number, _ in unresolved}
+    if not unresolved:
+        return results, complete, None
+
+    numbered_text = "\n".join(f"{number}: {line}" for number, line in verses)
+    pending_words = ", ".join(f"'{word}' (verso {verse})" for verse, word in unresolved)
+    try:
+        errors = generate_ai_content(
+            _check_prompt(numbered_text, pending_words), force_json=True, cache_scope='check',
+            validate=lambda r: isinstance(r, list),
+        )
+    except Exception as e:
+        print(f"[API /api/check-poem] Erro: {e}")
+        return results, complete, e
+    word_verse = {word.lower(): verse for verse, word in unresolved}
+    for error in errors if isinstance(errors, list) else []:
+        if not isinstance(error, dict):
+            continue
+        number = error.get('verse_number')
+        if number not in results:
+            number = word_verse.get(str(error.get('original', '')).lower())
+        if number in results:
+            results[number].append(dict(error, verse_number=number))
+    return results, set(results), None
+
+@app.route('/api/check-poem', methods=['POST'])
+def api_check_poem():
+    data = request.json
+    # Formato antigo: {"text": ...}. Incremental: {"verses": [{"verse_number", "text" | "hash"}]}.
+    if isinstance(data.get('verses'), list):
+        verses = [(v.get('verse_number'), v.get('text'), v.get('hash'))
+                  for v in data['verses'] if isinstance(v, dict) and isinstance(v.get('verse_number'), int)]
+    else:
+        text = data.get('text') or ''
+        verses = [(i + 1, line, None) for i, line in enumerate(text.split('\n'))]
+    verses = [(n, line, digest or verse_hash(line)) for n, line, digest in verses
+              if (line is not None and line.strip()) or (line is None and digest)]
+    if not verses:
+        return jsonify({"errors": [], "verse_hashes": {}})
+
+    # 1. Versos já revisados (mesmo hash) saem da memória.
+    ttl = AI_CACHE_TTLS['verse'] if AI_CACHE_ENABLED else 0
+    errors = []
+    changed = []
+    missing = []
+    for number, line, digest in verses:
+        hit, cached = ai_cache.get(_verse_memo_key(digest)) if ttl > 0 else (False, None)
+        if hit:
+            errors += [dict(e, verse_number=number) for e in cached]
+        elif line is None:
+            missing.append(number)
+        else:
+            changed.append((number, line, digest))
+    if missing:
+        return jsonify({"missing": missing})
+
+    # 2. Só os versos novos ou alterados: dicionário local e, no que ele não
+    #    resolver, uma única chamada à IA para todos eles.
+    partial = False
+    if changed:
+        results, complete, failure = _check_verses([(number, line) for number, line, _ in changed])
+        for number, line, digest in changed:
+            errors += results[number]
+            if ttl > 0 and number in complete:
+                memo = [{k: v for k, v in e.items() if k != 'verse_number'} for e in results[number]]
+                ai_cache.set(_verse_memo_key(digest), memo, ttl)
+        partial = len(complete) < len(changed)
+        # Com o modelo fora do ar, fica a revisão do dicionário (marcada como parcial).
+        if partial and not errors and not (failure is not None and upstream_unhealthy(failure)):
+            return api_error(failure or Exception("Não foi possível revisar o poema agora."))
+
+    errors.sort(key=lambda e: e['verse_number'])
+    response = {"errors": errors, "verse_hashes": {str(n): digest for n, _, digest in verses}}
+    if partial:
+        record_fallback('dictionary_check')
+        response["partial"] = True
+    return jsonify(response)
+
+
+# --- 3. NOVO MOTOR DE GERAÇÃO DE PDF (WeasyPrint) ---
+# (Toda a lógica do backend Python permanece inalterada)
+
+# Pool de processos de renderização: o WeasyPrint roda fora das threads de
+# requisição, em processos já aquecidos (ver pdf_worker.py). A fila é
+# limitada, cada job tem prazo e cada processo é reciclado após N jobs para
+# conter o crescimento de memória. PDF_RENDER_WORKERS=0 renderiza inline.
+# O CSS do tema viaja separado do HTML: cada processo compila uma vez o
+# `weasyprint.CSS` de cada folha e o reaproveita nos PDFs seguintes.
+
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+PDF_RENDER_QUEUE_SIZE = int(os.environ.get('PDF_RENDER_QUEUE_SIZE', 32))
+PDF_RENDER_TIMEOUT = float(os.environ.get('PDF_RENDER_TIMEOUT', 30))
+PDF_RENDER_MAX_JOBS = int(os.environ.get('PDF_RENDER_MAX_JOBS', 200))
+PDF_WORKER_BOOT_TIMEOUT = 60
+
+
+class PdfQueueFull(Exception):
+    """A fila de renderização está cheia."""
+
+
+class PdfRenderTimeout(Exception):
+    """O job de renderização passou do prazo."""
+
+
+class PdfRenderPool:
+    """Pool de processos WeasyPrint com fila limitada, prazo e reciclagem."""
+
+    def __init__(self, workers, queue_size, job_timeout, max_jobs_per_worker):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.stats = defaultdict(int)
+        self._jobs = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Sobe (uma vez por processo) as threads supervisoras e os renderizadores."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._jobs = queue.Queue(maxsize=self.queue_size)
+            for slot in range(self.workers):
+                threading.Thread(target=self._supervise, args=(slot,),
+                                 name=f'pdf-supervisor-{slot}', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, html_string, css_string=None):
+        """Enfileira um job e retorna um Future com os bytes do PDF."""
+        return self.submit_job({'html': html_string, 'css': css_string})
+
+    def submit_job(self, job, timeout=None):
+        """Enfileira um job já montado (ver pdf_worker.serve), com prazo próprio opcional."""
+        self.start()
+        future = concurrent.futures.Future()
+        try:
+            self._jobs.put_nowait((job, timeout or self.job_timeout, future))
+        except queue.Full:
+            self._count('rejected')
+            metrics.inc('oficina_pdf_render_failures_total', kind=_pdf_kind(job), reason='queue_full')
+            raise PdfQueueFull("Muitos PDFs sendo gerados agora. Tente de novo em instantes.")
+        return future
+
+    def wait(self, future, timeout=None):
+        # O supervisor já aplica o prazo do job; a margem cobre o tempo na fila.
+        timeout = (timeout or self.job_timeout) + self.job_timeout * self.queue_size / max(self.workers, 1)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise PdfRenderTimeout("O PDF demorou demais para ficar pronto.")
+
+    def render(self, html_string, css_string=None):
+        return self.wait(self.submit(html_string, css_string))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=pdf_worker.serve, args=(child_conn,), name='pdf-render', daemon=True)
+        proc.start()
+        child_conn.close()
+        if not parent_conn.poll(PDF_WORKER_BOOT_TIMEOUT):
+            self._kill(proc)
+            raise RuntimeError("O processo de PDF não terminou o aquecimento.")
+        parent_conn.recv()
+        self._count('spawned')
+        return proc, parent_conn
+
+    @staticmethod
+    def _kill(proc):
+        if proc is not None and proc.is_alive():
+            proc.kill()
+            proc.join(5)
+
+    def _supervise(self, slot):
+        proc = conn = None
+        jobs_done = 0
+        try:
+            proc, conn = self._spawn()
+        except Exception as e:
+            print(f"[PDF pool {slot}] Falha ao iniciar renderizador: {e}")
+
+        while True:
+            job, timeout, future = self._jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            kind = _pdf_kind(job)
+            try:
+                if proc is None or not proc.is_alive():
+                    proc, conn = self._spawn()
+                    jobs_done = 0
+                started = time.perf_counter()
+                conn.send(job)
+                if not conn.poll(timeout):
+                    self._kill(proc)
+                    proc = None
+                    self._count('timeouts')
+                    metrics.inc('oficina_pdf_render_failures_total', kind=kind, reason='timeout')
+                    future.set_exception(PdfRenderTimeout("O PDF demorou demais para ficar pronto."))
+                    continue
+                status, payload = conn.recv()
+            except Exception as e:
+                self._kill(proc)
+                proc = None
+                self._count('crashes')
+                metrics.inc('oficina_pdf_render_failures_total', kind=kind, reason='crash')
+                future.set_exception(RuntimeError(f"O processo de PDF falhou: {e}"))
+                continue
+
+            jobs_done += 1
+            if status == 'ok':
+                self._count('rendered')
+                observe_pdf(kind, time.perf_counter() - started, payload)
+                future.set_result(payload)
+            else:
+                self._count('errors')
+                metrics.inc('oficina_pdf_render_failures_total', kind=kind, reason='error')
+                future.set_exception(RuntimeError(payload))
+
+            if jobs_done >= self.max_jobs_per_worker:
+                try:
+                    conn.send(None)
+                    proc.join(5)
+                finally:
+                    self._kill(proc)
+                proc = None
+                self._count('recycled')
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._jobs.qsize() if self._jobs is not None else 0
+        stats['workers'] = self.workers
+        return stats
+
+
+pdf_pool = PdfRenderPool(PDF_RENDER_WORKERS, PDF_RENDER_QUEUE_SIZE, PDF_RENDER_TIMEOUT, PDF_RENDER_MAX_JOBS)
+
+
+def _pdf_kind(job):
+    return 'anthology' if 'anthology' in job else 'poem'
+
+
+def _render_inline(kind, fn, *args):
+    """Renderização sem o pool, com as mesmas métricas do supervisor."""
+    started = time.perf_counter()
     try:
-        errors = generate_ai_content(prompt, force_json=True)
-        if not isinstance(errors, list):
-            errors = []
-        return jsonify({"errors": errors})
-    except Exception as e:
-        print(f"[API /api/check-poem] Erro: {e}")
-        return jsonify({"error": str(e)}), 500
+        pdf_bytes = fn(*args)
+    except Exception:
+        metrics.inc('oficina_pdf_render_failures_total', kind=kind, reason='error')
+        raise
+    observe_pdf(kind, time.perf_counter() - started, pdf_bytes)
+    return pdf_bytes
 
 
-# --- 3. NOVO MOTOR DE GERAÇÃO DE PDF (WeasyPrint) ---
-# (Toda a lógica do backend Python permanece inalterada)
+@phase('write_pdf')
+def render_pdf(html_string, css_string=None):
+    """Renderiza pelo pool de processos (ou inline, se o pool estiver desligado)."""
+    if PDF_RENDER_WORKERS <= 0:
+        return _render_inline('poem', pdf_worker.render, html_string, css_string)
+    return pdf_pool.render(html_string, css_string)
 
-@app.route('/api/generate-pdf', methods=['POST'])
-def api_generate_pdf():
-    data = request.json
-    required_fields = ['title', 'author', 'text', 'theme']
-    if not all(field in data for field in required_fields):
-        return jsonify({"error": "Dados incompletos para PDF"}), 400
 
+def submit_pdf(html_string, css_string=None):
+    """Como render_pdf, mas retorna um Future (já resolvido no modo inline)."""
+    if PDF_RENDER_WORKERS > 0:
+        return pdf_pool.submit(html_string, css_string)
+    future = concurrent.futures.Future()
     try:
-        # 1. GERAR O CSS COM A IA
-        style_prompt = f"""
-        Aja como um designer web e gráfico. O tema do poema é "{data['theme']}".
+        future.set_result(_render_inline('poem', pdf_worker.render, html_string, css_string))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+@phase('write_pdf')
+def render_anthology_pdf(title, entries):
+    """Antologia num PDF só: um job inteiro num processo do pool (ou inline)."""
+    if PDF_RENDER_WORKERS <= 0:
+        return _render_inline('anthology', pdf_worker.render_anthology, title, entries)
+    timeout = PDF_RENDER_TIMEOUT * (1 + len(entries) / 10)
+    return pdf_pool.wait(pdf_pool.submit_job({'anthology': entries, 'title': title}, timeout), timeout)
+
+
+# Estilos do PDF por tema: o CSS gerado pela IA é validado uma única vez e
+# guardado por tema normalizado (até PDF_STYLE_VARIANTS variações, usadas em
+# rodízio). A geração começa em segundo plano assim que o aluno escolhe o tema
+# (/api/get-ideas), então ao clicar em "Gerar PDF" só resta renderizar.
+
+PDF_STYLE_VARIANTS = int(os.environ.get('PDF_STYLE_VARIANTS', 3))
+PDF_STYLE_PREFETCH_WORKERS = int(os.environ.get('PDF_STYLE_PREFETCH_WORKERS', 2))  # 0 desliga a pré-geração
+PDF_STYLE_MAX_CSS_CHARS = 6000
+# Rodízio e tentativas de pré-geração por tema, em memória: temas livres não
+# têm fim, então só os mais recentes são lembrados.
+PDF_STYLE_TRACKED_THEMES = int(os.environ.get('PDF_STYLE_TRACKED_THEMES', 2048))
+
+DEFAULT_PDF_CSS = """
+            body { font-family: Arial, sans-serif; background-color: #F0F8FF; color: #333; }
+            h1 { color: #FF6347; font-size: 24pt; text-align: center; border-bottom: 2px solid #FF6347; padding-bottom: 10px; }
+            p { font-size: 12pt; line-height: 1.6; margin-bottom: 10px; }
+            .author { text-align: right; font-style: italic; margin-top: 30px; font-size: 14pt; }
+            """
+
+
+def normalize_theme(theme):
+    """'  O Sol da Manhã! ' -> 'o sol da manha' (chave estável por tema)."""
+    plain = strip_accents(str(theme or '')).lower()
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', plain)).strip()
+
+
+@phase('prompt')
+def _pdf_style_prompt(theme, variant):
+    return f"""
+        Aja como um designer web e gráfico. O tema do poema é "{theme}".
         Sua tarefa é gerar uma string de CSS para estilizar um PDF de poema.
+        Esta é a variação de design número {variant + 1}: escolha uma paleta diferente das anteriores.
         REGRAS:
         1.  Gere CSS para as tags: `body`, `h1`, `p`, e a classe `.author`.
         2.  O design deve ser LÚDICO, COLORIDO e FÁCIL DE LER (bom contraste).
@@ -274,55 +4074,731 @@ def api_generate_pdf():
             color: #555555;
         }}
         """
-        
+
+
+def clean_pdf_css(css_string):
+    """Valida o CSS da IA e retorna a versão limpa, ou None se for inválido.
+
+    Recusa CSS vazio, desbalanceado, sem as regras básicas ou que busque
+    recursos externos (@import/url()), que travariam a renderização.
+    """
+    if not isinstance(css_string, str):
+        return None
+    css = re.sub(r'^\s*```(?:css)?|```\s*$', '', css_string.strip(), flags=re.IGNORECASE).strip()
+    if not css or len(css) > PDF_STYLE_MAX_CSS_CHARS:
+        return None
+    if css.count('{') != css.count('}') or '{' not in css:
+        return None
+    lowered = css.lower()
+    if '@import' in lowered or 'url(' in lowered or '</style' in lowered:
+        return None
+    if not re.search(r'(^|[\s,}])body\s*[{,]', lowered) or not re.search(r'(^|[\s,}])h1\s*[{,]', lowered):
+        return None
+    return css
+
+
+class PdfStyleCache:
+    """Variações de CSS validadas por tema, guardadas no cache da IA (memória + SQLite)."""
+
+    def __init__(self, variants, prefetch_workers, max_tracked=PDF_STYLE_TRACKED_THEMES):
+        self.variants = variants
+        self.max_tracked = max_tracked
+        self._themes = OrderedDict()  # tema normalizado -> [rodízio, tentativas], em LRU
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._prefetch_workers = prefetch_workers
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def _cache_key(normalized_theme):
+        return AIResponseCache.make_key(f"pdf-style-variants|{normalized_theme}", MODEL_NAME, False)
+
+    def _theme_state(self, normalized_theme):
+        """[rodízio, tentativas] do tema. Chamar com self._lock."""
+        state = self._themes.get(normalized_theme)
+        if state is None:
+            state = self._themes[normalized_theme] = [0, 0]
+            while len(self._themes) > self.max_tracked:
+                self._themes.popitem(last=False)
+        else:
+            self._themes.move_to_end(normalized_theme)
+        return state
+
+    def _load(self, normalized_theme):
+        hit, variants = ai_cache.get(self._cache_key(normalized_theme))
+        return list(variants) if hit and isinstance(variants, list) else []
+
+    def _generate_variant(self, theme):
+        """Gera, valida e guarda mais uma variação para o tema. Retorna o CSS ou None."""
+        normalized = normalize_theme(theme)
+        existing = self._load(normalized)
+        if len(existing) >= self.variants:
+            return existing[-1]
+        css = clean_pdf_css(generate_ai_content(_pdf_style_prompt(theme, len(existing)), force_json=False,
+                                                timeout=LLM_TIMEOUTS['pdf_style']))
+        if css is None:
+            with self._lock:
+                self.stats['invalid'] += 1
+            return None
+        # Relê antes de gravar: outro worker pode ter acrescentado variações.
+        variants = self._load(normalized)
+        if css not in variants:
+            variants.append(css)
+        ai_cache.set(self._cache_key(normalized), variants[-self.variants:], AI_CACHE_TTLS['pdf_style'])
+        with self._lock:
+            self.stats['generated'] += 1
+        return css
+
+    @phase('css')
+    def get(self, theme):
+        """CSS para o tema: usa as variações prontas em rodízio ou gera na hora."""
+        normalized = normalize_theme(theme)
+        variants = self._load(normalized)
+        if variants:
+            with self._lock:
+                state = self._theme_state(normalized)
+                turn = state[0]
+                state[0] += 1
+                self.stats['hits'] += 1
+            if len(variants) < self.variants:
+                self.prefetch(theme)
+            return variants[turn % len(variants)]
+
+        with self._lock:
+            self.stats['misses'] += 1
         try:
-            css_string = generate_ai_content(style_prompt, force_json=False)
-            if "{" not in css_string or "}" not in css_string:
-                raise Exception("Estilo CSS retornado pela IA é inválido.")
+            css = self._generate_variant(theme)
         except Exception as e:
             print(f"Falha ao gerar estilo de IA, usando padrão. Erro: {e}")
-            css_string = """
-            body { font-family: Arial, sans-serif; background-color: #F0F8FF; color: #333; }
-            h1 { color: #FF6347; font-size: 24pt; text-align: center; border-bottom: 2px solid #FF6347; padding-bottom: 10px; }
-            p { font-size: 12pt; line-height: 1.6; margin-bottom: 10px; }
-            .author { text-align: right; font-style: italic; margin-top: 30px; font-size: 14pt; }
-            """
+            css = None
+        if css is None:
+            record_fallback('default_pdf_css')
+        return css or DEFAULT_PDF_CSS
+
+    def prefetch(self, theme):
+        """Agenda em segundo plano a geração de uma variação para o tema (sem bloquear)."""
+        normalized = normalize_theme(theme)
+        if not normalized or self._prefetch_workers <= 0:
+            return
+        with self._lock:
+            # Limite de tentativas por tema: a IA pode devolver CSS repetido.
+            state = self._theme_state(normalized)
+            if normalized in self._pending or state[1] >= 2 * self.variants:
+                return
+            self._pending.add(normalized)
+            state[1] += 1
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self._prefetch_workers, thread_name_prefix='pdf-style')
+                self._executor_pid = os.getpid()
+            executor = self._executor
+            self.stats['prefetches'] += 1
+
+        def run():
+            try:
+                self._generate_variant(theme)
+            except Exception as e:
+                print(f"[Estilo PDF] Pré-geração falhou para '{theme}': {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(normalized)
 
-        # 2. GERAR O HTML
-        poem_html = "".join(f"<p>{stanza.replace(os.linesep, '<br>')}</p>" for stanza in data['text'].split(os.linesep * 2))
+        executor.submit(run)
 
-        html_template = f"""
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+            stats['tracked_themes'] = len(self._themes)
+        return stats
+
+
+pdf_styles = PdfStyleCache(PDF_STYLE_VARIANTS, PDF_STYLE_PREFETCH_WORKERS)
+
+
+@phase('html')
+def poem_html_document(poem):
+    """HTML (sem CSS) de um poema com title/author/text, como vai para o PDF."""
+    poem_html = "".join(f"<p>{stanza.replace(os.linesep, '<br>')}</p>" for stanza in poem['text'].split(os.linesep * 2))
+
+    return f"""
         <html>
             <head>
                 <meta charset="UTF-8">
-                <style>{css_string}</style>
             </head>
             <body>
-                <h1>{data['title']}</h1>
+                <h1>{poem['title']}</h1>
                 {poem_html}
-                <p class="author">- {data['author']}</p>
+                <p class="author">- {poem['author']}</p>
             </body>
         </html>
         """
 
-        # 3. RENDERIZAR O PDF (Motor WeasyPrint)
-        html = HTML(string=html_template)
-        pdf_bytes = html.write_pdf()
-        
-        # 4. RETORNAR O PDF
-        safe_filename = re.sub(r'[^a-z0-9]', '_', data['title'].lower(), re.IGNORECASE) or 'poema'
-        
-        return Response(
-            pdf_bytes,
-            mimetype="application/pdf",
-            headers={"Content-disposition": f"attachment; filename={safe_filename}.pdf"}
-        )
-        
+
+def pdf_filename(title, fallback='poema'):
+    """Nome de arquivo só com [a-z0-9_] ('Meu Coração!' -> 'meu_coracao_')."""
+    return re.sub(r'[^a-z0-9]', '_', strip_accents(title.lower())) or fallback
+
+
+# Cache de PDFs prontos, endereçado pelo conteúdo: o arquivo se chama pelo
+# sha256 do HTML (título, autor e texto) + CSS resolvido + folha base, então
+# o mesmo poema com o mesmo estilo nunca é renderizado duas vezes. Um apelido
+# por poema (título, autor, texto e tema) aponta para o último PDF gerado:
+# o clique repetido em "Gerar PDF" nem resolve o estilo de novo (as variações
+# do tema giram em rodízio). Os arquivos ficam em disco, compartilhados entre
+# os workers, e saem por send_file (sendfile do gunicorn, sem cópia) com o
+# hash como ETag. Acima de PDF_CACHE_MAX_BYTES, saem os menos acessados.
+
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'oficina_pdf_cache'))
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+
+
+class PdfOutputCache:
+    """PDFs em arquivos nomeados pelo hash do conteúdo, com índice e LRU num SQLite."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @staticmethod
+    def poem_key(poem):
+        raw = json.dumps([poem['title'], poem['author'], poem['text'], normalize_theme(poem['theme'])])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def content_digest(html_string, css_string):
+        raw = "\0".join([pdf_worker.BASE_CSS, css_string or '', html_string])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(self.directory, f'{digest}.pdf')
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pdf_files ("
+                " digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS pdf_files_last_access ON pdf_files (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS pdf_aliases (poem_key TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+        if name in ('hits', 'misses'):
+            metrics.inc('oficina_pdf_cache_total', amount, outcome=name[:-1] if name == 'hits' else 'miss')
+
+    def open(self, digest):
+        """Arquivo aberto (binário) do PDF, ou None se não está no cache."""
+        try:
+            f = open(self.path(digest), 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            self._db().execute("UPDATE pdf_files SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        except sqlite3.Error as e:
+            print(f"Cache de PDF: falha ao atualizar o índice: {e}")
+        return f
+
+    def lookup(self, poem_key):
+        """(hash, arquivo aberto) do último PDF deste poema, ou None."""
+        row = self._db().execute("SELECT digest FROM pdf_aliases WHERE poem_key = ?", (poem_key,)).fetchone()
+        f = self.open(row[0]) if row is not None else None
+        return (row[0], f) if f is not None else None
+
+    def store(self, digest, pdf_bytes):
+        """Grava o PDF (se ainda não existe) e aplica o limite de tamanho."""
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, path)
+            self._count('stores')
+        conn = self._db()
+        conn.execute("INSERT OR REPLACE INTO pdf_files (digest, size, last_access) VALUES (?, ?, ?)",
+                     (digest, len(pdf_bytes), time.time()))
+        self._evict(conn, keep=digest)
+
+    def alias(self, poem_key, digest):
+        self._db().execute("INSERT OR REPLACE INTO pdf_aliases (poem_key, digest) VALUES (?, ?)", (poem_key, digest))
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pdf_files").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        for digest, size in conn.execute("SELECT digest, size FROM pdf_files ORDER BY last_access").fetchall():
+            if digest == keep:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path(digest))
+            conn.execute("DELETE FROM pdf_files WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM pdf_aliases WHERE digest = ?", (digest,))
+            self._count('evictions')
+            excess -= size
+            if excess <= 0:
+                break
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hits, total = stats.get('hits', 0), stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        try:
+            files, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pdf_files").fetchone()
+            stats.update(files=files, bytes=size, max_bytes=self.max_bytes)
+        except sqlite3.Error:
+            pass
+        return stats
+
+
+pdf_cache = PdfOutputCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+
+
+def cached_poem_pdf(poem):
+    """(hash, arquivo) do PDF do poema: do cache, ou renderizado agora e guardado.
+
+    O arquivo é o do cache, já aberto (pronto para send_file), ou um BytesIO
+    se o disco do cache falhar.
+    """
+    poem_key = pdf_cache.poem_key(poem)
+    try:
+        found = pdf_cache.lookup(poem_key)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Cache de PDF indisponível: {e}")
+        found = None
+    if found is not None:
+        pdf_cache._count('hits')
+        return found
+
+    # Estilo do tema (CSS da IA, já validado e cacheado) + HTML
+    css_string = pdf_styles.get(poem['theme'])
+    html_template = poem_html_document(poem)
+    digest = pdf_cache.content_digest(html_template, css_string)
+    try:
+        f = pdf_cache.open(digest)
+        if f is not None:
+            pdf_cache._count('hits')
+            pdf_cache.alias(poem_key, digest)
+            return digest, f
+    except (OSError, sqlite3.Error) as e:
+        print(f"Cache de PDF indisponível: {e}")
+
+    pdf_cache._count('misses')
+    # O CSS vai à parte para ser compilado uma vez e reaproveitado
+    pdf_bytes = render_pdf(html_template, css_string)
+    try:
+        pdf_cache.store(digest, pdf_bytes)
+        pdf_cache.alias(poem_key, digest)
+        f = pdf_cache.open(digest)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Erro ao guardar PDF no cache: {e}")
+        f = None
+    return digest, f or io.BytesIO(pdf_bytes)
+
+
+def send_pdf(digest, f, filename):
+    """Resposta do PDF com o hash como ETag (arquivo em disco vai por sendfile, sem cópia)."""
+    # Vai o arquivo já aberto, não o caminho: se o LRU apagar o PDF depois do
+    # open(), o descritor continua válido. Para arquivo aberto o send_file não
+    # sabe o tamanho, então Content-Length e Range (make_conditional) ficam aqui.
+    size = f.getbuffer().nbytes if isinstance(f, io.BytesIO) else os.fstat(f.fileno()).st_size
+    response = send_file(f, mimetype="application/pdf", as_attachment=True, download_name=f"{filename}.pdf",
+                         etag=digest, conditional=False, max_age=0)
+    response.content_length = size
+    try:
+        return response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        f.close()
+        raise
+
+
+PDF_REQUIRED_FIELDS = ('title', 'author', 'text', 'theme')
+
+
+def pdf_fields_ok(data):
+    """O poema tem todos os campos do PDF, e como texto? (um número no título quebraria o job.)"""
+    return isinstance(data, dict) and all(isinstance(data.get(field), str) for field in PDF_REQUIRED_FIELDS)
+
+
+@app.route('/api/generate-pdf', methods=['POST'])
+def api_generate_pdf():
+    data = request.json
+    if not pdf_fields_ok(data):
+        return jsonify({"error": "Dados incompletos para PDF"}), 400
+
+    try:
+        digest, f = cached_poem_pdf(data)
+        return send_pdf(digest, f, pdf_filename(data['title']))
+    except PdfQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except PdfRenderTimeout as e:
+        print(f"Erro ao gerar PDF: {e}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Erro ao gerar PDF: {e}")
         return jsonify({"error": f"Erro interno ao gerar PDF: {e}"}), 500
 
 
+# Jobs de PDF: o /api/generate-pdf segura a conexão durante a chamada do CSS
+# à IA e a renderização, o que pode passar do timeout do proxy sob carga.
+# POST /api/pdf-jobs responde na hora com o id do job; o navegador consulta
+# GET /api/pdf-jobs/<id> (queued -> rendering -> done/failed) e baixa o
+# arquivo em /api/pdf-jobs/<id>/download. Cada worker tem uma fila limitada
+# e poucas threads que alimentam o pool de renderização, então uma rajada de
+# cliques em "Gerar PDF" espera a vez em vez de estourar o prazo. O estado
+# fica num SQLite e o PDF pronto vai para o cache de PDFs (acima): a
+# consulta e o download podem cair em qualquer worker. Os jobs expiram após
+# PDF_JOB_TTL; os arquivos saem pelo limite de tamanho do cache.
+
+PDF_JOBS_DIR = os.environ.get('PDF_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'oficina_pdf_jobs'))
+PDF_JOB_WORKERS = int(os.environ.get('PDF_JOB_WORKERS', 4))
+PDF_JOB_QUEUE_SIZE = int(os.environ.get('PDF_JOB_QUEUE_SIZE', 64))
+PDF_JOB_TTL = float(os.environ.get('PDF_JOB_TTL', 60 * 60))
+# Um job parado em queued/rendering por mais que isso morreu com o worker.
+PDF_JOB_MAX_SECONDS = float(os.environ.get('PDF_JOB_MAX_SECONDS', 5 * 60))
+PDF_JOB_SWEEP_INTERVAL = 60
+PDF_JOB_POLL_SECONDS = 1
+
+_PDF_JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+
+class PdfJobQueue:
+    """Fila local de jobs de PDF, com o estado em disco e os PDFs no pdf_cache."""
+
+    def __init__(self, directory, workers, queue_size, ttl, max_seconds):
+        self.directory = directory
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.max_seconds = max_seconds
+        self.stats = defaultdict(int)
+        self._jobs = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_sweep = 0.0
+
+    def start(self):
+        """Sobe (uma vez por processo) as threads que executam os jobs."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._jobs = queue.Queue(maxsize=self.queue_size)
+            self._local = threading.local()
+            for slot in range(self.workers):
+                threading.Thread(target=self._run, name=f'pdf-job-{slot}', daemon=True).start()
+            self._pid = os.getpid()
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, 'jobs.sqlite3'), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pdf_jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT NOT NULL, error TEXT,"
+                " size INTEGER, digest TEXT, updated_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            with contextlib.suppress(sqlite3.OperationalError):  # tabela anterior à coluna
+                conn.execute("ALTER TABLE pdf_jobs ADD COLUMN digest TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS pdf_jobs_expires_at ON pdf_jobs (expires_at)")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+        metrics.inc('oficina_pdf_jobs_total', amount, outcome=name)
+
+    def submit(self, poem):
+        """Registra e enfileira o job; retorna o id. PdfQueueFull se a fila estiver cheia."""
+        self.start()
+        self._sweep()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._db()
+        conn.execute(
+            "INSERT INTO pdf_jobs (id, status, filename, updated_at, expires_at) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, pdf_filename(poem['title']), now, now + self.ttl),
+        )
+        try:
+            self._jobs.put_nowait((job_id, poem))
+        except queue.Full:
+            conn.execute("DELETE FROM pdf_jobs WHERE id = ?", (job_id,))
+            self._count('rejected')
+            raise PdfQueueFull("Muitos PDFs na fila agora. Tente de novo em instantes.")
+        return job_id
+
+    def get(self, job_id):
+        """Estado do job (dict), ou None se o id não existe ou já expirou."""
+        if not _PDF_JOB_ID_RE.fullmatch(job_id):
+            return None
+        row = self._db().execute(
+            "SELECT status, filename, error, size, digest, updated_at, expires_at FROM pdf_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        now = time.time()
+        if row is None or row[6] <= now:
+            return None
+        status, filename, error, size, digest, updated_at, _ = row
+        if status in ('queued', 'rendering') and now - updated_at > self.max_seconds:
+            status, error = 'failed', "O servidor reiniciou antes de terminar este PDF. Gere de novo."
+        return {'status': status, 'filename': filename, 'error': error, 'size': size, 'digest': digest}
+
+    def _set(self, job_id, status, error=None, size=None, digest=None):
+        self._db().execute(
+            "UPDATE pdf_jobs SET status = ?, error = ?, size = ?, digest = ?, updated_at = ? WHERE id = ?",
+            (status, error, size, digest, time.time(), job_id),
+        )
+
+    def _render(self, poem):
+        # Pool de renderização cheio: espera uma vaga, como na antologia em ZIP.
+        give_up = time.monotonic() + PDF_RENDER_TIMEOUT
+        while True:
+            try:
+                return cached_poem_pdf(poem)
+            except PdfQueueFull:
+                if time.monotonic() > give_up:
+                    raise
+                time.sleep(0.5)
+
+    def _run(self):
+        while True:
+            job_id, poem = self._jobs.get()
+            try:
+                self._set(job_id, 'rendering')
+                digest, f = self._render(poem)
+                with f:
+                    if isinstance(f, io.BytesIO):
+                        raise OSError("o cache de PDFs não conseguiu guardar o arquivo.")
+                    size = os.fstat(f.fileno()).st_size
+                self._set(job_id, 'done', size=size, digest=digest)
+                self._count('done')
+            except Exception as e:
+                print(f"Erro no job de PDF {job_id}: {e}")
+                self._count('failed')
+                try:
+                    self._set(job_id, 'failed', error=str(e))
+                except sqlite3.Error:
+                    pass
+
+    def _sweep(self):
+        """Apaga jobs expirados (no máximo uma vez por intervalo); os PDFs ficam no cache."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < PDF_JOB_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        self._db().execute("DELETE FROM pdf_jobs WHERE expires_at <= ?", (now,))
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queued'] = self._jobs.qsize() if self._jobs is not None else 0
+        stats['workers'] = self.workers
+        return stats
+
+
+pdf_jobs = PdfJobQueue(PDF_JOBS_DIR, PDF_JOB_WORKERS, PDF_JOB_QUEUE_SIZE, PDF_JOB_TTL, PDF_JOB_MAX_SECONDS)
+
+
+def _pdf_job_payload(job_id, job):
+    payload = {
+        "job_id": job_id,
+        "status": job['status'],
+        "status_url": f"/api/pdf-jobs/{job_id}",
+    }
+    if job['status'] == 'done':
+        payload["download_url"] = f"/api/pdf-jobs/{job_id}/download"
+        payload["size_bytes"] = job['size']
+    elif job['status'] == 'failed':
+        payload["error"] = job['error']
+    return payload
+
+
+@app.route('/api/pdf-jobs', methods=['POST'])
+def api_submit_pdf_job():
+    data = request.json or {}
+    if not pdf_fields_ok(data):
+        return jsonify({"error": "Dados incompletos para PDF"}), 400
+    try:
+        job_id = pdf_jobs.submit({field: data[field] for field in PDF_REQUIRED_FIELDS})
+    except PdfQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except (OSError, sqlite3.Error) as e:
+        print(f"Erro ao registrar job de PDF: {e}")
+        return jsonify({"error": f"Erro interno ao gerar PDF: {e}"}), 500
+    payload = _pdf_job_payload(job_id, {'status': 'queued'})
+    return jsonify(payload), 202, {"Location": payload["status_url"], "Retry-After": str(PDF_JOB_POLL_SECONDS)}
+
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+def api_pdf_job_status(job_id):
+    job = pdf_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "PDF não encontrado (ou já expirou). Gere de novo."}), 404
+    headers = {"Cache-Control": "no-store"}
+    if job['status'] in ('queued', 'rendering'):
+        headers["Retry-After"] = str(PDF_JOB_POLL_SECONDS)
+    return jsonify(_pdf_job_payload(job_id, job)), 200, headers
+
+
+@app.route('/api/pdf-jobs/<job_id>/download', methods=['GET'])
+def api_pdf_job_download(job_id):
+    job = pdf_jobs.get(job_id)
+    if job is not None and job['status'] != 'done':
+        return jsonify(_pdf_job_payload(job_id, job)), 409
+    # Arquivo do cache de PDFs, enviado por sendfile; qualquer worker serve.
+    f = pdf_cache.open(job['digest']) if job is not None else None
+    if f is None:
+        return jsonify({"error": "PDF não encontrado (ou já expirou). Gere de novo."}), 404
+    return send_pdf(job['digest'], f, job['filename'])
+
+
+
+# Antologia da turma: vários poemas de uma vez, num PDF único com sumário ou
+# num ZIP com um PDF por poema. Os estilos dos temas são resolvidos em
+# paralelo; no ZIP os poemas são renderizados em paralelo pelo pool e cada
+# arquivo é enviado ao navegador assim que fica pronto.
+
+ANTHOLOGY_MAX_POEMS = int(os.environ.get('ANTHOLOGY_MAX_POEMS', 40))
+ANTHOLOGY_STYLE_WORKERS = 8
+
+
+class _ZipStream:
+    """Destino só de escrita do zipfile: guarda os bytes até o próximo envio."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+@phase('css')
+def _anthology_styles(themes):
+    """CSS de cada tema distinto, buscando os que faltam em paralelo."""
+    themes = list(dict.fromkeys(themes))
+    workers = max(1, min(len(themes), ANTHOLOGY_STYLE_WORKERS))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='anthology-style') as executor:
+        return dict(zip(themes, executor.map(pdf_styles.get, themes)))
+
+
+def _stream_anthology_zip(entries):
+    """Gera o ZIP aos pedaços, mantendo poucos PDFs na fila do pool por vez."""
+    out = _ZipStream()
+    window = max(PDF_RENDER_WORKERS, 1) * 2
+    todo = list(entries)
+    pending = {}
+    full_since = None
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as archive:
+        while todo or pending:
+            while todo and len(pending) < window:
+                entry = todo[0]
+                try:
+                    pending[submit_pdf(entry['html'], entry['css'])] = entry['filename']
+                except PdfQueueFull:
+                    # Fila cheia por causa de outros usuários: espera uma vaga.
+                    full_since = full_since or time.monotonic()
+                    if pending:
+                        break
+                    if time.monotonic() - full_since < PDF_RENDER_TIMEOUT:
+                        time.sleep(0.5)
+                        continue
+                    archive.writestr(entry['filename'][:-4] + '_ERRO.txt', "A fila de PDFs estava cheia.")
+                full_since = None
+                todo.pop(0)
+            if not pending:
+                continue
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                filename = pending.pop(future)
+                try:
+                    archive.writestr(filename, future.result())
+                except Exception as e:
+                    print(f"Erro ao gerar PDF da antologia ({filename}): {e}")
+                    archive.writestr(filename[:-4] + '_ERRO.txt', f"Não foi possível gerar este PDF: {e}")
+            yield out.drain()
+    yield out.drain()
+
+
+@app.route('/api/generate-anthology', methods=['POST'])
+def api_generate_anthology():
+    data = request.json or {}
+    poems = data.get('poems')
+    output = data.get('format', 'pdf')
+    title = data.get('title') if isinstance(data.get('title'), str) else None
+    title = (title or 'Antologia da Turma').strip()
+    if not isinstance(poems, list) or not poems or output not in ('pdf', 'zip'):
+        return jsonify({"error": "Envie 'poems' (lista) e 'format' ('pdf' ou 'zip')."}), 400
+    if len(poems) > ANTHOLOGY_MAX_POEMS:
+        return jsonify({"error": f"No máximo {ANTHOLOGY_MAX_POEMS} poemas por antologia."}), 400
+    if not all(pdf_fields_ok(p) for p in poems):
+        return jsonify({"error": "Dados incompletos para PDF"}), 400
+
+    styles = _anthology_styles(p['theme'] for p in poems)
+    entries = [{
+        'html': poem_html_document(p),
+        'css': styles[p['theme']],
+        'title': p['title'],
+        'author': p['author'],
+        'filename': f"{i:02d}_{pdf_filename(p['title'])}.pdf",
+    } for i, p in enumerate(poems, 1)]
+    safe_filename = pdf_filename(title, 'antologia')
+
+    if output == 'zip':
+        response = Response(_stream_anthology_zip(entries), mimetype="application/zip")
+        # O werkzeug monta o cabeçalho (aspas quando preciso), como no send_file.
+        response.headers.set('Content-Disposition', 'attachment', filename=f"{safe_filename}.zip")
+        return response
+
+    try:
+        pdf_bytes = render_anthology_pdf(title, [{k: e[k] for k in ('html', 'css', 'title', 'author')} for e in entries])
+        return send_file(io.BytesIO(pdf_bytes), mimetype="application/pdf", as_attachment=True,
+                         download_name=f"{safe_filename}.pdf")
+    except PdfQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    except PdfRenderTimeout as e:
+        print(f"Erro ao gerar antologia: {e}")
+        return jsonify({"error": str(e)}), 504
+    except Exception as e:
+        print(f"Erro ao gerar antologia: {e}")
+        return jsonify({"error": f"Erro interno ao gerar PDF: {e}"}), 500
+
 # --- 4. TEMPLATE DO FRONTEND (HTML/CSS/JS - V3 - VISUAL ATUALIZADO) ---
 
 # Frontend completo embutido em uma string Python.
@@ -893,7 +5369,8 @@ HTML_TEMPLATE = """
             const appState = {
                 chosenTheme: '',
                 poemText: '',
-                currentErrors: []
+                currentErrors: [],
+                verseHashes: {} // texto do verso -> hash já revisado pelo servidor
             };
 
             const stages = {
@@ -961,6 +5438,72 @@ HTML_TEMPLATE = """
                 }
             }
 
+            // --- Job de PDF: consulta o estado até o arquivo ficar pronto ---
+            async function waitForPdfJob(job) {
+                showLoading(true);
+                try {
+                    while (true) {
+                        const response = await fetch(job.status_url);
+                        const data = await response.json();
+                        if (!response.ok) {
+                            throw new Error(data.error || `Erro na API: ${response.statusText}`);
+                        }
+                        if (data.status === 'done') return data.download_url;
+                        if (data.status === 'failed') throw new Error(data.error || 'Falha ao gerar o PDF.');
+                        const wait = Number(response.headers.get('Retry-After')) || 1;
+                        await new Promise(resolve => setTimeout(resolve, wait * 1000));
+                    }
+                } catch (error) {
+                    console.error('Erro no job de PDF:', error);
+                    showToast(`Não foi possível gerar o PDF: ${error.message}`, true);
+                    return null;
+                } finally {
+                    showLoading(false);
+                }
+            }
+
+            // --- Streaming (SSE via fetch): cada item chega assim que a IA o termina ---
+            async function streamAPI(endpoint, body, handlers) {
+                try {
+                    const response = await fetch(endpoint, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify(body)
+                    });
+                    if (!response.ok || !response.body) {
+                        throw new Error(`Erro na API: ${response.statusText}`);
+                    }
+
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                            const rawEvent = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            let eventName = 'message';
+                            let dataText = '';
+                            rawEvent.split('\\n').forEach(line => {
+                                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                                else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+                            });
+                            const payload = dataText ? JSON.parse(dataText) : null;
+                            if (eventName === 'error') throw new Error(payload.error);
+                            if (handlers[eventName]) handlers[eventName](payload);
+                        }
+                    }
+                    return true;
+                } catch (error) {
+                    console.error('Erro no streamAPI:', error);
+                    showToast(`Ocorreu um erro ao conectar com o assistente: ${error.message}`, true);
+                    return false;
+                }
+            }
+
             // --- ETAPA 1: Lógica de Interesses ---
             const interestInput = document.getElementById('interest-input');
             const interestError = document.getElementById('interest-error');
@@ -972,20 +5515,27 @@ HTML_TEMPLATE = """
                 }
                 interestError.style.display = 'none';
                 
-                const data = await fetchAPI('/api/generate-themes', { interest });
-                if (data && data.themes) {
-                    const themeButtons = document.getElementById('theme-buttons');
-                    themeButtons.innerHTML = ''; // Limpa temas antigos
-                    data.themes.forEach(theme => {
+                // O carregamento só cobre a espera pelo primeiro tema; os demais
+                // vão aparecendo na tela conforme chegam.
+                const themeButtons = document.getElementById('theme-buttons');
+                let received = 0;
+                showLoading(true);
+                await streamAPI('/api/generate-themes/stream', { interest }, {
+                    item: theme => {
+                        if (received++ === 0) {
+                            themeButtons.innerHTML = ''; // Limpa temas antigos
+                            showLoading(false);
+                            showStage('theme');
+                        }
                         const button = document.createElement('button');
                         button.textContent = theme;
                         button.className = 'btn-secondary'; // Usa o novo estilo
                         button.title = theme;
                         button.onclick = () => handleThemeChoice(theme);
                         themeButtons.appendChild(button);
-                    });
-                    showStage('theme');
-                }
+                    }
+                });
+                showLoading(false);
             });
 
             // --- ETAPA 2: Lógica de Temas ---
@@ -998,20 +5548,20 @@ HTML_TEMPLATE = """
                 const ideasList = document.getElementById('progression-ideas-list');
                 ideasList.innerHTML = '<li class="placeholder">A carregar ideias...</li>';
                 
-                const data = await fetchAPI('/api/get-ideas', { theme });
-                
-                ideasList.innerHTML = ''; // Limpa
-                if (data && data.ideas) {
-                    data.ideas.forEach(idea => {
+                // A oficina abre na hora; as ideias entram na lista uma a uma.
+                showStage('writing');
+                let received = 0;
+                const ok = await streamAPI('/api/get-ideas/stream', { theme }, {
+                    item: idea => {
+                        if (received++ === 0) ideasList.innerHTML = ''; // Limpa
                         const li = document.createElement('li');
                         li.textContent = idea;
                         ideasList.appendChild(li);
-                    });
-                } else {
+                    }
+                });
+                if (!ok && received === 0) {
                     ideasList.innerHTML = '<li class="placeholder" style="color: red;">Erro ao carregar ideias.</li>';
                 }
-                
-                showStage('writing');
             }
 
             // --- ETAPA 3: Lógica da Oficina de Poemas ---
@@ -1041,22 +5591,33 @@ HTML_TEMPLATE = """
                 if (!word) return;
                 
                 rhymeResults.innerHTML = '<p class="placeholder">Buscando...</p>';
-                const data = await fetchAPI('/api/find-rhymes', { word, theme: appState.chosenTheme });
-                
-                rhymeResults.innerHTML = ''; // Limpa
-                if (data && data.rhymes) {
-                    if (data.rhymes[0].palavra === "Erro" || data.rhymes[0].palavra === "Puxa!") {
-                        rhymeResults.innerHTML = `<p class="placeholder">${data.rhymes[0].definicao}</p>`;
-                    } else {
-                        const list = document.createElement('ul');
-                        data.rhymes.forEach(r => {
-                            const li = document.createElement('li');
-                            li.innerHTML = `<strong>${r.palavra}:</strong> <span>${r.definicao}</span>`;
-                            list.appendChild(li);
+                let list = null;
+                const ok = await streamAPI('/api/find-rhymes/stream', { word, theme: appState.chosenTheme }, {
+                    item: r => {
+                        if (r.palavra === "Erro" || r.palavra === "Puxa!") {
+                            rhymeResults.innerHTML = `<p class="placeholder">${r.definicao}</p>`;
+                            return;
+                        }
+                        if (!list) {
+                            rhymeResults.innerHTML = ''; // Limpa
+                            list = document.createElement('ul');
+                            rhymeResults.appendChild(list);
+                        }
+                        const li = document.createElement('li');
+                        li.dataset.palavra = r.palavra.toLowerCase();
+                        li.innerHTML = `<strong>${r.palavra}:</strong> <span>${r.definicao}</span>`;
+                        list.appendChild(li);
+                    },
+                    // Rimas locais: as definições chegam depois das palavras.
+                    definitions: defs => {
+                        if (!list) return;
+                        list.querySelectorAll('li').forEach(li => {
+                            const def = defs[li.dataset.palavra];
+                            if (def) li.querySelector('span').textContent = def;
                         });
-                        rhymeResults.appendChild(list);
                     }
-                } else {
+                });
+                if (!ok && !list) {
                     rhymeResults.innerHTML = '<p class="placeholder" style="color: red;">Falha ao buscar rimas.</p>';
                 }
             });
@@ -1065,9 +5626,28 @@ HTML_TEMPLATE = """
             document.getElementById('btn-check-spelling').addEventListener('click', async () => {
                 if (!appState.poemText) return;
                 
-                const data = await fetchAPI('/api/check-poem', { text: appState.poemText });
+                // Versos que não mudaram vão só como hash; o servidor revisa apenas o resto.
+                const lines = appState.poemText.split('\\n');
+                const buildVerses = resendAll => lines
+                    .map((line, i) => ({ line, verse_number: i + 1 }))
+                    .filter(v => v.line.trim())
+                    .map(v => {
+                        const hash = appState.verseHashes[v.line.trim()];
+                        return (hash && !resendAll.has(v.verse_number))
+                            ? { verse_number: v.verse_number, hash }
+                            : { verse_number: v.verse_number, text: v.line };
+                    });
+
+                let data = await fetchAPI('/api/check-poem', { verses: buildVerses(new Set()) });
+                if (data && data.missing) {
+                    data = await fetchAPI('/api/check-poem', { verses: buildVerses(new Set(data.missing)) });
+                }
                 if (data) {
                     appState.currentErrors = data.errors || [];
+                    appState.verseHashes = {};
+                    Object.entries(data.verse_hashes || {}).forEach(([num, hash]) => {
+                        appState.verseHashes[lines[num - 1].trim()] = hash;
+                    });
                     renderCorrections();
                 }
             });
@@ -1162,23 +5742,21 @@ HTML_TEMPLATE = """
                 }
                 pdfError.style.display = 'none';
                 
-                const blob = await fetchAPI('/api/generate-pdf', {
+                const job = await fetchAPI('/api/pdf-jobs', {
                     title,
                     author,
                     text: appState.poemText,
                     theme: appState.chosenTheme
                 });
+                const downloadUrl = job && await waitForPdfJob(job);
 
-                if (blob) {
-                    const url = window.URL.createObjectURL(blob);
+                if (downloadUrl) {
+                    // O servidor manda o arquivo como anexo: o navegador baixa direto
                     const a = document.createElement('a');
                     a.style.display = 'none';
-                    a.href = url;
-                    const safeFilename = title.replace(/[^a-z0-9]/gi, '_').toLowerCase();
-                    a.download = `${safeFilename || 'meu_poema'}.pdf`;
+                    a.href = downloadUrl;
                     document.body.appendChild(a);
                     a.click();
-                    window.URL.revokeObjectURL(url);
                     document.body.removeChild(a);
                 }
             });
@@ -1193,25 +5771,194 @@ HTML_TEMPLATE = """
 """
 
 # --- 5. ROTA PRINCIPAL DO FLASK ---
+# O frontend é compilado uma vez, na importação: o <style> e o <script>
+# embutidos viram arquivos com o hash no nome (/assets/app.<hash>.css|js,
+# cache de um ano) e o HTML que sobra é revalidado a cada visita. Tudo já
+# fica comprimido em gzip e brotli, com ETag forte, então uma visita repetida
+# é só um GET condicional respondido com 304.
+
+FRONTEND_SPLIT_ASSETS = os.environ.get('FRONTEND_SPLIT_ASSETS', '1') != '0'
+FRONTEND_HTML_CACHE_CONTROL = 'no-cache'
+FRONTEND_ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class StaticAsset:
+    """Conteúdo fixo pré-comprimido (gzip/brotli), com ETag forte pelo hash."""
+
+    _ETAG_SUFFIX = {'identity': '', 'gzip': '-gz', 'br': '-br'}
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': body}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding):
+        return self.digest + self._ETAG_SUFFIX[encoding]
+
+    def _negotiate(self):
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted[encoding] > 0:
+                return encoding
+        return 'identity'
+
+    def response(self):
+        """Resposta para a requisição atual: 304 ou o corpo na melhor codificação aceita."""
+        encoding = self._negotiate()
+        # Qualquer variante vale para o 304: o conteúdo é o mesmo.
+        if any(request.if_none_match.contains(self.etag(e)) for e in self.variants):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], mimetype=self.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(self.etag(encoding))
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def compile_frontend(template, split_assets=True):
+    """Renderiza o template uma vez e retorna (página, {nome: asset})."""
+    html = app.jinja_env.from_string(template).render()
+    assets = {}
+    if split_assets:
+        for tag, ext, mimetype, reference in (
+            ('style', 'css', 'text/css', '<link rel="stylesheet" href="{}">'),
+            ('script', 'js', 'application/javascript', '<script src="{}"></script>'),
+        ):
+            match = re.search(rf'<{tag}>(.*?)</{tag}>', html, re.DOTALL)
+            if not match:
+                continue
+            asset = StaticAsset(match.group(1).encode('utf-8'), mimetype, FRONTEND_ASSET_CACHE_CONTROL)
+            name = f"app.{asset.digest}.{ext}"
+            assets[name] = asset
+            html = html[:match.start()] + reference.format(f"/assets/{name}") + html[match.end():]
+    page = StaticAsset(html.encode('utf-8'), 'text/html', FRONTEND_HTML_CACHE_CONTROL)
+    return page, assets
+
+
+frontend_page, frontend_assets = compile_frontend(HTML_TEMPLATE, FRONTEND_SPLIT_ASSETS)
+
 
 @app.route('/')
 def home():
     """Serve o frontend principal (HTML/CSS/JS)."""
-    return render_template_string(HTML_TEMPLATE)
+    return frontend_page.response()
+
+@app.route('/assets/<name>')
+def frontend_asset(name):
+    """CSS/JS do frontend, com o hash do conteúdo no nome."""
+    asset = frontend_assets.get(name)
+    if asset is None:
+        abort(404)
+    return asset.response()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas no formato texto do Prometheus, somadas entre os workers."""
+    if not METRICS_ENABLED:
+        abort(404)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/cache-stats', methods=['GET'])
+def api_cache_stats():
+    """Contadores do cache da IA, do single-flight, da especulação, do agendador e do PDF."""
+    stats = ai_cache.snapshot()
+    stats['single_flight'] = single_flight.snapshot()
+    stats['pdf_pool'] = pdf_pool.snapshot()
+    stats['pdf_jobs'] = pdf_jobs.snapshot()
+    stats['pdf_cache'] = pdf_cache.snapshot()
+    stats['pdf_styles'] = pdf_styles.snapshot()
+    stats['speculative'] = speculative.snapshot()
+    stats['theme_bank'] = theme_bank.snapshot()
+    stats['similar_interests'] = similar_interests.snapshot()
+    stats['llm_scheduler'] = llm_scheduler.snapshot()
+    stats['llm_resilience'] = dict(llm_resilience_stats, breaker=llm_breaker.snapshot())
+    stats['startup'] = startup_report
+    return jsonify(stats)
 
 # --- 6. INICIALIZAÇÃO DA APLICAÇÃO ---
 
+# O gunicorn nunca executa o bloco __main__: cada worker chama warm_up() no
+# hook post_worker_init (ver gunicorn.conf.py), antes de aceitar conexões.
+# Assim a primeira requisição não paga a configuração do modelo nem a carga
+# do léxico, do índice ortográfico e do banco de temas. O relatório de
+# subida (tempo de cada etapa e memória do worker) sai no log como
+# [Startup], no /api/cache-stats e nas métricas oficina_worker_startup_*.
+
+STARTUP_WARM_INDEXES = os.environ.get('STARTUP_WARM_INDEXES', '1') != '0'
+
+startup_report = {}
+
+
+def process_rss_bytes():
+    """Memória residente deste processo (Linux, via /proc), ou None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def warm_up(started=None):
+    """Prepara o processo para atender e registra o custo de cada etapa.
+
+    `started` é o perf_counter() do fork do worker: a etapa 'load' (importar
+    o app) é medida a partir dele.
+    """
+    steps = [('model', get_model), ('pdf_pool', pdf_pool.start)]
+    if STARTUP_WARM_INDEXES:
+        steps += [('lexicon', lexicon.ensure_loaded), ('spell_index', spell_index.ensure_loaded),
+                  ('theme_bank', theme_bank.ensure_loaded)]
+
+    phases = {}
+    if started is not None:
+        phases['load'] = time.perf_counter() - started
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"[Startup] Falha no aquecimento '{name}': {e}")
+        phases[name] = time.perf_counter() - step_started
+
+    rss = process_rss_bytes()
+    startup_report.clear()
+    startup_report.update({
+        'pid': os.getpid(),
+        'total_ms': round(sum(phases.values()) * 1000, 1),
+        'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in phases.items()},
+        'rss_mb': round(rss / 2**20, 1) if rss is not None else None,
+        'weasyprint_loaded': 'weasyprint' in sys.modules,
+    })
+    for name, seconds in phases.items():
+        metrics.observe('oficina_worker_startup_seconds', seconds, phase=name)
+    if rss is not None:
+        metrics.set('oficina_worker_startup_resident_memory_bytes', rss, pid=os.getpid())
+    metrics.flush()
+    print(f"[Startup] {json.dumps(startup_report)}")
+    return startup_report
+
 if __name__ == '__main__':
     # Verifica a chave de API na inicialização
-    if not API_KEY:
+    if MODEL_BACKEND == 'gemini' and not API_KEY:
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         print("!! AVISO: A GOOGLE_API_KEY não está configurada.         !!")
         print("!! Defina-a como uma variável de ambiente para a IA     !!")
         print("!! funcionar. (ex: export GOOGLE_API_KEY='sua_chave')   !!")
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
     
-    # Inicializa o modelo na inicialização para verificar a chave
-    get_model()
+    # Configura o modelo (verifica a chave), sobe o pool de PDF e carrega os índices
+    warm_up()
     
     # Configura a porta para produção (Render) ou 5000 para desenvolvimento
     port = int(os.environ.get("PORT", 5000))
@@ -0,0 +1,390 @@
+"""Benchmark de carga das rotas /api/* com o modelo falso (sem gastar cota).
+
+Uso:
+    python bench_load.py                                  # gthread:2:200, 30 clientes, 20 s
+    python bench_load.py --server gthread:2:200 --server sync:8:1 --concurrency 50
+    python bench_load.py --routes themes,rhymes,check --duration 60
+    python bench_load.py --save base.json                 # guarda o resultado
+    python bench_load.py --baseline base.json             # código 1 se piorar além do limite
+    python bench_load.py --url http://127.0.0.1:8000      # servidor já no ar
+
+Para cada --server (classe:workers:threads) sobe o gunicorn com
+MODEL_BACKEND=fake (latência, erros e tokens do modelo falso pelas variáveis
+FAKE_MODEL_*, ver fake_model.py) e caches temporários, dispara as rotas numa
+mistura ponderada com N clientes simultâneos (cada um com a sua conexão
+keep-alive) e mostra, por rota, vazão, p50/p95/p99 e erros, além da memória
+(RSS) somada do gunicorn, dos workers e dos processos de PDF.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BOOT_TIMEOUT = 180
+
+INTERESTS = ["futebol e videogame", "gatos e cachorros", "praia nas férias", "música e dança",
+             "desenho e pintura", "skate na praça", "dias de chuva", "dinossauros"]
+THEMES = ["O barulho do sinal do recreio", "Meu tênis de futsal gasto", "O cheiro da chuva no asfalto",
+          "A cor do meu jogo favorito", "O silêncio do meu quarto à noite", "A fila da cantina"]
+# Palavras do léxico (rimas locais) e inventadas (caminho da IA).
+KNOWN_WORDS = ["escola", "coração", "bola", "amigo", "janela", "caminho", "luar", "sorvete"]
+SYLLABLES = ["ra", "zu", "bli", "to", "quen", "fa", "lo", "mi"]
+POEM_LINES = ["O mar é grande e azul", "tem peixe, tem barco e tem sol", "A onda vem e vai",
+              "e a areia sempre cai", "Meu amigo Joãozinho", "brinca comigo no caminho"]
+
+
+def _theme(unique):
+    theme = random.choice(THEMES)
+    return f"{theme} {random.randrange(10**6)}" if random.random() < unique else theme
+
+
+def _word(unique):
+    if random.random() < unique:
+        return "".join(random.choice(SYLLABLES) for _ in range(3))
+    return random.choice(KNOWN_WORDS)
+
+
+def _poem(unique):
+    lines = random.sample(POEM_LINES, 4)
+    if random.random() < unique:
+        lines.append(f"e o número {random.randrange(10**6)} caiu da mesa")
+    return {"title": "Poema da Turma", "author": "Aluno", "text": "\n".join(lines[:2]) + "\n\n" + "\n".join(lines[2:]),
+            "theme": _theme(unique)}
+
+
+# nome -> (método, caminho, peso na mistura, corpo(unique))
+ROUTES = {
+    'themes': ('POST', '/api/generate-themes', 10,
+               lambda u: {"interest": random.choice(INTERESTS) + (f" {random.randrange(10**6)}" if random.random() < u else "")}),
+    'themes_stream': ('POST', '/api/generate-themes/stream', 5,
+                      lambda u: {"interest": random.choice(INTERESTS) + (f" {random.randrange(10**6)}" if random.random() < u else "")}),
+    'ideas': ('POST', '/api/get-ideas', 15, lambda u: {"theme": _theme(u)}),
+    'ideas_stream': ('POST', '/api/get-ideas/stream', 5, lambda u: {"theme": _theme(u)}),
+    'ideas_batch': ('POST', '/api/get-ideas/batch', 1, lambda u: {"themes": [_theme(u) for _ in range(5)]}),
+    'rhymes': ('POST', '/api/find-rhymes', 20, lambda u: {"word": _word(u), "theme": _theme(u)}),
+    'rhymes_stream': ('POST', '/api/find-rhymes/stream', 5, lambda u: {"word": _word(u), "theme": _theme(u)}),
+    'check': ('POST', '/api/check-poem', 20, lambda u: {"text": _poem(u)["text"]}),
+    'pdf': ('POST', '/api/generate-pdf', 4, _poem),
+    'anthology': ('POST', '/api/generate-anthology', 1,
+                  lambda u: {"format": random.choice(["pdf", "zip"]), "poems": [_poem(u) for _ in range(3)]}),
+    'cache_stats': ('GET', '/api/cache-stats', 1, lambda u: None),
+}
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree(root_pid):
+    """PID raiz e todos os descendentes (Linux, via /proc)."""
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    tree, todo = [], [root_pid]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, ()))
+    return tree
+
+
+class RssSampler(threading.Thread):
+    """Mede a memória do gunicorn e de todos os processos filhos durante o teste."""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.last_kb = 0
+        self.processes = 0
+        self._done = threading.Event()
+
+    def sample(self):
+        tree = _process_tree(self.pid)
+        self.last_kb = sum(_rss_kb(pid) for pid in tree)
+        self.processes = len(tree)
+        self.peak_kb = max(self.peak_kb, self.last_kb)
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.sample()
+
+
+def start_gunicorn(spec, port, workdir):
+    worker_class, workers, threads = (spec.split(':') + ['2', '200'])[:3]
+    env = dict(os.environ)
+    env.setdefault('MODEL_BACKEND', 'fake')
+    env.update({
+        'AI_CACHE_DB_PATH': os.path.join(workdir, 'ai_cache.sqlite3'),
+        'METRICS_DB_PATH': os.path.join(workdir, 'metrics.sqlite3'),
+        'SINGLE_FLIGHT_LOCK_DIR': os.path.join(workdir, 'singleflight'),
+    })
+    log_path = os.path.join(workdir, 'gunicorn.log')
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+             '--worker-class', worker_class, '--workers', workers, '--threads', threads],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+    deadline = time.monotonic() + BOOT_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn saiu com código {proc.returncode}:\n{_tail(log_path)}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/cache-stats')
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError(f"gunicorn não respondeu em {BOOT_TIMEOUT}s:\n{_tail(log_path)}")
+
+
+def _tail(path, lines=20):
+    with open(path, errors='replace') as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def stop_gunicorn(proc):
+    proc.terminate()
+    try:
+        proc.wait(30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def _request(conn, route, unique):
+    method, path, _, body_fn = ROUTES[route]
+    body = body_fn(unique)
+    payload = json.dumps(body).encode('utf-8') if body is not None else None
+    headers = {'Content-Type': 'application/json'} if payload is not None else {}
+    # Cada cliente é um "aluno": o agendador reparte a cota por cliente.
+    headers['X-Client-Id'] = threading.current_thread().name
+    conn.request(method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    response.read()  # streams (SSE, ZIP) contam até o último byte
+    return response.status
+
+
+def run_load(base_url, routes, concurrency, duration, unique, timeout):
+    """Dispara a mistura de rotas; retorna {rota: [(status, segundos)]} e a duração real."""
+    parts = urlsplit(base_url)
+    weights = [ROUTES[r][2] for r in routes]
+    results = defaultdict(list)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+        local = defaultdict(list)
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = _request(conn, route, unique)
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+            local[route].append((status, time.perf_counter() - started))
+        conn.close()
+        with lock:
+            for route, samples in local.items():
+                results[route].extend(samples)
+
+    threads = [threading.Thread(target=client, name=f'aluno-{i}') for i in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.monotonic() - started
+
+
+def summarize(results, elapsed):
+    summary = {}
+    everything = []
+    for route, samples in sorted(results.items()):
+        latencies = sorted(s for _, s in samples)
+        statuses = defaultdict(int)
+        for status, _ in samples:
+            statuses[status] += 1
+        errors = sum(n for status, n in statuses.items() if status == 0 or status >= 500)
+        summary[route] = {
+            'requests': len(samples),
+            'rps': round(len(samples) / elapsed, 2),
+            'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+            'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+            'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        }
+        everything += samples
+    latencies = sorted(s for _, s in everything)
+    summary['TOTAL'] = {
+        'requests': len(everything),
+        'rps': round(len(everything) / elapsed, 2),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        'error_rate': round(sum(1 for status, _ in everything if status == 0 or status >= 500)
+                            / len(everything), 4) if everything else 0.0,
+    }
+    return summary
+
+
+def print_report(label, summary, rss):
+    print(f"\n=== {label} ===")
+    print(f"{'rota':<15} {'req':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'erros':>7}  status")
+    for route, row in summary.items():
+        statuses = " ".join(f"{k}:{v}" for k, v in row.get('statuses', {}).items())
+        print(f"{route:<15} {row['requests']:>7} {row['rps']:>8.1f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['error_rate']:>7.1%}  {statuses}")
+    if rss:
+        print(f"RSS: pico {rss['peak_mb']:.0f} MB, final {rss['final_mb']:.0f} MB em {rss['processes']} processos")
+
+
+def compare(baseline, current, max_regression):
+    """Lista as regressões (p95 maior ou vazão menor que o limite) em relação à base."""
+    problems = []
+    for label, run in current.items():
+        base_run = baseline.get(label)
+        if base_run is None:
+            continue
+        for route, row in run['routes'].items():
+            base = base_run['routes'].get(route)
+            if base is None or base['requests'] < 20 or row['requests'] < 20:
+                continue
+            if base['p95_ms'] > 0 and row['p95_ms'] > base['p95_ms'] * (1 + max_regression):
+                problems.append(f"{label} {route}: p95 {base['p95_ms']:.0f} -> {row['p95_ms']:.0f} ms")
+            if route == 'TOTAL' and row['rps'] < base['rps'] * (1 - max_regression):
+                problems.append(f"{label} {route}: vazão {base['rps']:.1f} -> {row['rps']:.1f} req/s")
+        base_rss, rss = base_run.get('rss'), run.get('rss')
+        if base_rss and rss and rss['peak_mb'] > base_rss['peak_mb'] * (1 + max_regression):
+            problems.append(f"{label}: RSS pico {base_rss['peak_mb']:.0f} -> {rss['peak_mb']:.0f} MB")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', action='append',
+                        help="classe:workers:threads do gunicorn (repetível; padrão gthread:2:200)")
+    parser.add_argument('--url', help="usa um servidor já no ar em vez de subir o gunicorn")
+    parser.add_argument('--routes', default=','.join(ROUTES),
+                        help=f"rotas da mistura, separadas por vírgula ({', '.join(ROUTES)})")
+    parser.add_argument('--concurrency', type=int, default=30)
+    parser.add_argument('--duration', type=float, default=20, help="segundos de carga por servidor")
+    parser.add_argument('--warmup', type=float, default=3, help="segundos de carga antes de medir")
+    parser.add_argument('--unique', type=float, default=0.5,
+                        help="fração de pedidos com entrada inédita (o resto tende a acertar o cache)")
+    parser.add_argument('--timeout', type=float, default=120, help="prazo de cada requisição (s)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="grava o resultado em JSON")
+    parser.add_argument('--baseline', help="compara com um resultado gravado e sai com 1 se piorar")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="piora tolerada em relação à base (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    routes = [r.strip() for r in args.routes.split(',') if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f"rotas desconhecidas: {', '.join(unknown)}")
+
+    results = {}
+    targets = [('url', args.url)] if args.url else [(spec, None) for spec in (args.server or ['gthread:2:200'])]
+    for label, url in targets:
+        workdir = tempfile.mkdtemp(prefix='oficina_bench_')
+        proc = sampler = None
+        try:
+            if url is None:
+                port = _free_port()
+                print(f"Subindo gunicorn {label} na porta {port}...")
+                proc = start_gunicorn(label, port, workdir)
+                url = f"http://127.0.0.1:{port}"
+                sampler = RssSampler(proc.pid)
+                sampler.start()
+            if args.warmup > 0:
+                run_load(url, routes, args.concurrency, args.warmup, args.unique, args.timeout)
+            print(f"Carga: {args.concurrency} clientes por {args.duration:.0f}s...")
+            load, elapsed = run_load(url, routes, args.concurrency, args.duration, args.unique, args.timeout)
+            rss = None
+            if sampler is not None:
+                sampler.stop()
+                rss = {'peak_mb': round(sampler.peak_kb / 1024, 1), 'final_mb': round(sampler.last_kb / 1024, 1),
+                       'processes': sampler.processes}
+            summary = summarize(load, elapsed)
+            results[label] = {'routes': summary, 'rss': rss, 'concurrency': args.concurrency,
+                              'duration': round(elapsed, 1)}
+            print_report(label, summary, rss)
+        finally:
+            if proc is not None:
+                stop_gunicorn(proc)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultado gravado em {args.save}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(json.load(f), results, args.max_regression)
+        if problems:
+            print("\nRegressões em relação à base:")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("\nSem regressões em relação à base.")
+
+
+if __name__ == '__main__':
+    main()
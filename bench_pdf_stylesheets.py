@@ -0,0 +1,62 @@
+"""Micro-benchmark: CSS embutido no HTML x folha compilada e reaproveitada.
+
+Uso: python bench_pdf_stylesheets.py [renderizações]
+
+Mede, no mesmo processo, (1) o caminho antigo, com o CSS do tema num <style>
+reprocessado a cada PDF, (2) o caminho atual do pdf_worker, com o `CSS`
+compilado uma vez e passado em `stylesheets=`, e (3) o custo isolado de
+compilar a folha, que é o que o cache elimina por renderização.
+"""
+import statistics
+import sys
+import time
+
+from weasyprint import HTML, CSS
+
+import pdf_worker
+
+THEME_CSS = pdf_worker.WARMUP_CSS + "".join(
+    f".estrofe-{i} {{ margin-left: {i}px; color: #{i:02x}{i:02x}80; }}\n" for i in range(60)
+)
+
+BODY = """
+<h1>O Mar</h1>
+<p>O mar é grande e azul,<br>tem peixe, tem barco e tem sol.</p>
+<p>A onda vem e vai,<br>e a areia sempre cai.</p>
+<p class="author">- Turma do 4º ano</p>
+"""
+
+INLINE_HTML = f'<html><head><meta charset="UTF-8"><style>{THEME_CSS}</style></head><body>{BODY}</body></html>'
+PLAIN_HTML = f'<html><head><meta charset="UTF-8"></head><body>{BODY}</body></html>'
+
+
+def _measure(label, fn, rounds):
+    fn()  # aquecimento
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<34} média {statistics.mean(samples):7.2f} ms   "
+          f"mediana {statistics.median(samples):7.2f} ms")
+    return statistics.mean(samples)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    print(f"{rounds} renderizações por cenário, CSS do tema com {len(THEME_CSS)} caracteres\n")
+
+    font_config = pdf_worker.font_configuration()
+    parse = _measure("compilar CSS(string=...)",
+                     lambda: CSS(string=THEME_CSS, font_config=font_config), rounds)
+    inline = _measure("PDF com <style> embutido",
+                      lambda: HTML(string=INLINE_HTML).write_pdf(), rounds)
+    cached = _measure("PDF com folha compilada (cache)",
+                      lambda: pdf_worker.render(PLAIN_HTML, THEME_CSS), rounds)
+
+    print(f"\nEconomia por PDF: {inline - cached:.2f} ms "
+          f"(compilação isolada da folha: {parse:.2f} ms)")
+
+
+if __name__ == '__main__':
+    main()
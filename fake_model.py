@@ -0,0 +1,222 @@
+"""Modelo falso, sem rede nem cota, para benchmarks e testes de carga.
+
+Selecionado com MODEL_BACKEND=fake (ver get_model() no app.py). Imita a
+interface do `genai.GenerativeModel` que o app usa: `generate_content` e
+`generate_content_async`, com e sem stream, respostas com `.text` e
+`.usage_metadata`. Reconhece cada prompt do app (temas, ideias, ideias em
+lote, rimas, definições, revisão e CSS do PDF) e devolve um JSON no formato
+esperado, com conteúdo derivado do próprio prompt.
+
+Configuração por variáveis de ambiente:
+    FAKE_MODEL_LATENCY         distribuição da latência total, em segundos:
+                               'lognormal:mediana,sigma' (padrão 'lognormal:0.8,0.4'),
+                               'uniform:min,max', 'normal:média,desvio' ou 'fixed:s'
+    FAKE_MODEL_ERROR_RATE      fração de chamadas que falham com 503 (padrão 0)
+    FAKE_MODEL_QUOTA_RATE      fração de chamadas que falham com 429 (padrão 0)
+    FAKE_MODEL_MALFORMED_RATE  fração de respostas com JSON truncado (padrão 0)
+    FAKE_MODEL_CHARS_PER_TOKEN caracteres por token na contagem de uso (padrão 4)
+    FAKE_MODEL_SEED            semente do gerador (padrão: aleatória)
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+
+STREAM_CHUNK_CHARS = 40
+FIRST_CHUNK_SHARE = 0.3  # fração da latência até o primeiro pedaço, no stream
+
+_THEME_PATTERNS = (
+    "O barulho de {0}", "A cor de {0} ao entardecer", "O cheiro de {0} no domingo",
+    "Meu caderno de {0}", "O silêncio depois de {0}", "Um dia inteiro de {0}",
+    "A sombra de {0} na parede", "O som de {0} na chuva", "Segredos de {0}",
+)
+
+_IDEA_PATTERNS = (
+    "Que *cor* você enxerga quando pensa em '{0}'?",
+    "Qual é o *som* mais forte de '{0}'?",
+    "Se '{0}' tivesse um *cheiro*, qual seria?",
+    "Como seria *tocar* em '{0}'? É macio, áspero, frio?",
+    "Compare '{0}' com algo *rápido* ou *lento* que você conhece.",
+)
+
+_RHYME_PREFIXES = ('ba', 'ca', 'pa', 'ma', 'sa', 'ja', 'ra', 'te', 'ne', 'vi')
+
+
+class ServiceUnavailable(Exception):
+    """Mesmo nome do erro 503 do SDK (o app reconhece pelo nome como transitório)."""
+
+
+class ResourceExhausted(Exception):
+    """Mesmo nome do erro 429 do SDK (cota)."""
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStream:
+    """Resposta em stream: iterável (síncrono) de pedaços, com o uso total no fim."""
+
+    def __init__(self, chunks, delays, usage):
+        self._chunks = chunks
+        self._delays = delays
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        for i, (text, delay) in enumerate(zip(self._chunks, self._delays)):
+            time.sleep(delay)
+            yield FakeResponse(text, self.usage_metadata if i == len(self._chunks) - 1 else None)
+
+
+class FakeAsyncStream(FakeStream):
+
+    async def __aiter__(self):
+        for i, (text, delay) in enumerate(zip(self._chunks, self._delays)):
+            await asyncio.sleep(delay)
+            yield FakeResponse(text, self.usage_metadata if i == len(self._chunks) - 1 else None)
+
+
+def parse_latency(spec):
+    """'lognormal:0.8,0.4' -> função sem argumentos que sorteia uma latência (s)."""
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()]
+    if kind == 'fixed':
+        return lambda rng: values[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Distribuição de latência desconhecida: {spec!r}")
+
+
+def _pick(seed_text, options, count):
+    """Escolha estável (mesmo prompt, mesma resposta), como um modelo com temperatura baixa."""
+    offset = int(hashlib.md5(seed_text.encode('utf-8')).hexdigest(), 16)
+    return [options[(offset + i) % len(options)] for i in range(count)]
+
+
+def answer(prompt):
+    """Texto da resposta para um prompt do app."""
+    if 'Para CADA tema' in prompt:
+        match = re.search(r'Temas: (\[.*?\])\n', prompt)
+        themes = json.loads(match.group(1)) if match else []
+        return json.dumps({t: [p.format(t) for p in _IDEA_PATTERNS] for t in themes}, ensure_ascii=False)
+    if 'gerar 9 temas' in prompt:
+        match = re.search(r'interesses: "(.*)"', prompt)
+        interest = (match.group(1) if match else 'a escola').strip() or 'a escola'
+        return json.dumps([p.format(interest) for p in _pick(interest, _THEME_PATTERNS, 9)], ensure_ascii=False)
+    if '5 ideias' in prompt:
+        match = re.search(r"O tema do poema é '(.*)'", prompt)
+        theme = match.group(1) if match else 'o poema'
+        return json.dumps([p.format(theme) for p in _IDEA_PATTERNS], ensure_ascii=False)
+    if 'que rimam com' in prompt:
+        match = re.search(r"que rimam com '(.*?)'", prompt)
+        word = (match.group(1) if match else 'ão').lower()
+        ending = word[-3:] if len(word) > 3 else word
+        rhymes = [{"palavra": prefix + ending, "definicao": f"Palavra que termina em '{ending}'."}
+                  for prefix in _pick(word, _RHYME_PREFIXES, 8) if prefix + ending != word]
+        return json.dumps(rhymes, ensure_ascii=False)
+    if 'cada uma destas palavras' in prompt:
+        match = re.search(r'cada uma destas palavras: (\[.*?\])', prompt)
+        words = json.loads(match.group(1)) if match else []
+        return json.dumps({w: f"Algo que lembra '{w}'." for w in words}, ensure_ascii=False)
+    if 'Palavras a verificar' in prompt:
+        pending = re.findall(r"'([^']+)' \(verso (\d+)\)", prompt)
+        # Um pouco de tudo: nomes próprios passam, o resto ganha uma sugestão.
+        errors = [{"original": word, "suggestions": [word.lower().rstrip('s') or word.lower()],
+                   "reason": "Confira a grafia desta palavra.", "verse_number": int(verse)}
+                  for word, verse in pending if not word[:1].isupper()]
+        return json.dumps(errors, ensure_ascii=False)
+    if 'string de CSS' in prompt:
+        hue = int(hashlib.md5(prompt.encode('utf-8')).hexdigest()[:2], 16) * 360 // 256
+        return (f"body {{ font-family: Arial, sans-serif; background-color: hsl({hue}, 70%, 95%); color: #222; }}\n"
+                f"h1 {{ color: hsl({hue}, 70%, 35%); font-size: 24pt; text-align: center; }}\n"
+                f"p {{ font-size: 12pt; line-height: 1.6; }}\n"
+                f".author {{ text-align: right; font-style: italic; margin-top: 20px; }}\n")
+    return "[]"
+
+
+class FakeModel:
+    """Substituto do GenerativeModel com latência, erros e uso de tokens sorteados."""
+
+    def __init__(self, latency='lognormal:0.8,0.4', error_rate=0.0, quota_rate=0.0,
+                 malformed_rate=0.0, chars_per_token=4, seed=None):
+        self.latency_spec = latency
+        self._latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.malformed_rate = malformed_rate
+        self.chars_per_token = chars_per_token
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def from_env(cls):
+        seed = os.environ.get('FAKE_MODEL_SEED')
+        return cls(
+            latency=os.environ.get('FAKE_MODEL_LATENCY', 'lognormal:0.8,0.4'),
+            error_rate=float(os.environ.get('FAKE_MODEL_ERROR_RATE', 0)),
+            quota_rate=float(os.environ.get('FAKE_MODEL_QUOTA_RATE', 0)),
+            malformed_rate=float(os.environ.get('FAKE_MODEL_MALFORMED_RATE', 0)),
+            chars_per_token=float(os.environ.get('FAKE_MODEL_CHARS_PER_TOKEN', 4)),
+            seed=int(seed) if seed is not None else None,
+        )
+
+    def describe(self):
+        return (f"latência {self.latency_spec}, erros {self.error_rate:.0%}, "
+                f"429 {self.quota_rate:.0%}, JSON truncado {self.malformed_rate:.0%}")
+
+    def _plan(self, prompt):
+        """Sorteia latência e desfecho; retorna (latência, texto, uso) ou levanta o erro."""
+        latency = self._latency(self._rng)
+        roll = self._rng.random()
+        if roll < self.error_rate:
+            return latency, ServiceUnavailable("503 The model is overloaded. Please try again later."), None
+        if roll < self.error_rate + self.quota_rate:
+            return latency, ResourceExhausted("429 Resource has been exhausted (e.g. check quota). "
+                                              "retry_delay { seconds: 5 }"), None
+        text = answer(prompt)
+        if self._rng.random() < self.malformed_rate:
+            text = text[:max(1, len(text) // 2)]
+        usage = FakeUsage(math.ceil(len(prompt) / self.chars_per_token),
+                          math.ceil(len(text) / self.chars_per_token))
+        return latency, text, usage
+
+    def _stream_parts(self, latency, text):
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or ['']
+        rest = latency * (1 - FIRST_CHUNK_SHARE) / max(len(chunks) - 1, 1)
+        return chunks, [latency * FIRST_CHUNK_SHARE] + [rest] * (len(chunks) - 1)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, request_options=None, **kwargs):
+        latency, outcome, usage = self._plan(prompt)
+        if isinstance(outcome, Exception):
+            time.sleep(latency * FIRST_CHUNK_SHARE)
+            raise outcome
+        if stream:
+            return FakeStream(*self._stream_parts(latency, outcome), usage)
+        time.sleep(latency)
+        return FakeResponse(outcome, usage)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, request_options=None, **kwargs):
+        latency, outcome, usage = self._plan(prompt)
+        if isinstance(outcome, Exception):
+            await asyncio.sleep(latency * FIRST_CHUNK_SHARE)
+            raise outcome
+        if stream:
+            return FakeAsyncStream(*self._stream_parts(latency, outcome), usage)
+        await asyncio.sleep(latency)
+        return FakeResponse(outcome, usage)
@@ -0,0 +1,31 @@
+# Configuração do gunicorn (lida automaticamente quando o servidor é iniciado
+# na raiz do projeto: `gunicorn app:app`).
+#
+# Workers 'gthread': cada requisição ocupa só uma thread leve enquanto espera a
+# IA (a chamada em si roda no event loop assíncrono de app.py), então poucos
+# processos atendem uma turma inteira ao mesmo tempo.
+import os
+import time
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 200))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 5
+
+
+def post_fork(server, worker):
+    """Marca o início do worker: o relatório de subida mede a carga do app a partir daqui.
+
+    Também informa ao app quantos workers dividem a cota do modelo (cada um
+    fica com 1/N de LLM_RPM_LIMIT e LLM_TPM_LIMIT). Roda antes de o worker
+    importar o app.
+    """
+    worker.boot_started = time.perf_counter()
+    os.environ['LLM_SCHEDULER_PROCESSES'] = str(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    """Aquece o worker (modelo, pool de PDF, léxico) antes da primeira requisição."""
+    import app
+    app.warm_up(getattr(worker, 'boot_started', None))
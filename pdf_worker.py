@@ -0,0 +1,177 @@
+"""Processo de renderização de PDF usado pelo pool do app.py.
+
+Cada processo do pool roda `serve()`: aquece o WeasyPrint renderizando um
+poema de exemplo (descoberta de fontes, cascata de CSS, layout) e depois
+atende os jobs que chegam pelo Pipe. Os processos são criados com 'spawn',
+então este módulo importa só o WeasyPrint — nada de Flask ou do Gemini.
+E o WeasyPrint (Pango/cairo) só é importado na primeira renderização: o
+app.py importa este módulo nos workers web, que não renderizam nada
+quando o pool está ligado.
+
+O CSS de cada tema chega como texto separado do HTML e é compilado uma vez
+em um `weasyprint.CSS`, guardado num LRU pelo hash do texto; a folha base e
+a configuração de fontes são compartilhadas por todas as renderizações.
+
+Jobs com a chave 'anthology' juntam vários poemas num só PDF, cada um com
+a sua folha de estilo, precedidos de um sumário com as páginas.
+"""
+import hashlib
+import html
+import threading
+from collections import OrderedDict
+
+STYLESHEET_CACHE_SIZE = 64
+
+# Regras comuns a todos os PDFs (o CSS do tema vem depois e tem precedência).
+BASE_CSS = """
+@page { size: A4; margin: 2cm; }
+body { font-family: Arial, sans-serif; }
+h1 { text-align: center; }
+p { overflow-wrap: break-word; }
+"""
+
+WARMUP_CSS = """
+body { font-family: Arial, sans-serif; background-color: #F0F8FF; color: #333; }
+h1 { color: #FF6347; font-size: 24pt; text-align: center; }
+p { font-size: 12pt; line-height: 1.6; }
+.author { text-align: right; font-style: italic; margin-top: 30px; }
+"""
+
+# Sumário da antologia: usa só a folha base, para não herdar o tema de um poema.
+TOC_CSS = """
+h1 { font-size: 22pt; margin-bottom: 24px; }
+ol { list-style: none; padding: 0; }
+li { display: flex; font-size: 12pt; margin: 6px 0; }
+li .title { flex: 1; }
+li .author { color: #666; font-style: italic; margin: 0 12px; }
+"""
+
+WARMUP_HTML = """
+<html>
+    <head><meta charset="UTF-8"></head>
+    <body>
+        <h1>Aquecimento</h1>
+        <p>O sol se põe no horizonte,<br>a bola rola na escola.</p>
+        <p class="author">- Oficina de Poemas</p>
+    </body>
+</html>
+"""
+
+weasyprint = None
+_font_config = None
+_base_stylesheet = None
+_stylesheets = OrderedDict()
+# Com PDF_RENDER_WORKERS=0 o app.py renderiza aqui mesmo, nas threads do
+# gunicorn: o LRU é compartilhado entre elas.
+_stylesheets_lock = threading.Lock()
+
+
+def engine():
+    """Módulo `weasyprint`, importado na primeira chamada."""
+    global weasyprint
+    if weasyprint is None:
+        # Por causa do `global`, o import liga o pacote ao nome do módulo.
+        import weasyprint.text.fonts
+    return weasyprint
+
+
+def font_configuration():
+    global _font_config
+    if _font_config is None:
+        _font_config = engine().text.fonts.FontConfiguration()
+    return _font_config
+
+
+def base_stylesheet():
+    global _base_stylesheet
+    if _base_stylesheet is None:
+        _base_stylesheet = engine().CSS(string=BASE_CSS, font_config=font_configuration())
+    return _base_stylesheet
+
+
+def compiled_stylesheet(css_string):
+    """Retorna o `CSS` já compilado para o texto, compilando só na primeira vez."""
+    key = hashlib.sha256(css_string.encode('utf-8')).hexdigest()
+    with _stylesheets_lock:
+        stylesheet = _stylesheets.get(key)
+        if stylesheet is not None:
+            _stylesheets.move_to_end(key)
+            return stylesheet
+    # Compila fora do lock; duas threads com o mesmo CSS novo só compilam duas vezes.
+    stylesheet = engine().CSS(string=css_string, font_config=font_configuration())
+    with _stylesheets_lock:
+        _stylesheets[key] = stylesheet
+        while len(_stylesheets) > STYLESHEET_CACHE_SIZE:
+            _stylesheets.popitem(last=False)
+    return stylesheet
+
+
+def _stylesheets_for(css_string):
+    stylesheets = [base_stylesheet()]
+    if css_string:
+        stylesheets.append(compiled_stylesheet(css_string))
+    return stylesheets
+
+
+def render(html_string, css_string=None):
+    """Renderiza o HTML com a folha base (+ CSS do tema) e retorna os bytes do PDF."""
+    return engine().HTML(string=html_string).write_pdf(stylesheets=_stylesheets_for(css_string),
+                                                       font_config=font_configuration())
+
+
+def _toc_html(title, rows):
+    items = "".join(
+        f'<li><span class="title">{html.escape(entry["title"])}</span>'
+        f'<span class="author">{html.escape(entry["author"])}</span><span>{page}</span></li>'
+        for entry, page in rows
+    )
+    return (f'<html><head><meta charset="UTF-8"></head><body>'
+            f'<h1>{html.escape(title)}</h1><ol>{items}</ol></body></html>')
+
+
+def render_anthology(title, entries):
+    """Junta vários poemas num PDF só, com sumário.
+
+    `entries` é uma lista de dicts com html/css/title/author. Cada poema é
+    diagramado com a própria folha de estilo e as páginas são concatenadas.
+    """
+    font_config = font_configuration()
+    documents = [engine().HTML(string=entry['html']).render(stylesheets=_stylesheets_for(entry.get('css')),
+                                                   font_config=font_config)
+                 for entry in entries]
+    toc_stylesheets = _stylesheets_for(TOC_CSS)
+
+    def render_toc(offset):
+        rows = []
+        page = offset + 1
+        for entry, document in zip(entries, documents):
+            rows.append((entry, page))
+            page += len(document.pages)
+        return engine().HTML(string=_toc_html(title, rows)).render(stylesheets=toc_stylesheets, font_config=font_config)
+
+    # O sumário ocupa páginas também: diagrama uma vez para saber quantas.
+    toc = render_toc(0)
+    toc = render_toc(len(toc.pages))
+    pages = [page for document in [toc] + documents for page in document.pages]
+    return toc.copy(pages).write_pdf()
+
+
+def serve(conn):
+    """Loop do processo: aquece o motor e atende jobs até receber None."""
+    render(WARMUP_HTML, WARMUP_CSS)
+    conn.send(('ready', None))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        try:
+            if 'anthology' in job:
+                pdf_bytes = render_anthology(job['title'], job['anthology'])
+            else:
+                pdf_bytes = render(job['html'], job.get('css'))
+            conn.send(('ok', pdf_bytes))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
@@ -0,0 +1,28 @@
+"""Configuração dos testes: o app roda com o modelo falso e tudo em disco num diretório temporário.
+
+As variáveis precisam estar no ambiente antes do primeiro "import app", porque a
+configuração é lida na importação. Elas sobrepõem as do shell: os testes nunca
+chamam o Gemini de verdade nem tocam nos caches de /tmp do servidor.
+"""
+import os
+import sys
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix='oficina_tests_')
+
+for _name, _value in {
+    'MODEL_BACKEND': 'fake',
+    'FAKE_MODEL_LATENCY': 'fixed:0',
+    'AI_CACHE_DB_PATH': os.path.join(_TMP, 'ai_cache.sqlite3'),
+    'METRICS_DB_PATH': os.path.join(_TMP, 'metrics.sqlite3'),
+    'THEME_BANK_DB_PATH': os.path.join(_TMP, 'theme_bank.sqlite3'),
+    'SINGLE_FLIGHT_LOCK_DIR': os.path.join(_TMP, 'singleflight'),
+    'PDF_CACHE_DIR': os.path.join(_TMP, 'pdf_cache'),
+    'PDF_JOBS_DIR': os.path.join(_TMP, 'pdf_jobs'),
+    'PROFILE_DIR': os.path.join(_TMP, 'profiles'),
+    'PDF_RENDER_WORKERS': '0',
+    'PDF_STYLE_PREFETCH_WORKERS': '0',
+}.items():
+    os.environ[_name] = _value
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+import time
+
+import app
+
+
+def make_cache(tmp_path):
+    return app.AIResponseCache(str(tmp_path / 'cache.sqlite3'), memory_items=10, disk_max_bytes=1024 * 1024)
+
+
+def test_key_collapses_whitespace_but_keeps_case():
+    key = app.AIResponseCache.make_key
+    assert key('Um  poema\nsobre o Sol ', 'm', True) == key('Um poema sobre o Sol', 'm', True)
+    assert key('O Sol', 'm', True) != key('o sol', 'm', True)
+    assert key('O Sol', 'm', True) != key('O Sol', 'm', False)
+    assert key('O Sol', 'm', True) != key('O Sol', 'outro', True)
+
+
+def test_get_set_and_disk_tier(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set('k', ['a', 'b'], ttl=60)
+    assert cache.get('k') == (True, ['a', 'b'])
+
+    other = make_cache(tmp_path)  # Outro processo: só o disco é compartilhado.
+    assert other.get('k') == (True, ['a', 'b'])
+    assert other.stats['disk_hits'] == 1
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path)
+    cache.set('k', 'v', ttl=10)
+    now = time.time()
+    monkeypatch.setattr(app.time, 'time', lambda: now + 11)
+    assert cache.get('k') == (False, None)
+
+
+def test_zero_ttl_is_not_stored(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set('k', 'v', ttl=0)
+    assert cache.get('k') == (False, None)
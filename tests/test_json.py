@@ -0,0 +1,43 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('["a", "b"]', ["a", "b"]),
+    ('```json\n["a", "b"]\n```', ["a", "b"]),
+    ('Aqui está: {"x": [1, 2]} Espero que ajude!', {"x": [1, 2]}),
+    ('["com \\"aspas\\" e ] colchete", "b"] e depois [1]', ['com "aspas" e ] colchete', "b"]),
+])
+def test_extract_json_finds_the_first_balanced_value(text, expected):
+    assert app.extract_json(text) == (expected, False)
+
+
+def test_extract_json_repairs_a_truncated_list():
+    value, repaired = app.extract_json('["um", "dois", "trê')
+    assert (value, repaired) == (["um", "dois"], True)
+
+
+def test_extract_json_without_json_raises():
+    with pytest.raises(app.JsonExtractionError):
+        app.extract_json('O modelo respondeu só com texto.')
+    with pytest.raises(app.JsonExtractionError):
+        app.extract_json('["a"', repair=False)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Segue a lista [abaixo]: ["a", "b"]', ["a", "b"]),
+    ('Veja {isto} e {aquilo}: {"x": 1}', {"x": 1}),
+])
+def test_extract_json_skips_brackets_in_prose(text, expected):
+    assert app.extract_json(text) == (expected, False)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a":"x"', {"a": "x"}),
+    ('{"a": "x", "b": "dois pa', {"a": "x", "b": "dois pa"}),
+    ('{"a": "x", "b', {"a": "x"}),
+    ('Segue a lista [abaixo]: ["um", "do', ["um"]),
+])
+def test_extract_json_repairs_a_truncated_object(text, expected):
+    assert app.extract_json(text) == (expected, True)
@@ -0,0 +1,73 @@
+import json
+import time
+
+import app
+
+DEFINITIONS = {
+    'requests_total': ('counter', 'Pedidos.', None),
+    'in_flight': ('gauge', 'Em voo.', None),
+    'latency_seconds': ('histogram', 'Latência.', (0.1, 1)),
+}
+
+
+def make_registry(tmp_path):
+    return app.MetricsRegistry(DEFINITIONS, str(tmp_path / 'metrics.sqlite3'), flush_interval=3600,
+                               archive_after=60)
+
+
+def write_row(registry, instance, age, series):
+    registry._db().execute("INSERT OR REPLACE INTO metrics (instance, updated_at, data) VALUES (?, ?, ?)",
+                           (instance, time.time() - age, json.dumps(series)))
+
+
+def dead_worker(requests, latency):
+    return [
+        ['requests_total', [['route', '/']], requests],
+        ['in_flight', [], 3],
+        ['latency_seconds', [], [[1, 0, 0], latency, 1]],
+    ]
+
+
+def test_collect_sums_processes_and_renders_prometheus_text(tmp_path):
+    registry = make_registry(tmp_path)
+    registry.inc('requests_total', route='/')
+    registry.observe('latency_seconds', 0.5)
+    write_row(registry, 'outro', 0, [['requests_total', [['route', '/']], 2]])
+
+    totals = registry.collect()
+    assert totals[('requests_total', (('route', '/'),))] == 3
+    assert totals[('latency_seconds', ())] == [[0, 1, 0], 0.5, 1]
+
+    text = registry.render()
+    assert 'requests_total{route="/"} 3' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+
+
+def test_stale_instances_are_folded_into_one_archived_row(tmp_path):
+    registry = make_registry(tmp_path)
+    write_row(registry, 'morto-1', 120, dead_worker(2, 0.05))
+    write_row(registry, 'morto-2', 120, dead_worker(5, 0.07))
+    write_row(registry, 'vivo', 0, [['requests_total', [['route', '/']], 1], ['in_flight', [], 1]])
+    before = registry.collect()
+
+    registry.archive_stale()
+    write_row(registry, 'morto-3', 120, dead_worker(1, 0.01))  # Outro reinício, mais tarde.
+    registry.archive_stale()
+
+    instances = {row[0] for row in registry._db().execute("SELECT instance FROM metrics")}
+    assert 'morto-1' not in instances and 'morto-3' not in instances
+    assert app.METRICS_ARCHIVE_INSTANCE in instances and 'vivo' in instances
+
+    after = registry.collect()
+    assert after[('requests_total', (('route', '/'),))] == before[('requests_total', (('route', '/'),))] + 1 == 9
+    histogram = after[('latency_seconds', ())]
+    assert histogram[0] == [3, 0, 0] and histogram[2] == 3
+    assert after[('in_flight', ())] == 1  # Gauges de processos mortos não contam.
+
+
+def test_metrics_route_exposes_prometheus_text():
+    client = app.app.test_client()
+    client.post('/api/find-rhymes', json={'word': 'mar', 'definitions': False})
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert '# TYPE oficina_http_requests_total counter' in response.get_data(as_text=True)
@@ -0,0 +1,158 @@
+import os
+import time
+
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('title, expected', [
+    ('Meu Poema Lindo!', 'meu_poema_lindo_'),
+    ('Coração de Estudante', 'coracao_de_estudante'),
+    ('a/b\\c"d;e', 'a_b_c_d_e'),
+    ('', 'poema'),
+])
+def test_pdf_filename_keeps_only_safe_characters(title, expected):
+    assert app.pdf_filename(title) == expected
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def poem(title='Sol', theme='praia'):
+    return {'title': title, 'author': 'Ana', 'text': 'O sol nasceu\nna beira do mar', 'theme': theme}
+
+
+def test_anthology_zip_has_a_well_formed_content_disposition(client):
+    response = client.post('/api/generate-anthology', json={
+        'poems': [poem()], 'format': 'zip', 'title': 'Poemas da Turma; 6º "A"',
+    })
+    try:
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'] == 'attachment; filename=poemas_da_turma__6___a_.zip'
+    finally:
+        response.close()
+
+
+PDF_BYTES = b'%PDF-1.7\n' + b'x' * 1000 + b'\n%%EOF\n'
+
+
+@pytest.fixture
+def pdf_cache(tmp_path, monkeypatch):
+    cache = app.PdfOutputCache(str(tmp_path / 'pdfs'), max_bytes=10 * 1024)
+    monkeypatch.setattr(app, 'pdf_cache', cache)
+    return cache
+
+
+def cached(cache, data):
+    digest = 'a' * 64
+    cache.store(digest, PDF_BYTES)
+    cache.alias(cache.poem_key(data), digest)
+    return digest
+
+
+def test_pdf_cache_store_alias_and_eviction(pdf_cache):
+    data = poem()
+    digest = cached(pdf_cache, data)
+    found_digest, f = pdf_cache.lookup(pdf_cache.poem_key(data))
+    with f:
+        assert (found_digest, f.read()) == (digest, PDF_BYTES)
+
+    for i in range(12):  # ~12 KB num cache de 10 KB: os mais antigos saem.
+        pdf_cache.store(f'{i:064x}', PDF_BYTES)
+    assert pdf_cache.lookup(pdf_cache.poem_key(data)) is None
+    assert pdf_cache.snapshot()['bytes'] <= pdf_cache.max_bytes
+    assert pdf_cache.stats['evictions'] >= 2
+
+
+def test_generate_pdf_sends_the_open_file_even_if_it_is_evicted(client, pdf_cache, monkeypatch):
+    data = poem()
+    digest = cached(pdf_cache, data)
+    lookup = pdf_cache.lookup
+
+    def lookup_then_evict(poem_key):
+        found = lookup(poem_key)
+        os.remove(pdf_cache.path(found[0]))  # Outro worker apagou o arquivo logo depois do open().
+        return found
+
+    monkeypatch.setattr(pdf_cache, 'lookup', lookup_then_evict)
+    response = client.post('/api/generate-pdf', json=data)
+
+    assert response.status_code == 200
+    assert response.data == PDF_BYTES
+    assert response.content_length == len(PDF_BYTES)
+    assert response.headers['ETag'] == f'"{digest}"'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=sol.pdf'
+
+
+@pytest.fixture
+def pdf_jobs(tmp_path, monkeypatch):
+    jobs = app.PdfJobQueue(str(tmp_path / 'jobs'), workers=1, queue_size=4, ttl=60, max_seconds=60)
+    monkeypatch.setattr(app, 'pdf_jobs', jobs)
+    return jobs
+
+
+def finished_job(client, data):
+    response = client.post('/api/pdf-jobs', json=data)
+    assert response.status_code == 202
+    status_url = response.headers['Location']
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        payload = client.get(status_url).get_json()
+        if payload['status'] not in ('queued', 'rendering'):
+            return payload
+        time.sleep(0.02)
+    raise AssertionError('o job não terminou')
+
+
+def test_job_download_answers_conditional_and_range_requests(client, pdf_cache, pdf_jobs):
+    data = poem()
+    digest = cached(pdf_cache, data)  # Já no cache: o job não precisa renderizar.
+    job = finished_job(client, data)
+    assert job['status'] == 'done'
+    assert job['size_bytes'] == len(PDF_BYTES)
+    url = job['download_url']
+
+    response = client.get(url)
+    assert response.data == PDF_BYTES
+    assert response.content_length == len(PDF_BYTES)
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+    assert client.get(url, headers={'If-None-Match': f'"{digest}"'}).status_code == 304
+
+    response = client.get(url, headers={'Range': 'bytes=0-8'})
+    assert response.status_code == 206
+    assert response.data == PDF_BYTES[:9]
+    assert response.headers['Content-Range'] == f'bytes 0-8/{len(PDF_BYTES)}'
+
+    assert client.get(url, headers={'Range': f'bytes={len(PDF_BYTES) + 10}-'}).status_code == 416
+
+
+@pytest.mark.parametrize('route', ['/api/pdf-jobs', '/api/generate-pdf'])
+@pytest.mark.parametrize('change', [{'title': 123}, {'author': None}, {'text': ['verso']}, {'theme': {}}])
+def test_pdf_routes_reject_fields_that_are_not_text(client, pdf_jobs, route, change):
+    response = client.post(route, json={**poem(), **change})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Dados incompletos para PDF'}
+    assert not pdf_jobs.stats
+
+
+def test_anthology_rejects_fields_that_are_not_text(client):
+    response = client.post('/api/generate-anthology', json={'poems': [poem(), {**poem(), 'title': 7}]})
+    assert response.status_code == 400
+
+
+def test_style_prefetch_can_be_disabled():
+    styles = app.PdfStyleCache(variants=3, prefetch_workers=0)
+    styles.prefetch('A chuva no telhado')
+    assert not styles.stats.get('prefetches')
+
+
+def test_style_cache_forgets_the_oldest_themes():
+    styles = app.PdfStyleCache(variants=1, prefetch_workers=0, max_tracked=3)
+    for i in range(10):
+        styles.get(f'Tema livre número {i}')
+        styles.get(f'Tema livre número {i}')  # Segunda vez: rodízio sobre a variação pronta.
+    assert styles.snapshot()['tracked_themes'] == 3
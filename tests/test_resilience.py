@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import app
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker._opened_at = time.monotonic() - breaker.open_seconds - 1
+
+
+def test_circuit_breaker_opens_and_allows_one_probe():
+    breaker = app.CircuitBreaker(failure_threshold=2, open_seconds=60)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(app.LLMUnavailable):
+        breaker.allow()
+
+    breaker._opened_at = time.monotonic() - 61
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    with pytest.raises(app.LLMUnavailable):
+        breaker.allow()  # A sonda já está em curso.
+
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.allow()
+
+
+def test_stream_ai_list_releases_probe_when_client_disconnects(monkeypatch):
+    breaker = app.CircuitBreaker(failure_threshold=1, open_seconds=60)
+    monkeypatch.setattr(app, 'llm_breaker', breaker)
+    open_breaker(breaker)
+
+    stream = app.stream_ai_list(app._themes_prompt(f'desconexão {time.time()}'))
+    next(stream)
+    assert breaker._probing
+    stream.close()  # O cliente SSE foi embora no meio da lista.
+
+    assert not breaker._probing
+    breaker.allow()  # Outra chamada pode sondar.
+
+
+def test_stream_ai_list_records_success_at_the_end(monkeypatch):
+    breaker = app.CircuitBreaker(failure_threshold=1, open_seconds=60)
+    monkeypatch.setattr(app, 'llm_breaker', breaker)
+    open_breaker(breaker)
+
+    items = list(app.stream_ai_list(app._themes_prompt(f'sucesso {time.time()}')))
+
+    assert items
+    assert breaker.state == 'closed'
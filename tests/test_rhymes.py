@@ -0,0 +1,65 @@
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize('a, b', [('você', 'bebê'), ('coração', 'mão'), ('amor', 'calor'), ('bola', 'escola')])
+def test_rhyme_key_matches_rhyming_pairs(a, b):
+    assert app.ptbr_rhyme_key(a) == app.ptbr_rhyme_key(b)
+
+
+def test_rhyme_key_tells_open_and_closed_vowels_apart():
+    assert app.ptbr_rhyme_key('avó') != app.ptbr_rhyme_key('avô')
+
+
+def test_function_words_are_not_suggested_as_rhymes():
+    rhymes, known = app.find_local_rhymes('você', limit=50)
+    assert known
+    assert 'bebê' in rhymes
+    assert not {'que', 'de', 'e', 'se', 'me', 'te', 'lhe'} & set(rhymes)
+    assert 'por' not in app.find_local_rhymes('amor', limit=50)[0]
+
+
+@pytest.mark.parametrize('word', ['pistola', 'droga', 'morto'])
+def test_blocklisted_words_are_not_indexed(word):
+    lex = app.lexicon.ensure_loaded()
+    assert word in lex.words
+    entries = lex.rhyme_index.get(app.ptbr_rhyme_key(lex.pronunciation(word)), ())
+    assert entries  # A chave existe (há outras rimas), só a palavra ficou de fora.
+    assert word not in {candidate for _, candidate in entries}
+
+
+def test_find_rhymes_route_uses_the_local_lexicon():
+    client = app.app.test_client()
+    response = client.post('/api/find-rhymes', json={'word': 'você', 'definitions': False})
+    assert response.status_code == 200
+    words = [r['palavra'] for r in response.get_json()['rhymes']]
+    assert 'bebê' in words and 'que' not in words
+    assert client.post('/api/find-rhymes', json={}).status_code == 400
+
+
+@pytest.mark.parametrize('word, key', [('táxi', 'aksi'), ('fixo', 'iksu'), ('caixa', 'ajSa'),
+                                       ('taxa', 'aSa'), ('próximo', 'Osimu')])
+def test_x_sound_follows_the_exceptions(word, key):
+    assert app.ptbr_rhyme_key(word) == key
+
+
+def test_lexicon_has_no_european_portuguese_forms():
+    words = app.lexicon.ensure_loaded().words
+    assert not {'bebé', 'carrinha', 'telemóvel', 'equipa', 'autocarro'} & set(words)
+    assert 'bebê' in words
+
+
+def test_find_rhymes_route_does_not_wait_for_definitions(monkeypatch):
+    waited = []
+    monkeypatch.setattr(app, '_rhyme_definitions', lambda words: waited.append(words) or {})
+    monkeypatch.setattr(app, 'SPECULATIVE_ENABLED', False)
+    client = app.app.test_client()
+
+    response = client.post('/api/find-rhymes', json={'word': 'janela'})
+    assert response.status_code == 200
+    assert all(r['definicao'] == '' for r in response.get_json()['rhymes'])
+    assert waited == []
+
+    client.post('/api/find-rhymes', json={'word': 'janela', 'definitions': True})
+    assert len(waited) == 1
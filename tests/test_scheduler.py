@@ -0,0 +1,66 @@
+import pytest
+
+import app
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = app.TokenBucket(60)  # 1 ficha por segundo.
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == 0
+
+
+def test_scheduler_grants_within_capacity_and_rejects_past_deadline():
+    scheduler = app.LLMScheduler(rpm=2, tpm=0, deadline=0.05, background_deadline=0.05, background_reserve=0)
+    scheduler.acquire(10, 'turma-a', 'interactive')
+    scheduler.acquire(10, 'turma-a', 'interactive')
+    with pytest.raises(app.LLMRateLimited) as info:
+        scheduler.acquire(10, 'turma-a', 'interactive')
+    assert info.value.retry_after >= 1
+    assert scheduler.stats['granted_interactive'] == 2
+    assert scheduler.stats['rejected_interactive'] == 1
+
+
+def test_background_leaves_the_reserve_free():
+    scheduler = app.LLMScheduler(rpm=10, tpm=0, deadline=0.05, background_deadline=0.05, background_reserve=0.5)
+    for _ in range(5):
+        scheduler.acquire(1, 'background', 'background')
+    with pytest.raises(app.LLMRateLimited):
+        scheduler.acquire(1, 'background', 'background')
+    scheduler.acquire(1, 'turma-a', 'interactive')
+
+
+def test_penalize_blocks_every_caller():
+    scheduler = app.LLMScheduler(rpm=0, tpm=0, deadline=0.05, background_deadline=0.05, background_reserve=0)
+    scheduler.penalize(5)
+    with pytest.raises(app.LLMRateLimited):
+        scheduler.acquire(1, 'turma-a', 'interactive')
+
+
+def test_limits_are_split_between_workers(monkeypatch):
+    monkeypatch.setattr(app, 'LLM_SCHEDULER_PROCESSES', 4)
+    assert app._per_process_limit(600) == 150
+    assert app._per_process_limit(2) == 1
+    assert app._per_process_limit(0) == 0
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class HttpError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize('error, expected', [
+    (ResourceExhausted('quota'), True),
+    (HttpError('too many requests', 429), True),
+    (HttpError('internal', 500), False),
+    (ValueError('o aluno escreveu 429 no poema'), False),
+])
+def test_is_quota_error_uses_type_or_status(error, expected):
+    assert app.is_quota_error(error) is expected
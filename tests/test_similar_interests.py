@@ -0,0 +1,28 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def similar(tmp_path):
+    def make():
+        return app.SimilarInterestCache(str(tmp_path / 'similar.sqlite3'), threshold=0.6, max_entries=100, ttl=3600,
+                                        bands=16, rows=3, sync_interval=0)
+    return make
+
+
+def test_similar_interest_hits_on_reworded_interest(similar):
+    cache = similar()
+    themes = [f'tema {i}' for i in range(9)]
+    cache.add('Futebol e videogame', themes)
+
+    found = cache.get('videogames e futebol!!')
+    assert sorted(found) == sorted(themes)
+    assert cache.get('culinária japonesa') is None
+    assert cache.stats['hit'] == 1 and cache.stats['miss'] == 1
+
+
+def test_similar_interest_is_shared_between_workers(similar):
+    similar().add('dinossauros e vulcões', ['tema'])
+    other = similar()  # Outro worker: começa vazio e puxa do SQLite.
+    assert other.get('vulcão e dinossauro') == ['tema']
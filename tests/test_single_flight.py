@@ -0,0 +1,60 @@
+import threading
+import time
+
+import app
+
+
+def test_do_collapses_concurrent_calls(tmp_path):
+    flight = app.SingleFlight(str(tmp_path), lock_timeout=5)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'resultado'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in [leader, *followers]:
+        t.join(5)
+
+    assert calls == [1]
+    assert results == ['resultado'] * 4
+    assert flight.stats['collapsed'] == 3
+
+
+def test_file_lock_is_exclusive_while_holders_unlink_it(tmp_path):
+    # Cada thread abre o próprio descritor, como workers diferentes: o flock
+    # conflita entre eles. Quem solta apaga o arquivo; ninguém pode acabar
+    # travando um inode órfão enquanto outro trava o arquivo novo.
+    flight = app.SingleFlight(str(tmp_path), lock_timeout=10)
+    inside = []
+    overlaps = []
+
+    def worker():
+        for _ in range(200):
+            with flight.process_lock('chave'):
+                inside.append(1)
+                if len(inside) > 1:
+                    overlaps.append(1)
+                time.sleep(0.0005)
+                inside.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+
+    assert overlaps == []
+    assert not list(tmp_path.iterdir())  # O último a sair apagou a trava.
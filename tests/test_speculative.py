@@ -0,0 +1,31 @@
+import threading
+import time
+
+import app
+
+
+def test_take_stops_waiting_for_a_slow_speculation():
+    cache = app.SpeculativeCache(workers=1, max_queued=4, ttl=60, max_llm_load=1.0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return ['ideia']
+
+    cache.schedule([('k', slow)])
+    assert started.wait(2)
+
+    t0 = time.monotonic()
+    assert cache.take('k', timeout=0.1) is None
+    assert time.monotonic() - t0 < 1
+    assert cache.snapshot()['join_timeouts'] == 1
+
+    release.set()
+    assert cache.take('k', timeout=2) == ['ideia']
+
+
+def test_join_timeout_never_exceeds_the_interactive_deadline(monkeypatch):
+    monkeypatch.setattr(app, 'SPECULATIVE_JOIN_TIMEOUT', 60)
+    assert app._speculative_join_timeout('ideas') == app.LLM_TIMEOUTS['ideas']
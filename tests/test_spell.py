@@ -0,0 +1,49 @@
+import pytest
+
+import app
+
+
+@pytest.fixture(scope='module')
+def index():
+    return app.spell_index.ensure_loaded()
+
+
+@pytest.mark.parametrize('word', ['amigoss', 'gatoss', 'meninoss', 'bolass', 'casamente'])
+def test_wrong_inflections_are_unknown(index, word):
+    assert not index.is_known(word)
+
+
+@pytest.mark.parametrize('word', ['goiabas', 'pulávamos', 'sapinho', 'caderninho', 'preguiçosamente'])
+def test_inflections_of_lexicon_words_are_known(index, word):
+    assert word not in app.lexicon.words  # Só a regra de terminação explica o acerto.
+    assert index.is_known(word)
+
+
+def test_local_spell_check_suggests_accent(index):
+    errors, unresolved = app.local_spell_check(['O coracao bateu forte'])
+
+    assert [e['original'] for e in errors] == ['coracao']
+    assert 'coração' in errors[0]['suggestions']
+    assert unresolved == []
+
+
+def test_check_poem_route_flags_a_missing_accent():
+    response = app.app.test_client().post('/api/check-poem', json={'text': 'Meu coracao bate forte'})
+    assert response.status_code == 200
+    errors = response.get_json()['errors']
+    assert [(e['original'], e['verse_number']) for e in errors] == [('coracao', 1)]
+
+
+@pytest.mark.parametrize('word', ['musicas', 'arvores', 'voces'])
+def test_dropped_accents_are_reported(index, word):
+    errors, unresolved = app.local_spell_check([f'Entre {word} e versos'])
+
+    assert [e['original'] for e in errors] == [word]
+    assert errors[0]['reason'].startswith('Atenção ao acento')
+    assert word not in errors[0]['suggestions']
+    assert unresolved == []
+
+
+@pytest.mark.parametrize('word', ['facas', 'pratica', 'esta', 'mãezinha', 'rapidamente'])
+def test_legit_spellings_near_accented_words_are_known(index, word):
+    assert index.is_known(word)
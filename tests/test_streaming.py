@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def sse_events(body):
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_json_array_stream_emits_items_as_they_close():
+    stream = app.JsonArrayStream()
+    assert stream.feed('```json\n["O sol", "A lu') == ["O sol"]
+    assert stream.feed('a, \\"cheia\\"", {"k": [1, ') == ['A lua, "cheia"']
+    assert stream.feed('2]}, nada]') == [{"k": [1, 2]}]
+    assert stream.closed
+    assert stream.invalid == 1  # 'nada' não é JSON.
+
+
+def test_json_array_stream_ignores_text_after_the_list():
+    stream = app.JsonArrayStream()
+    assert stream.feed('[1, 2] e mais [3]') == [1, 2]
+    assert stream.feed(', 4]') == []
+
+
+def test_ideas_stream_sends_items_then_done(client):
+    response = client.post('/api/get-ideas/stream', json={'theme': 'A chuva no telhado de zinco'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = sse_events(response.data)
+    assert [kind for kind, _ in events] == ['item'] * 5 + ['done']
+
+
+def test_stream_joins_a_call_already_in_flight():
+    key = app.AIResponseCache.make_key('prompt em voo', app.MODEL_NAME, True)
+    future, leader = app.single_flight.enter(key)
+    assert leader
+    items = []
+    follower = threading.Thread(target=lambda: items.extend(app.stream_ai_list('prompt em voo')))
+    follower.start()
+    time.sleep(0.1)
+    future.set_result(['verso 1', 'verso 2'])
+    app.single_flight.leave(key, future)
+    follower.join(5)
+
+    assert items == ['verso 1', 'verso 2']
+
+
+def test_abandoned_stream_lets_waiting_callers_retry():
+    prompt = app._ideas_prompt('Pipas no céu de agosto')
+    key = app.AIResponseCache.make_key(prompt, app.MODEL_NAME, True)
+    stream = app.stream_ai_list(prompt)
+    next(stream)  # O stream vira líder da chamada.
+    follower_future, follower_leads = app.single_flight.enter(key)
+    assert not follower_leads
+    stream.close()  # Cliente desconectou no meio.
+
+    with pytest.raises(app.FlightAbandoned):
+        follower_future.result(timeout=1)
+    assert app.single_flight.snapshot()['in_flight'] == 0
@@ -0,0 +1,47 @@
+import pytest
+
+import app
+
+
+def test_interest_keywords_normalize_accents_plural_and_stopwords():
+    assert app.interest_keywords('Eu gosto de Cachorros, Futebol e Animais!') == ['cachorro', 'futebol', 'animal']
+    assert app.interest_keywords('leões e  Pães') == ['leao', 'pao']
+    assert app.interest_keywords(None) == []
+
+
+@pytest.fixture
+def bank(tmp_path):
+    return app.ThemeBank(app.THEME_BANK_PATH, str(tmp_path / 'bank.sqlite3'), min_coverage=0.75, max_learned=12)
+
+
+def test_curated_topics_cover_common_interests(bank):
+    themes = bank.suggest('Futebol e videogames')
+    assert len(themes) == app.THEME_COUNT == len(set(themes))
+    curated = set(bank.topics['futebol']) | set(bank.topics['games'])
+    assert set(themes) <= curated
+
+
+def test_curated_topics_have_enough_themes(bank):
+    bank.ensure_loaded()
+    assert {topic: len(themes) for topic, themes in bank.topics.items() if len(themes) < app.THEME_COUNT} == {}
+
+
+def test_uncovered_interest_misses_until_learned(bank):
+    assert bank.suggest('origami e xadrez') is None
+    themes = [f'A dobra número {i} do origami' for i in range(5)] + [f'O peão {i} do xadrez' for i in range(5)]
+    assert bank.learn('origami e xadrez', themes + ['Um tema com droga no meio', 42]) == 10
+
+    suggested = bank.suggest('xadrez e origami')
+    assert len(suggested) == app.THEME_COUNT and set(suggested) <= set(themes)
+
+
+def test_fallback_always_has_themes(bank):
+    assert len(bank.fallback('astrofísica quântica')) == app.THEME_COUNT
+
+
+def test_generate_themes_route_serves_the_curated_bank():
+    response = app.app.test_client().post('/api/generate-themes', json={'interest': 'futebol'})
+    assert response.status_code == 200
+    themes = response.get_json()['themes']
+    assert len(themes) == app.THEME_COUNT
+    assert set(themes) <= set(app.theme_bank.topics['futebol'])